@@ -0,0 +1,134 @@
+"""
+Throughput of the custom_format parser against the previous implementation
+(kept below as legacy_deserialize_custom / legacy_split_items), and of the
+binary encoding from custom_binary for the same snapshots.
+
+    python bench_custom_format.py [--products 2000] [--rounds 5]
+"""
+import argparse
+import time
+
+from custom_format import custom_serialize, deserialize_custom
+from custom_binary import custom_serialize_binary, deserialize_custom_binary
+
+
+def legacy_deserialize_custom(serialized):
+    if serialized.startswith("Dict{"):
+        data = {}
+        serialized = serialized[5:-1]
+        items = legacy_split_items(serialized, "; ")
+        i = 0
+        while i < len(items) - 1:
+            if items[i].startswith("Key-> ") and items[i + 1].startswith("Value-> "):
+                key = legacy_deserialize_custom(items[i].split("Key-> ", 1)[1])
+                value = legacy_deserialize_custom(items[i + 1].split("Value-> ", 1)[1])
+                data[key] = value
+                i += 2
+            else:
+                i += 1
+        return data
+    elif serialized.startswith("List["):
+        data = []
+        serialized = serialized[5:-1]
+        items = legacy_split_items(serialized, "; ")
+        for item in items:
+            if item:
+                data.append(legacy_deserialize_custom(item))
+        return data
+    else:
+        if serialized.startswith("int("):
+            return int(serialized[4:-1])
+        elif serialized.startswith("float("):
+            return float(serialized[6:-1])
+        elif serialized.startswith("str("):
+            return serialized[4:-1]
+        elif serialized.startswith("Unknown("):
+            return serialized[8:-1]
+        else:
+            raise ValueError(f"Unknown type in serialized data: {serialized}")
+
+
+def legacy_split_items(serialized, delimiter):
+    items = []
+    current = ""
+    bracket_level = 0
+
+    for char in serialized:
+        if char == '{' or char == '[':
+            bracket_level += 1
+        elif char == '}' or char == ']':
+            bracket_level -= 1
+
+        if char == delimiter[0] and bracket_level == 0:
+            items.append(current.strip())
+            current = ""
+        else:
+            current += char
+
+    if current:
+        items.append(current.strip())
+
+    return items
+
+
+def make_snapshot(count):
+    # Same shape as the scraper output; names are kept free of `;{[]}` so the
+    # legacy parser can still read them
+    products = [{
+        'name': f"Smartphone Samsung Galaxy S{i % 30}, 12GB/256GB, Onyx Black",
+        'url': f"https://ultra.md/product/s{i}-12256gb-black",
+        'price_mdl': 10000 + i,
+        'display_size': "3088x1440",
+        'price_eur': round((10000 + i) / 19.5, 2),
+    } for i in range(count)]
+    return {
+        'filtered_products': products,
+        'total_sum_eur': round(sum(p['price_eur'] for p in products), 2),
+        'timestamp_utc': "2024-12-12T10:00:00+00:00",
+    }
+
+
+def throughput(parse, text, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        parse(text)
+    elapsed = (time.perf_counter() - start) / rounds
+    return elapsed, len(text) / elapsed / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    parsers = [
+        ('legacy', legacy_deserialize_custom),
+        ('recursive', deserialize_custom),
+        ('iterative', lambda text: deserialize_custom(text, iterative=True)),
+    ]
+
+    print(f"{'payload':<28} {'parser':<10} {'KiB':>8} {'ms':>10} {'MB/s':>8}")
+    for products in (args.products // 10, args.products):
+        snapshot = make_snapshot(products)
+        text = custom_serialize(snapshot)
+        label = f'{products} products'
+        for name, parse in parsers:
+            elapsed, mb_per_s = throughput(parse, text, args.rounds)
+            print(f"{label:<28} {name:<10} {len(text) // 1024:>8} {elapsed * 1000:>10.1f} {mb_per_s:>8.2f}")
+        for name, intern_keys in (('binary', False), ('interned', True)):
+            encoded = custom_serialize_binary(snapshot, intern_keys=intern_keys)
+            if deserialize_custom_binary(encoded) != snapshot:
+                raise SystemExit(f"{name}: binary round trip failed")
+            elapsed, mb_per_s = throughput(deserialize_custom_binary, encoded, args.rounds)
+            print(f"{label:<28} {name:<10} {len(encoded) // 1024:>8} {elapsed * 1000:>10.1f} {mb_per_s:>8.2f}")
+
+    # Nesting deeper than the recursion limit only works with the iterative parser
+    depth = 100000
+    text = "List[" * depth + "int(1)" + "]" * depth
+    elapsed, mb_per_s = throughput(lambda t: deserialize_custom(t, iterative=True), text, 1)
+    print(f"{f'nesting depth {depth}':<28} {'iterative':<10} {len(text) // 1024:>8} {elapsed * 1000:>10.1f} {mb_per_s:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+import struct
+
+# Compact binary form of the custom_serialize type model.
+#
+#   document := MAGIC strings-table value
+#   strings-table := varint(count) (varint(len) utf-8 bytes)*
+#   value := 'D' varint(count) (value value)*   dict, key then value
+#          | 'L' varint(count) value*           list
+#          | 'i' zigzag varint                  int of any size
+#          | 'f' 8 bytes little-endian double   float
+#          | 'T' | 'F'                          bool
+#          | 's' varint(len) utf-8 bytes        str
+#          | 'r' varint(index)                  str from the strings table
+#          | 'u' varint(len) utf-8 bytes        Unknown, repr() of the object
+#
+# With intern_keys=True every dict key that is a string is written once in the
+# strings table and referenced by index afterwards, which removes most of the
+# size of a product list ('name', 'url', 'price_mdl', ... repeated per product).
+
+MAGIC = b'CB\x01'
+DOUBLE = struct.Struct('<d')
+
+
+def _write_varint(out, value):
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _write_bytes(out, tag, data):
+    out.append(tag)
+    _write_varint(out, len(data))
+    out += data
+
+
+def custom_serialize_binary(data, intern_keys=False):
+    table = {}
+    body = bytearray()
+
+    def write(value):
+        if isinstance(value, dict):
+            body.append(0x44)  # 'D'
+            _write_varint(body, len(value))
+            for key, item in value.items():
+                if intern_keys and type(key) is str:
+                    index = table.setdefault(key, len(table))
+                    body.append(0x72)  # 'r'
+                    _write_varint(body, index)
+                else:
+                    write(key)
+                write(item)
+        elif isinstance(value, list):
+            body.append(0x4c)  # 'L'
+            _write_varint(body, len(value))
+            for item in value:
+                write(item)
+        elif isinstance(value, bool):
+            body.append(0x54 if value else 0x46)  # 'T' / 'F'
+        elif isinstance(value, int):
+            body.append(0x69)  # 'i'
+            _write_varint(body, value << 1 if value >= 0 else ((-value) << 1) - 1)
+        elif isinstance(value, float):
+            body.append(0x66)  # 'f'
+            body.extend(DOUBLE.pack(value))
+        elif isinstance(value, str):
+            _write_bytes(body, 0x73, value.encode('utf-8'))  # 's'
+        else:
+            _write_bytes(body, 0x75, repr(value).encode('utf-8'))  # 'u'
+
+    write(data)
+
+    out = bytearray(MAGIC)
+    _write_varint(out, len(table))
+    for key in table:  # dicts keep insertion order, which is the index order
+        encoded = key.encode('utf-8')
+        _write_varint(out, len(encoded))
+        out += encoded
+    out += body
+    return bytes(out)
+
+
+def deserialize_custom_binary(buffer):
+    """
+    Decodes a document produced by custom_serialize_binary. The input is read
+    through a memoryview, so bytes, bytearray, mmap or a slice of a larger
+    buffer are decoded in place; only the resulting Python objects are created.
+    """
+    view = memoryview(buffer)
+    if view.ndim != 1 or view.itemsize != 1:
+        view = view.cast('B')
+    if bytes(view[:len(MAGIC)]) != MAGIC:
+        raise ValueError("Not a custom binary document")
+    pos = len(MAGIC)
+    size = len(view)
+
+    def read_varint():
+        nonlocal pos
+        result = 0
+        shift = 0
+        while True:
+            if pos >= size:
+                raise ValueError("Truncated varint")
+            byte = view[pos]
+            pos += 1
+            result |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return result
+            shift += 7
+
+    def read_text():
+        nonlocal pos
+        length = read_varint()
+        end = pos + length
+        if end > size:
+            raise ValueError("Truncated string")
+        text = str(view[pos:end], 'utf-8')
+        pos = end
+        return text
+
+    table = [read_text() for _ in range(read_varint())]
+
+    def read():
+        nonlocal pos
+        if pos >= size:
+            raise ValueError("Truncated document")
+        tag = view[pos]
+        pos += 1
+        if tag == 0x44:  # 'D'
+            data = {}
+            for _ in range(read_varint()):
+                key = read()
+                data[key] = read()
+            return data
+        if tag == 0x4c:  # 'L'
+            return [read() for _ in range(read_varint())]
+        if tag == 0x69:  # 'i'
+            value = read_varint()
+            return value >> 1 if not value & 1 else -((value + 1) >> 1)
+        if tag == 0x66:  # 'f'
+            if pos + 8 > size:
+                raise ValueError("Truncated float")
+            value = DOUBLE.unpack_from(view, pos)[0]
+            pos += 8
+            return value
+        if tag == 0x72:  # 'r'
+            index = read_varint()
+            if index >= len(table):
+                raise ValueError(f"Unknown string reference {index}")
+            return table[index]
+        if tag == 0x73 or tag == 0x75:  # 's' / 'u'
+            return read_text()
+        if tag == 0x54:
+            return True
+        if tag == 0x46:
+            return False
+        raise ValueError(f"Unknown type tag {tag:#x} at position {pos - 1}")
+
+    value = read()
+    if pos != size:
+        raise ValueError(f"Unexpected data at position {pos}")
+    return value
@@ -0,0 +1,236 @@
+import ast
+
+# The text format produced by custom_serialize:
+#   Dict{Key-> <value>; Value-> <value>; Key-> ...}
+#   List[<value>; <value>; ...]
+#   int(42)  float(4.2)  bool(True)  str('text')  Unknown(<repr>)
+# Strings are written with repr(), so quotes and backslashes inside them are
+# escaped and `;`, `{` or `]` in a string never confuse the parser.
+
+WHITESPACE = ' \t\r\n'
+NO_KEY = object()
+
+
+def custom_serialize(data):
+    parts = []
+    _serialize_into(data, parts)
+    return ''.join(parts)
+
+
+def _serialize_into(data, parts):
+    # Keeps its own stack like _parse_iterative, so any nesting depth the
+    # parser accepts can be written. Entries are (is_text, item): text is
+    # appended as is, anything else is a value still to serialize.
+    stack = [(False, data)]
+    while stack:
+        is_text, item = stack.pop()
+        if is_text:
+            parts.append(item)
+        elif isinstance(item, dict):
+            pending = [(True, "Dict{")]
+            for key, value in item.items():
+                if len(pending) > 1:
+                    pending.append((True, "; "))
+                pending += [(True, "Key-> "), (False, key), (True, "; Value-> "), (False, value)]
+            pending.append((True, "}"))
+            stack.extend(reversed(pending))
+        elif isinstance(item, list):
+            pending = [(True, "List[")]
+            for value in item:
+                if len(pending) > 1:
+                    pending.append((True, "; "))
+                pending.append((False, value))
+            pending.append((True, "]"))
+            stack.extend(reversed(pending))
+        elif isinstance(item, (int, float, str)):
+            parts.append(f"{type(item).__name__}({item!r})")
+        else:
+            parts.append(f"Unknown({item!r})")
+
+
+def deserialize_custom(serialized, iterative=False):
+    """
+    Single pass parser for the custom_serialize format. The default recursive
+    descent parser is limited by the Python recursion limit; iterative=True
+    keeps its own stack and handles any nesting depth.
+    """
+    parse = _parse_iterative if iterative else _parse_value
+    value, pos = parse(serialized, 0)
+    pos = _skip_whitespace(serialized, pos)
+    if pos != len(serialized):
+        raise ValueError(f"Unexpected data at position {pos}: {serialized[pos:pos + 20]!r}")
+    return value
+
+
+def _skip_whitespace(s, pos):
+    while pos < len(s) and s[pos] in WHITESPACE:
+        pos += 1
+    return pos
+
+
+def _expect(s, pos, token):
+    pos = _skip_whitespace(s, pos)
+    if not s.startswith(token, pos):
+        raise ValueError(f"Expected {token!r} at position {pos}: {s[pos:pos + 20]!r}")
+    return pos + len(token)
+
+
+def _find_closing_paren(s, pos):
+    # Position of the `)` closing a value that starts at pos, skipping
+    # parentheses nested in the repr and anything inside quotes
+    depth = 0
+    quote = None
+    while pos < len(s):
+        char = s[pos]
+        if quote:
+            if char == '\\':
+                pos += 1
+            elif char == quote:
+                quote = None
+        elif char in '\'"':
+            quote = char
+        elif char in '([{':
+            depth += 1
+        elif char in ')]}':
+            if depth == 0:
+                return pos
+            depth -= 1
+        pos += 1
+    raise ValueError("Unterminated value")
+
+
+def _parse_string(s, pos):
+    # pos is at the opening quote of a repr() string literal
+    quote = s[pos] if pos < len(s) else ''
+    if quote not in ('"', "'"):
+        raise ValueError(f"Expected a quoted string at position {pos}")
+    start = pos
+    pos += 1
+    while True:
+        end = s.find(quote, pos)
+        if end == -1:
+            raise ValueError(f"Unterminated string starting at position {start}")
+        # The quote is escaped when preceded by an odd number of backslashes
+        backslashes = 0
+        while s[end - 1 - backslashes] == '\\':
+            backslashes += 1
+        if backslashes % 2 == 0:
+            break
+        pos = end + 1
+    if s.find('\\', start, end) == -1:
+        return s[start + 1:end], end + 1
+    return ast.literal_eval(s[start:end + 1]), end + 1
+
+
+def _scalar_end(s, pos):
+    end = s.find(')', pos)
+    if end == -1:
+        raise ValueError(f"Unterminated value at position {pos}")
+    return end
+
+
+def _parse_scalar(s, pos):
+    if s.startswith("str(", pos):
+        value, pos = _parse_string(s, pos + 4)
+        return value, _expect(s, pos, ')')
+    if s.startswith("int(", pos):
+        end = _scalar_end(s, pos)
+        return int(s[pos + 4:end]), end + 1
+    if s.startswith("float(", pos):
+        end = _scalar_end(s, pos)
+        return float(s[pos + 6:end]), end + 1
+    if s.startswith("bool(", pos):
+        end = _scalar_end(s, pos)
+        return s[pos + 5:end] == 'True', end + 1
+    if s.startswith("Unknown(", pos):
+        end = _find_closing_paren(s, pos + 8)
+        return s[pos + 8:end], end + 1
+    raise ValueError(f"Unknown type in serialized data at position {pos}: {s[pos:pos + 20]!r}")
+
+
+def _parse_value(s, pos):
+    pos = _skip_whitespace(s, pos)
+    if s.startswith("Dict{", pos):
+        data = {}
+        pos = _skip_whitespace(s, pos + 5)
+        if s.startswith("}", pos):
+            return data, pos + 1
+        while True:
+            pos = _expect(s, pos, "Key->")
+            key, pos = _parse_value(s, pos)
+            pos = _expect(s, pos, ";")
+            pos = _expect(s, pos, "Value->")
+            data[key], pos = _parse_value(s, pos)
+            pos = _skip_whitespace(s, pos)
+            if s.startswith(";", pos):
+                pos += 1
+            elif s.startswith("}", pos):
+                return data, pos + 1
+            else:
+                raise ValueError(f"Expected ';' or '}}' at position {pos}")
+    if s.startswith("List[", pos):
+        data = []
+        pos = _skip_whitespace(s, pos + 5)
+        if s.startswith("]", pos):
+            return data, pos + 1
+        while True:
+            item, pos = _parse_value(s, pos)
+            data.append(item)
+            pos = _skip_whitespace(s, pos)
+            if s.startswith(";", pos):
+                pos += 1
+            elif s.startswith("]", pos):
+                return data, pos + 1
+            else:
+                raise ValueError(f"Expected ';' or ']' at position {pos}")
+    return _parse_scalar(s, pos)
+
+
+def _parse_iterative(s, pos):
+    # Every open container is a [container, pending_key] frame; pending_key is
+    # the key read for a dict whose value has not been parsed yet
+    stack = []
+    while True:
+        pos = _skip_whitespace(s, pos)
+        if stack and isinstance(stack[-1][0], dict):
+            pos = _expect(s, pos, "Key->" if stack[-1][1] is NO_KEY else "Value->")
+            pos = _skip_whitespace(s, pos)
+
+        if s.startswith("Dict{", pos) or s.startswith("List[", pos):
+            container = {} if s[pos] == 'D' else []
+            closing = '}' if s[pos] == 'D' else ']'
+            pos = _skip_whitespace(s, pos + 5)
+            if not s.startswith(closing, pos):
+                stack.append([container, NO_KEY])
+                continue
+            value = container
+            pos += 1
+        else:
+            value, pos = _parse_scalar(s, pos)
+
+        # Attach the finished value to its parent, closing every container
+        # that ends right after it
+        while True:
+            if not stack:
+                return value, pos
+            frame = stack[-1]
+            container = frame[0]
+            if isinstance(container, dict):
+                if frame[1] is NO_KEY:
+                    frame[1] = value
+                    pos = _expect(s, pos, ";")
+                    break
+                container[frame[1]] = value
+                frame[1] = NO_KEY
+                closing = '}'
+            else:
+                container.append(value)
+                closing = ']'
+            pos = _skip_whitespace(s, pos)
+            if s.startswith(";", pos):
+                pos += 1
+                break
+            if not s.startswith(closing, pos):
+                raise ValueError(f"Expected ';' or {closing!r} at position {pos}")
+            pos += 1
+            value = stack.pop()[0]
@@ -0,0 +1,192 @@
+import socket
+import ssl
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3"
+
+MAX_HEADER_LINE = 65536
+
+
+class HTTPResponse:
+    def __init__(self, status, reason, headers, body):
+        self.status = status
+        self.reason = reason
+        self.headers = headers  # header names are lower-cased
+        self.body = body
+
+    def header(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+    @property
+    def text(self):
+        return self.body.decode('utf-8', errors='replace')
+
+
+class HTTPConnection:
+    """
+    A single HTTP/1.1 connection that can carry many requests (keep-alive).
+    Responses are framed by Content-Length or chunked transfer-encoding,
+    so the socket does not have to be closed to find the end of a body.
+    """
+
+    def __init__(self, host, port, use_https=False, ssl_context=None, tls_session=None, timeout=10):
+        self.host = host
+        self.port = port
+        self.use_https = use_https
+        self.timeout = timeout
+        self.requests_sent = 0
+        self.session_reused = False
+
+        sock = socket.create_connection((host, port), timeout=timeout)
+        if use_https:
+            # Passing the previous session lets the server resume it instead of
+            # doing a full handshake
+            sock = ssl_context.wrap_socket(sock, server_hostname=host, session=tls_session)
+            self.session_reused = sock.session_reused
+        self.sock = sock
+        self.reader = sock.makefile('rb')
+
+    @property
+    def tls_session(self):
+        return self.sock.session if self.use_https else None
+
+    def request(self, method, path, headers=None):
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}", f"User-Agent: {USER_AGENT}",
+                 "Connection: keep-alive"]
+        for name, value in (headers or {}).items():
+            lines.append(f"{name}: {value}")
+        self.sock.sendall(("\r\n".join(lines) + "\r\n\r\n").encode('utf-8'))
+        self.requests_sent += 1
+        return self.read_response(method)
+
+    def read_response(self, method):
+        status_line = self.reader.readline(MAX_HEADER_LINE)
+        if not status_line:
+            raise ConnectionError("Connection closed by server")
+        parts = status_line.decode('iso-8859-1').rstrip("\r\n").split(" ", 2)
+        status = int(parts[1])
+        reason = parts[2] if len(parts) > 2 else ""
+
+        headers = {}
+        while True:
+            line = self.reader.readline(MAX_HEADER_LINE)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode('iso-8859-1').partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+            body = b""
+        elif "chunked" in headers.get("transfer-encoding", "").lower():
+            body = self.read_chunked()
+        elif "content-length" in headers:
+            body = self.read_exact(int(headers["content-length"]))
+        else:
+            # No framing information: the body ends when the server closes
+            body = self.reader.read()
+            headers["connection"] = "close"
+
+        return HTTPResponse(status, reason, headers, body)
+
+    def read_exact(self, size):
+        data = self.reader.read(size)
+        if len(data) != size:
+            raise ConnectionError("Connection closed before the end of the body")
+        return data
+
+    def read_chunked(self):
+        chunks = []
+        while True:
+            size_line = self.reader.readline(MAX_HEADER_LINE)
+            if not size_line:
+                raise ConnectionError("Connection closed inside a chunked body")
+            size = int(size_line.split(b";", 1)[0].strip(), 16)
+            if size == 0:
+                break
+            chunks.append(self.read_exact(size))
+            self.read_exact(2)  # CRLF after every chunk
+        # Skip optional trailer headers
+        while True:
+            line = self.reader.readline(MAX_HEADER_LINE)
+            if line in (b"\r\n", b"\n", b""):
+                break
+        return b"".join(chunks)
+
+    def close(self):
+        try:
+            self.reader.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class ConnectionPool:
+    """
+    Keeps idle keep-alive connections per (host, port, scheme) and remembers the
+    last TLS session of every host so new connections can resume it.
+    """
+
+    def __init__(self, max_idle_per_host=4, timeout=10):
+        self.max_idle_per_host = max_idle_per_host
+        self.timeout = timeout
+        self.ssl_context = ssl.create_default_context()
+        self.idle = {}
+        self.tls_sessions = {}
+
+        # Counters to check how much the pool actually saves
+        self.requests = 0
+        self.handshakes = 0
+        self.resumed_handshakes = 0
+
+    def get_connection(self, host, port, use_https):
+        key = (host, port, use_https)
+        idle = self.idle.get(key)
+        if idle:
+            return idle.pop(), True
+
+        conn = HTTPConnection(host, port, use_https=use_https, ssl_context=self.ssl_context,
+                              tls_session=self.tls_sessions.get(host), timeout=self.timeout)
+        self.handshakes += 1
+        if conn.session_reused:
+            self.resumed_handshakes += 1
+        return conn, False
+
+    def release(self, conn, response):
+        if conn.use_https and conn.tls_session is not None:
+            self.tls_sessions[conn.host] = conn.tls_session
+
+        if response.header("connection", "").lower() == "close":
+            conn.close()
+            return
+        idle = self.idle.setdefault((conn.host, conn.port, conn.use_https), [])
+        if len(idle) >= self.max_idle_per_host:
+            conn.close()
+        else:
+            idle.append(conn)
+
+    def request(self, host, port, path, use_https=False, method="GET", headers=None):
+        self.requests += 1
+        conn, reused = self.get_connection(host, port, use_https)
+        try:
+            response = conn.request(method, path, headers)
+        except (ConnectionError, OSError, ValueError):
+            conn.close()
+            if not reused:
+                raise
+            # The server closed an idle connection, the others are probably
+            # stale too; retry once on a fresh one
+            for stale in self.idle.pop((host, port, use_https), []):
+                stale.close()
+            conn, _ = self.get_connection(host, port, use_https)
+            try:
+                response = conn.request(method, path, headers)
+            except Exception:
+                conn.close()
+                raise
+        self.release(conn, response)
+        return response
+
+    def close(self):
+        for connections in self.idle.values():
+            for conn in connections:
+                conn.close()
+        self.idle.clear()
@@ -0,0 +1,101 @@
+import json
+import math
+import re
+from json.encoder import encode_basestring
+from xml.sax.saxutils import escape
+
+# Characters that are not allowed anywhere in an XML 1.0 document
+XML_INVALID_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+PRODUCT_FIELDS = [
+    ('name', "N/A"),
+    ('url', "N/A"),
+    ('price_mdl', 0),
+    ('display_size', "N/A"),
+    ('price_eur', 0.0),
+]
+
+WRITE_BUFFER_SIZE = 64 * 1024
+
+
+def json_value(value):
+    # Fast paths for the types a product is made of; encode_basestring escapes
+    # quotes, backslashes and control characters
+    if isinstance(value, str):
+        return encode_basestring(value)
+    if type(value) is int or (type(value) is float and math.isfinite(value)):
+        return repr(value)
+    return json.dumps(value, ensure_ascii=False)
+
+
+def xml_text(value):
+    return escape(XML_INVALID_CHARS.sub('', str(value)))
+
+
+def iter_json(data):
+    """
+    Yields the JSON document piece by piece, one product at a time, so
+    `filtered_products` can be any iterable (even a generator) and the whole
+    document never has to exist in memory.
+    """
+    yield '{"filtered_products": ['
+    first = True
+    for product in data['filtered_products']:
+        if not product:
+            continue
+        fields = ', '.join(f'"{field}": {json_value(product.get(field, default))}'
+                           for field, default in PRODUCT_FIELDS)
+        yield ('{' if first else ',{') + fields + '}'
+        first = False
+    yield '],'
+    yield f'"total_sum_eur": {json_value(data.get("total_sum_eur", 0.0))}, '
+    yield f'"timestamp_utc": {json_value(data.get("timestamp_utc", "N/A"))}'
+    yield '}'
+
+
+def iter_xml(data):
+    """
+    Same as iter_json, for the XML form. Text is escaped so names containing
+    `<` or `&` still produce a well-formed document.
+    """
+    yield '<data><filtered_products>'
+    for product in data['filtered_products']:
+        if not product:
+            continue
+        fields = ''.join(f'<{field}>{xml_text(product.get(field, default))}</{field}>'
+                         for field, default in PRODUCT_FIELDS)
+        yield f'<product>{fields}</product>'
+    yield '</filtered_products>'
+    yield f'<total_sum_eur>{xml_text(data.get("total_sum_eur", 0.0))}</total_sum_eur>'
+    yield f'<timestamp_utc>{xml_text(data.get("timestamp_utc", "N/A"))}</timestamp_utc>'
+    yield '</data>'
+
+
+def write_chunks(chunks, fp, buffer_size=WRITE_BUFFER_SIZE):
+    """
+    Writes the chunks to a text file-like object, grouping small chunks
+    into writes of about buffer_size characters.
+    """
+    buffer = []
+    buffered = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        buffered += len(chunk)
+        if buffered >= buffer_size:
+            fp.write(''.join(buffer))
+            buffer = []
+            buffered = 0
+    if buffer:
+        fp.write(''.join(buffer))
+
+
+def serialize_to_json(data, fp=None):
+    if fp is None:
+        return ''.join(iter_json(data))
+    write_chunks(iter_json(data), fp)
+
+
+def serialize_to_xml(data, fp=None):
+    if fp is None:
+        return ''.join(iter_xml(data))
+    write_chunks(iter_xml(data), fp)
@@ -1,35 +1,173 @@
 
 import socket
 import threading
+import base64
 import json
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from models import Product, Session
+from protocol import FrameError, decode_payload, read_frame_payload, send_frame
 import sqlalchemy.exc
+from sqlalchemy import insert
 
 HOST = '127.0.0.1'  # Localhost
 PORT = 65432  # Arbitrary non-privileged port
 
+# Requests from all connections run on a shared pool of workers. Each
+# connection may have at most MAX_IN_FLIGHT requests running; after that the
+# server stops reading from it, which pushes back on the client through TCP.
+REQUEST_WORKERS = 16
+MAX_IN_FLIGHT = 32
 
-def handle_client(conn, addr):
-    print(f"Connected by {addr}")
+# Streaming exports are paced by their reader, so they get a pool of their
+# own: slow exporters can only hold up other exports, not CRUD requests
+EXPORT_WORKERS = 8
+
+# Actions without side effects. Everything else (including unknown actions)
+# is ordered like a mutation.
+READ_ACTIONS = {'read', 'bulk_read', 'export'}
+
+# Page size of read without id or name, with or without a cursor
+READ_DEFAULT_LIMIT = 10
+READ_MAX_LIMIT = 100
+
+# Bulk actions look rows up with IN (...) queries of at most this many values
+BULK_CHUNK_SIZE = 500
+
+PRODUCT_FIELDS = ['name', 'url', 'price_mdl', 'display_size', 'price_eur']
+
+# Rows per frame sent by the streaming export action
+EXPORT_CHUNK_SIZE = 1000
+
+executor = ThreadPoolExecutor(max_workers=REQUEST_WORKERS)
+export_executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS)
+
+
+def submit_after(dependencies, pool, fn, *args):
+    """
+    Submits fn to pool once every future in dependencies is done, without
+    holding a worker while waiting. Returns a future of fn's result.
+    """
+    result = Future()
+    remaining = [len(dependencies) + 1]
+    lock = threading.Lock()
+
+    def copy_outcome(future):
+        if future.exception() is not None:
+            result.set_exception(future.exception())
+        else:
+            result.set_result(future.result())
+
+    def dependency_done(_=None):
+        with lock:
+            remaining[0] -= 1
+            ready = remaining[0] == 0
+        if ready:
+            pool.submit(fn, *args).add_done_callback(copy_outcome)
+
+    for dependency in dependencies:
+        dependency.add_done_callback(dependency_done)
+    dependency_done()
+    return result
+
+
+def run_request(request):
+    # Pipelined requests run concurrently, so every request gets its own session
+    session = Session()
+    try:
+        if not isinstance(request, dict):
+            return {"status": "error", "message": "Request must be a JSON object."}
+        return process_request(request, session)
+    except Exception as e:
+        session.rollback()
+        return {"status": "error", "message": str(e)}
+    finally:
+        session.close()
+
+
+def stream_request(request):
+    """
+    Generator version of run_request for actions that answer with several
+    frames: any number of {"status": "partial", ...} frames followed by one
+    final frame.
+    """
     session = Session()
     try:
-        with conn:
+        yield from STREAMING_ACTIONS[request['action']](request.get('data', {}), session)
+    except Exception as e:
+        session.rollback()
+        yield {"status": "error", "message": str(e)}
+    finally:
+        session.close()
+
+
+def is_streaming(request):
+    return isinstance(request, dict) and request.get('action') in STREAMING_ACTIONS
+
+
+def is_read(request):
+    return isinstance(request, dict) and request.get('action') in READ_ACTIONS
+
+
+def handle_client(conn, addr):
+    print(f"Connected by {addr}")
+    send_lock = threading.Lock()
+    in_flight = threading.BoundedSemaphore(MAX_IN_FLIGHT)
+    pending = set()
+    # Pipelined requests must not reorder effects: a mutation starts after
+    # every earlier request of the connection is done, and a read after every
+    # earlier mutation. Reads between two mutations still run concurrently.
+    last_mutation = None
+    reads_since_mutation = []
+
+    def respond(request_id, response):
+        response["id"] = request_id
+        try:
+            with send_lock:
+                send_frame(conn, response)
+            return True
+        except OSError:
+            return False  # client went away, nothing left to tell it
+
+    def run_and_respond(request):
+        try:
+            if is_streaming(request):
+                for response in stream_request(request):
+                    if not respond(request.get("id"), response):
+                        break
+            else:
+                respond(request.get("id") if isinstance(request, dict) else None, run_request(request))
+        finally:
+            in_flight.release()
+
+    with conn:
+        try:
             while True:
-                data = conn.recv(4096)
-                if not data:
+                payload = read_frame_payload(conn)
+                if payload is None:
                     break
                 try:
-                    request = json.loads(data.decode('utf-8'))
-                    response = process_request(request, session)
-                except json.JSONDecodeError:
-                    response = {"status": "error", "message": "Invalid JSON format."}
-                except Exception as e:
-                    response = {"status": "error", "message": str(e)}
-                # Send response
-                response_bytes = json.dumps(response).encode('utf-8')
-                conn.sendall(response_bytes)
-    finally:
-        session.close()
+                    request = decode_payload(payload)
+                except FrameError as e:
+                    respond(None, {"status": "error", "message": str(e)})
+                    continue
+                in_flight.acquire()
+                pool = export_executor if is_streaming(request) else executor
+                if is_read(request):
+                    dependencies = [last_mutation] if last_mutation else []
+                    future = submit_after(dependencies, pool, run_and_respond, request)
+                    reads_since_mutation = [read for read in reads_since_mutation if not read.done()]
+                    reads_since_mutation.append(future)
+                else:
+                    dependencies = reads_since_mutation + ([last_mutation] if last_mutation else [])
+                    future = submit_after(dependencies, pool, run_and_respond, request)
+                    last_mutation = future
+                    reads_since_mutation = []
+                pending.add(future)
+                future.add_done_callback(pending.discard)
+        except (FrameError, OSError) as e:
+            print(f"Closing connection to {addr}: {e}")
+        # Let the requests already received finish before the socket is closed
+        wait(list(pending))
     print(f"Disconnected by {addr}")
 
 
@@ -45,6 +183,14 @@ def process_request(request, session):
         return update_product(data, session)
     elif action == 'delete':
         return delete_product(data, session)
+    elif action == 'bulk_create':
+        return bulk_create_products(data, session)
+    elif action == 'bulk_read':
+        return bulk_read_products(data, session)
+    elif action == 'bulk_update':
+        return bulk_update_products(data, session)
+    elif action == 'bulk_delete':
+        return bulk_delete_products(data, session)
     else:
         return {"status": "error", "message": "Unknown action."}
 
@@ -95,17 +241,84 @@ def read_products(data, session):
     else:
         # Return all products with optional pagination
         offset = data.get('offset', 0)
-        limit = data.get('limit', 10)
+        limit = data.get('limit', READ_DEFAULT_LIMIT)
         try:
             offset = int(offset)
-            limit = int(limit)
-        except ValueError:
+            limit = min(int(limit), READ_MAX_LIMIT)
+        except (TypeError, ValueError):
             return {"status": "error", "message": "Offset and limit must be integers."}
+        if offset < 0 or limit < 1:
+            return {"status": "error", "message": "Offset must not be negative and limit must be positive."}
+
+        if 'cursor' in data:
+            return read_products_page(data.get('cursor'), limit, session)
 
         products = session.query(Product).offset(offset).limit(limit).all()
         return {"status": "success", "data": [p.to_dict() for p in products]}
 
 
+# Keyset pagination: the cursor is an opaque token holding the last id of the
+# previous page, so every page is an index range scan on id instead of an
+# OFFSET that has to skip all the rows before it.
+
+def encode_cursor(last_id):
+    return base64.urlsafe_b64encode(json.dumps({"after": last_id}).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        return int(json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))["after"])
+    except (ValueError, KeyError, TypeError, AttributeError):
+        raise ValueError("Invalid cursor.")
+
+
+def read_products_page(cursor, limit, session):
+    try:
+        after = decode_cursor(cursor)
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+
+    query = session.query(Product).order_by(Product.id)
+    if after is not None:
+        query = query.filter(Product.id > after)
+    products = [p.to_dict() for p in query.limit(limit)]
+    # A full page means there may be more rows after it
+    next_cursor = encode_cursor(products[-1]['id']) if len(products) == limit and products else None
+    return {"status": "success", "data": products, "next_cursor": next_cursor}
+
+
+def export_products(data, session):
+    """
+    Streams every product (after an optional cursor) in frames of
+    EXPORT_CHUNK_SIZE rows. yield_per keeps only one chunk of rows in memory;
+    each frame carries a cursor to resume the export from if it is interrupted.
+    """
+    after = decode_cursor(data.get('cursor'))
+    query = session.query(Product).order_by(Product.id)
+    if after is not None:
+        query = query.filter(Product.id > after)
+
+    count = 0
+    chunk = []
+    for product in query.yield_per(EXPORT_CHUNK_SIZE):
+        chunk.append(product.to_dict())
+        if len(chunk) == EXPORT_CHUNK_SIZE:
+            count += len(chunk)
+            yield {"status": "partial", "data": chunk, "next_cursor": encode_cursor(chunk[-1]['id'])}
+            chunk = []
+    if chunk:
+        count += len(chunk)
+        yield {"status": "partial", "data": chunk, "next_cursor": encode_cursor(chunk[-1]['id'])}
+    yield {"status": "success", "done": True, "count": count}
+
+
+STREAMING_ACTIONS = {
+    'export': export_products,
+}
+
+
 def update_product(data, session):
     # Identify product by id or name
     identifier = {}
@@ -167,6 +380,207 @@ def delete_product(data, session):
     return {"status": "success", "message": "Product deleted successfully."}
 
 
+# Bulk actions take {"products": [...]} (or the list itself as data) and answer
+# with one result per item, in order:
+#   {"status": "success", "succeeded": 2, "failed": 1, "results": [
+#       {"index": 0, "status": "success", "data": {...}},
+#       {"index": 1, "status": "error", "message": "..."}, ...]}
+# All the writes of a bulk action go to the database in one executemany
+# statement and one commit.
+
+def bulk_items(data):
+    items = data if isinstance(data, list) else data.get('products')
+    if not isinstance(items, list):
+        return None
+    return items
+
+
+def bulk_response(results):
+    failed = sum(1 for result in results if result["status"] == "error")
+    return {
+        "status": "success",
+        "succeeded": len(results) - failed,
+        "failed": failed,
+        "results": results
+    }
+
+
+def item_error(index, message):
+    return {"index": index, "status": "error", "message": message}
+
+
+def chunks(values, size=BULK_CHUNK_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def load_products(session, ids=(), names=()):
+    # Fetch the products referenced by a bulk request with a few IN queries
+    by_id, by_name = {}, {}
+    for chunk in chunks(set(ids)):
+        for product in session.query(Product).filter(Product.id.in_(chunk)):
+            by_id[product.id] = product
+            by_name[product.name] = product
+    for chunk in chunks(set(names) - set(by_name)):
+        for product in session.query(Product).filter(Product.name.in_(chunk)):
+            by_id[product.id] = product
+            by_name[product.name] = product
+    return by_id, by_name
+
+
+def find_item(item, by_id, by_name):
+    if 'id' in item:
+        return by_id.get(item['id'])
+    return by_name.get(item['name'])
+
+
+def identifiers(items):
+    ids = [item['id'] for item in items if isinstance(item, dict) and 'id' in item]
+    names = [item['name'] for item in items if isinstance(item, dict) and 'id' not in item and 'name' in item]
+    return ids, names
+
+
+def bulk_create_products(data, session):
+    items = bulk_items(data)
+    if items is None:
+        return {"status": "error", "message": "Please provide a list of products."}
+
+    results = [None] * len(items)
+    rows, row_indexes, seen = [], [], set()
+    existing = set()
+    names = [item['name'] for item in items if isinstance(item, dict) and 'name' in item]
+    for chunk in chunks(set(names)):
+        existing.update(name for (name,) in session.query(Product.name).filter(Product.name.in_(chunk)))
+
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[index] = item_error(index, "Product must be a JSON object.")
+            continue
+        missing = [field for field in PRODUCT_FIELDS if field not in item]
+        if missing:
+            results[index] = item_error(index, f"Missing fields: {', '.join(missing)}")
+        elif item['name'] in existing or item['name'] in seen:
+            results[index] = item_error(index, "Product with this name already exists.")
+        else:
+            seen.add(item['name'])
+            rows.append({field: item[field] for field in PRODUCT_FIELDS})
+            row_indexes.append(index)
+
+    if rows:
+        try:
+            session.execute(insert(Product), rows)
+            session.commit()
+        except sqlalchemy.exc.IntegrityError:
+            # Another client inserted one of the names in the meantime
+            session.rollback()
+            for index in row_indexes:
+                results[index] = item_error(index, "Product with this name already exists.")
+            return bulk_response(results)
+
+        _, created = load_products(session, names=[row['name'] for row in rows])
+        for index, row in zip(row_indexes, rows):
+            results[index] = {"index": index, "status": "success", "data": created[row['name']].to_dict()}
+
+    return bulk_response(results)
+
+
+def bulk_read_products(data, session):
+    items = bulk_items(data)
+    if items is None:
+        return {"status": "error", "message": "Please provide a list of products."}
+
+    by_id, by_name = load_products(session, *identifiers(items))
+    results = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or ('id' not in item and 'name' not in item):
+            results.append(item_error(index, "Please provide 'id' or 'name'."))
+            continue
+        product = find_item(item, by_id, by_name)
+        if product:
+            results.append({"index": index, "status": "success", "data": product.to_dict()})
+        else:
+            results.append(item_error(index, "Product not found."))
+    return bulk_response(results)
+
+
+def bulk_update_products(data, session):
+    items = bulk_items(data)
+    if items is None:
+        return {"status": "error", "message": "Please provide a list of products."}
+
+    by_id, by_name = load_products(session, *identifiers(items))
+    # Names that products will be renamed to, checked against the database and the batch
+    new_names = [item['name'] for item in items if isinstance(item, dict) and 'id' in item and 'name' in item]
+    _, taken = load_products(session, names=new_names)
+    owners = {name: product.id for name, product in taken.items()}
+
+    results = [None] * len(items)
+    mappings, mapping_indexes, updated_ids = [], [], set()
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or ('id' not in item and 'name' not in item):
+            results[index] = item_error(index, "Please provide 'id' or 'name' to update.")
+            continue
+        product = find_item(item, by_id, by_name)
+        if not product:
+            results[index] = item_error(index, "Product not found.")
+            continue
+        if product.id in updated_ids:
+            results[index] = item_error(index, "Product is updated twice in the same batch.")
+            continue
+        changes = {field: item[field] for field in PRODUCT_FIELDS if field in item}
+        new_name = changes.get('name', product.name)
+        if owners.get(new_name, product.id) != product.id:
+            results[index] = item_error(index, "Product with this name already exists.")
+            continue
+        owners[new_name] = product.id
+        updated_ids.add(product.id)
+        mappings.append({'id': product.id, **changes})
+        mapping_indexes.append(index)
+
+    if mappings:
+        updated = [{**by_id[mapping['id']].to_dict(), **mapping} for mapping in mappings]
+        try:
+            session.bulk_update_mappings(Product, mappings)
+            session.commit()
+        except sqlalchemy.exc.IntegrityError:
+            session.rollback()
+            for index in mapping_indexes:
+                results[index] = item_error(index, "Product with this name already exists.")
+            return bulk_response(results)
+        for index, product in zip(mapping_indexes, updated):
+            results[index] = {"index": index, "status": "success", "data": product}
+
+    return bulk_response(results)
+
+
+def bulk_delete_products(data, session):
+    items = bulk_items(data)
+    if items is None:
+        return {"status": "error", "message": "Please provide a list of products."}
+
+    by_id, by_name = load_products(session, *identifiers(items))
+    results = []
+    delete_ids = set()
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or ('id' not in item and 'name' not in item):
+            results.append(item_error(index, "Please provide 'id' or 'name' to delete."))
+            continue
+        product = find_item(item, by_id, by_name)
+        if not product or product.id in delete_ids:
+            results.append(item_error(index, "Product not found."))
+            continue
+        delete_ids.add(product.id)
+        results.append({"index": index, "status": "success", "message": "Product deleted successfully."})
+
+    if delete_ids:
+        for chunk in chunks(delete_ids):
+            session.query(Product).filter(Product.id.in_(chunk)).delete(synchronize_session=False)
+        session.commit()
+
+    return bulk_response(results)
+
+
 def start_server():
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         s.bind((HOST, PORT))
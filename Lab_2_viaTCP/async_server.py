@@ -0,0 +1,228 @@
+import asyncio
+import argparse
+import signal
+import threading
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
+from protocol import FrameError, decode_payload, encode_frame, read_frame_payload_async
+from TCP_server import HOST, is_read, is_streaming, run_request, stream_request
+
+PORT = 65433  # Next to the threaded server so both can run for the load test
+
+MAX_CONNECTIONS = 1000
+DB_WORKERS = 16  # Threads running SQLAlchemy work; the event loop never blocks on the DB
+MAX_IN_FLIGHT = 32  # Requests per connection before the server stops reading from it
+SHUTDOWN_TIMEOUT = 10  # Seconds given to in-flight requests on shutdown
+
+
+class AsyncTCPServer:
+    """
+    Same CRUD protocol as TCP_server.py on a single asyncio event loop.
+    Idle connections cost a few KB instead of an OS thread each.
+    """
+
+    def __init__(self, host=HOST, port=PORT, max_connections=MAX_CONNECTIONS,
+                 db_workers=DB_WORKERS, max_in_flight=MAX_IN_FLIGHT):
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self.max_in_flight = max_in_flight
+        self.executor = ThreadPoolExecutor(max_workers=db_workers)
+        self.server = None
+        self.connections = set()
+        self.closing = False
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        print(f"Async TCP Server listening on {self.host}:{self.port}")
+
+    async def handle_client(self, reader, writer):
+        addr = writer.get_extra_info('peername')
+        if self.closing or len(self.connections) >= self.max_connections:
+            writer.write(encode_frame({"id": None, "status": "error", "message": "Server is busy."}))
+            await self.close_writer(writer)
+            return
+
+        task = asyncio.current_task()
+        self.connections.add(task)
+        write_lock = asyncio.Lock()
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        pending = set()
+        # Same ordering as TCP_server.py: a mutation starts after every
+        # earlier request of the connection is done, and a read after every
+        # earlier mutation. Reads between two mutations still run concurrently.
+        last_mutation = None
+        reads_since_mutation = []
+
+        async def respond(request_id, response):
+            response["id"] = request_id
+            async with write_lock:
+                writer.write(encode_frame(response))
+                # drain() waits while the client is not reading its responses
+                await writer.drain()
+
+        async def run_and_respond(request, dependencies):
+            try:
+                if dependencies:
+                    await asyncio.wait(dependencies)
+                if is_streaming(request):
+                    await self.stream_and_respond(request, respond)
+                else:
+                    response = await asyncio.get_running_loop().run_in_executor(self.executor, run_request, request)
+                    await respond(request.get("id") if isinstance(request, dict) else None, response)
+            except (ConnectionError, OSError):
+                pass
+            finally:
+                in_flight.release()
+
+        try:
+            while not self.closing:
+                payload = await read_frame_payload_async(reader)
+                if payload is None:
+                    break
+                try:
+                    request = decode_payload(payload)
+                except FrameError as e:
+                    await respond(None, {"status": "error", "message": str(e)})
+                    continue
+                await in_flight.acquire()
+                if is_read(request):
+                    dependencies = [last_mutation] if last_mutation else []
+                    request_task = asyncio.create_task(run_and_respond(request, dependencies))
+                    reads_since_mutation = [read for read in reads_since_mutation if not read.done()]
+                    reads_since_mutation.append(request_task)
+                else:
+                    dependencies = reads_since_mutation + ([last_mutation] if last_mutation else [])
+                    request_task = asyncio.create_task(run_and_respond(request, dependencies))
+                    last_mutation = request_task
+                    reads_since_mutation = []
+                pending.add(request_task)
+                request_task.add_done_callback(pending.discard)
+        except asyncio.CancelledError:
+            pass  # shutdown: stop reading, but finish what was already received
+        except (FrameError, ConnectionError, OSError) as e:
+            print(f"Closing connection to {addr}: {e}")
+        finally:
+            try:
+                if pending:
+                    await asyncio.wait(pending)
+                await self.close_writer(writer)
+            except asyncio.CancelledError:
+                # Second cancel: shutdown's grace period is over, drop the
+                # remaining requests and any unsent responses
+                for request_task in pending:
+                    request_task.cancel()
+                writer.transport.abort()
+            finally:
+                self.connections.discard(task)
+
+    async def stream_and_respond(self, request, respond):
+        # The export generator runs in one executor thread (its session stays
+        # on that thread) and hands frames over through a small queue; when
+        # the client reads slowly the queue fills up and the generator waits.
+        loop = asyncio.get_running_loop()
+        frames = asyncio.Queue(maxsize=2)
+        stop = threading.Event()
+
+        def hand_over(item):
+            # Gives up once the consumer is gone (cancelled on shutdown), so
+            # the thread never waits on a queue that nobody drains
+            future = asyncio.run_coroutine_threadsafe(frames.put(item), loop)
+            while True:
+                try:
+                    future.result(timeout=0.1)
+                    return True
+                except concurrent.futures.TimeoutError:
+                    if stop.is_set():
+                        future.cancel()
+                        return False
+
+        def produce():
+            try:
+                for response in stream_request(request):
+                    if stop.is_set() or not hand_over(response):
+                        break
+            finally:
+                hand_over(None)
+
+        producer = loop.run_in_executor(self.executor, produce)
+        failed = False
+        try:
+            while True:
+                response = await frames.get()
+                if response is None:
+                    break
+                if failed:
+                    continue  # keep draining so the producer is never stuck on a full queue
+                try:
+                    await respond(request.get("id"), response)
+                except (ConnectionError, OSError):
+                    failed = True
+                    stop.set()
+            await producer
+        finally:
+            stop.set()
+
+    @staticmethod
+    async def close_writer(writer):
+        try:
+            writer.close()
+            await writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+    async def shutdown(self, timeout=SHUTDOWN_TIMEOUT):
+        if self.closing:
+            return
+        print("Shutting down: no new connections, finishing in-flight requests")
+        self.closing = True
+        self.server.close()
+        for task in list(self.connections):
+            task.cancel()
+        if self.connections:
+            await asyncio.wait(list(self.connections), timeout=timeout)
+        for task in list(self.connections):
+            task.cancel()
+        if self.connections:
+            await asyncio.wait(list(self.connections), timeout=1)
+        await self.server.wait_closed()
+        # Wait for the executor off the loop: a producer thread blocked on
+        # run_coroutine_threadsafe(...).result() needs the loop to finish
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.wait_for(loop.run_in_executor(None, self.executor.shutdown), timeout)
+        except asyncio.TimeoutError:
+            print("Shutdown timed out, dropping queued database work")
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def serve_forever(self):
+        await self.start()
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        # Signal handlers can only be installed from the main thread; started
+        # from another one, the server runs until its task is cancelled
+        if threading.current_thread() is threading.main_thread():
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                try:
+                    loop.add_signal_handler(sig, stop.set)
+                except NotImplementedError:  # Windows
+                    pass
+        await stop.wait()
+        await self.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="asyncio TCP server for the product CRUD protocol")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--max-connections', type=int, default=MAX_CONNECTIONS)
+    parser.add_argument('--db-workers', type=int, default=DB_WORKERS)
+    parser.add_argument('--max-in-flight', type=int, default=MAX_IN_FLIGHT)
+    args = parser.parse_args()
+
+    server = AsyncTCPServer(args.host, args.port, args.max_connections, args.db_workers, args.max_in_flight)
+    asyncio.run(server.serve_forever())
+
+
+if __name__ == "__main__":
+    main()
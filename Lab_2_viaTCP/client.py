@@ -1,19 +1,122 @@
 # tcp_client.py
 
 import socket
-import json
+import itertools
+import queue
+import threading
+from concurrent.futures import Future
+from protocol import FrameError, encode_frame, recv_frame
 
 HOST = '127.0.0.1'  # The server's hostname or IP address
 PORT = 65432  # The port used by the server
 
 
+class PipelinedClient:
+    """
+    Keeps one connection open and lets many requests be in flight on it.
+    submit() returns a Future that is resolved when the response with the
+    same id arrives, whatever order the server answers in.
+    """
+
+    def __init__(self, host=HOST, port=PORT):
+        self.sock = socket.create_connection((host, port))
+        self.ids = itertools.count(1)
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.closed = False
+        self.reader = threading.Thread(target=self._read_responses, daemon=True)
+        self.reader.start()
+
+    def submit(self, request):
+        future = Future()
+        with self.lock:
+            if self.closed:
+                raise ConnectionError("Client is closed")
+            request_id = next(self.ids)
+            self.pending[request_id] = future
+            frame = encode_frame({**request, "id": request_id})
+            self.sock.sendall(frame)
+        return future
+
+    def request(self, request, timeout=None):
+        return self.submit(request).result(timeout)
+
+    def stream(self, request):
+        """
+        Send a streaming request (e.g. export) and yield every frame of the
+        answer, the final one included.
+        """
+        frames = queue.Queue()
+        with self.lock:
+            if self.closed:
+                raise ConnectionError("Client is closed")
+            request_id = next(self.ids)
+            self.pending[request_id] = frames
+            self.sock.sendall(encode_frame({**request, "id": request_id}))
+        while True:
+            frame = frames.get()
+            if isinstance(frame, Exception):
+                raise frame
+            yield frame
+            if frame.get("status") != "partial":
+                return
+
+    def export(self, cursor=None):
+        """
+        Yield every product, chunk by chunk, without loading them all.
+        """
+        for frame in self.stream({"action": "export", "data": {"cursor": cursor}}):
+            if frame.get("status") == "error":
+                raise RuntimeError(frame.get("message"))
+            yield from frame.get("data", [])
+
+    def _read_responses(self):
+        error = ConnectionError("Connection closed by server")
+        try:
+            while True:
+                response = recv_frame(self.sock)
+                if response is None:
+                    break
+                with self.lock:
+                    if response.get("status") == "partial":
+                        waiter = self.pending.get(response.get("id"))
+                    else:
+                        waiter = self.pending.pop(response.get("id"), None)
+                if isinstance(waiter, queue.Queue):
+                    waiter.put(response)
+                elif waiter is not None:
+                    waiter.set_result(response)
+        except (FrameError, OSError) as e:
+            error = ConnectionError(str(e))
+        with self.lock:
+            self.closed = True
+            pending, self.pending = self.pending, {}
+        for waiter in pending.values():
+            if isinstance(waiter, queue.Queue):
+                waiter.put(error)
+            else:
+                waiter.set_exception(error)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        self.reader.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
 def send_request(request):
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.connect((HOST, PORT))
-        s.sendall(json.dumps(request).encode('utf-8'))
-        data = s.recv(4096)
-    response = json.loads(data.decode('utf-8'))
-    return response
+    with PipelinedClient() as client:
+        return client.request(request)
 
 
 if __name__ == "__main__":
@@ -65,3 +168,34 @@ if __name__ == "__main__":
     print("\nDeleting Product:", delete_request)
     response = send_request(delete_request)
     print("Response:", response)
+
+    # Example: create a batch of products in one round trip and one commit
+    bulk_request = {
+        "action": "bulk_create",
+        "data": {
+            "products": [{
+                "name": f"Bulk Product {i}",
+                "url": f"http://example.com/bulk-{i}",
+                "price_mdl": 100.0 + i,
+                "display_size": "1920x1080",
+                "price_eur": 5.0 + i
+            } for i in range(100)]
+        }
+    }
+    response = send_request(bulk_request)
+    print(f"\nBulk create: {response['succeeded']} created, {response['failed']} failed")
+
+    response = send_request({"action": "bulk_delete", "data": [{"name": f"Bulk Product {i}"} for i in range(100)]})
+    print(f"Bulk delete: {response['succeeded']} deleted, {response['failed']} failed")
+
+    # Example: pipeline several reads on one connection
+    with PipelinedClient() as client:
+        futures = [client.submit({"action": "read", "data": {"offset": i * 10, "limit": 10}}) for i in range(5)]
+        print("\nPipelined reads:", [len(f.result().get("data", [])) for f in futures])
+
+        # Example: keyset pagination with the opaque cursor
+        response = client.request({"action": "read", "data": {"cursor": None, "limit": 10}})
+        print("First page:", [p["id"] for p in response["data"]], "next cursor:", response["next_cursor"])
+
+        # Example: stream every product without buffering them
+        print("Exported products:", sum(1 for _ in client.export()))
@@ -0,0 +1,114 @@
+"""
+Load test for the threaded (TCP_server.py) and asyncio (async_server.py)
+servers. Start the servers first, then:
+
+    python load_test.py --connections 2000 --concurrency 200 --idle 1000
+
+For every server it opens --idle connections that stay silent for the whole
+run, then opens --connections short-lived connections (--concurrency at a
+time), each sending --requests read requests one after the other. It reports
+connections/s and the request latency percentiles.
+"""
+import argparse
+import asyncio
+import time
+from protocol import decode_payload, encode_frame, read_frame_payload_async
+
+HOST = '127.0.0.1'
+SERVERS = {
+    'threaded': 65432,
+    'asyncio': 65433,
+}
+REQUEST = {"action": "read", "data": {"offset": 0, "limit": 10}}
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def open_idle(host, port, count):
+    connections = []
+    for _ in range(count):
+        try:
+            connections.append(await asyncio.open_connection(host, port))
+        except OSError:
+            break
+    return connections
+
+
+async def client_session(host, port, requests, latencies, errors):
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+    except OSError:
+        errors.append('connect')
+        return
+    try:
+        for i in range(requests):
+            start = time.perf_counter()
+            writer.write(encode_frame({**REQUEST, "id": i}))
+            await writer.drain()
+            payload = await read_frame_payload_async(reader)
+            if payload is None:
+                errors.append('closed')
+                return
+            if decode_payload(payload).get("status") != "success":
+                errors.append('error response')
+            latencies.append(time.perf_counter() - start)
+    except (OSError, ConnectionError) as e:
+        errors.append(type(e).__name__)
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except (OSError, ConnectionError):
+            pass
+
+
+async def run_load(host, port, connections, concurrency, requests, idle):
+    idle_connections = await open_idle(host, port, idle)
+    latencies, errors = [], []
+    limit = asyncio.Semaphore(concurrency)
+
+    async def limited():
+        async with limit:
+            await client_session(host, port, requests, latencies, errors)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(limited() for _ in range(connections)))
+    elapsed = time.perf_counter() - start
+
+    for _, writer in idle_connections:
+        writer.close()
+    return {
+        'idle': len(idle_connections),
+        'connections_per_s': connections / elapsed,
+        'requests_per_s': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'errors': len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--servers', nargs='+', default=list(SERVERS), choices=list(SERVERS))
+    parser.add_argument('--connections', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--requests', type=int, default=5, help="requests per connection")
+    parser.add_argument('--idle', type=int, default=500, help="idle connections held open during the run")
+    args = parser.parse_args()
+
+    print(f"{'server':<10} {'idle':>6} {'conn/s':>10} {'req/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for name in args.servers:
+        result = asyncio.run(run_load(args.host, SERVERS[name], args.connections, args.concurrency,
+                                      args.requests, args.idle))
+        print(f"{name:<10} {result['idle']:>6} {result['connections_per_s']:>10.0f} {result['requests_per_s']:>10.0f} "
+              f"{result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['errors']:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import asyncio
+import json
+import struct
+
+# Every message on the wire is a frame: a 4-byte big-endian length followed by
+# that many bytes of UTF-8 JSON. Requests carry an "id" that the server copies
+# into the matching response, so several requests can be in flight on one
+# connection and their responses may come back in any order.
+
+HEADER = struct.Struct('!I')
+MAX_FRAME_SIZE = 16 * 1024 * 1024  # 16 MiB
+
+
+class FrameError(Exception):
+    pass
+
+
+def encode_frame(message):
+    payload = json.dumps(message).encode('utf-8')
+    if len(payload) > MAX_FRAME_SIZE:
+        raise FrameError(f"Frame of {len(payload)} bytes exceeds the {MAX_FRAME_SIZE} byte limit")
+    return HEADER.pack(len(payload)) + payload
+
+
+def decode_payload(payload):
+    try:
+        return json.loads(payload.decode('utf-8'))
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        raise FrameError("Invalid JSON format.")
+
+
+def send_frame(sock, message):
+    sock.sendall(encode_frame(message))
+
+
+def recv_exact(sock, size):
+    """
+    Read exactly size bytes. Returns None if the peer closed the connection
+    before sending anything, raises FrameError if it closed in the middle.
+    """
+    chunks = []
+    remaining = size
+    while remaining:
+        chunk = sock.recv(min(remaining, 65536))
+        if not chunk:
+            if remaining == size:
+                return None
+            raise FrameError("Connection closed in the middle of a frame")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+
+def read_frame_payload(sock):
+    header = recv_exact(sock, HEADER.size)
+    if header is None:
+        return None
+    (length,) = HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise FrameError(f"Frame of {length} bytes exceeds the {MAX_FRAME_SIZE} byte limit")
+    payload = recv_exact(sock, length) if length else b''
+    if payload is None:
+        raise FrameError("Connection closed in the middle of a frame")
+    return payload
+
+
+def recv_frame(sock):
+    payload = read_frame_payload(sock)
+    if payload is None:
+        return None
+    return decode_payload(payload)
+
+
+async def read_frame_payload_async(reader):
+    """
+    asyncio counterpart of read_frame_payload for a StreamReader.
+    """
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise FrameError("Connection closed in the middle of a frame")
+    (length,) = HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise FrameError(f"Frame of {length} bytes exceeds the {MAX_FRAME_SIZE} byte limit")
+    try:
+        return await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        raise FrameError("Connection closed in the middle of a frame")
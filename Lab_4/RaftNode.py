@@ -1,8 +1,16 @@
+import collections
+import heapq
+import itertools
+import selectors
 import socket
 import threading
 import time
 import random
 import json
+import os
+from concurrent.futures import Future
+from raft_storage import RaftStorage
+from state_machine import ProductStore
 
 # Possible states of a node
 FOLLOWER = "FOLLOWER"
@@ -12,30 +20,167 @@ LEADER = "LEADER"
 # Message types
 REQUEST_VOTE = "REQUEST_VOTE"
 VOTE_RESPONSE = "VOTE_RESPONSE"
-HEARTBEAT = "HEARTBEAT"
+APPEND_ENTRIES = "APPEND_ENTRIES"  # an AppendEntries without entries is the heartbeat
+APPEND_RESPONSE = "APPEND_RESPONSE"
+
+HEARTBEAT_INTERVAL = 0.5  # seconds
+ELECTION_TIMEOUT = (1.5, 3.0)  # randomized between these bounds, in seconds
+PROPOSE_TIMEOUT = 5.0  # seconds a client waits for its command or read
+
+# Entries per AppendEntries message; fewer are sent when the datagram would
+# exceed MAX_DATAGRAM_SIZE (UDP payloads are limited to 65507 bytes)
+MAX_ENTRIES_PER_MESSAGE = 256
+MAX_DATAGRAM_SIZE = 60000
+RECV_BUFFER_SIZE = 4 * 1024 * 1024  # kernel receive buffer, absorbs bursts of entries
+RECV_BATCH = 64  # datagrams handled before a follower sends its coalesced ack
+
+# Pipelining: AppendEntries messages with entries sent to one follower and
+# not acknowledged yet. The leader stops sending to that follower when the
+# window is full.
+MAX_INFLIGHT = 8
+
+# Snapshot the state machine and drop the log prefix once this many applied
+# entries follow the last snapshot
+SNAPSHOT_THRESHOLD = 1000
+
+# InstallSnapshot goes over TCP, to base_port + SNAPSHOT_PORT_OFFSET + node_id:
+# a JSON header line, the snapshot in chunks, then a JSON reply line
+SNAPSHOT_PORT_OFFSET = 1000
+SNAPSHOT_CHUNK_SIZE = 64 * 1024
+SNAPSHOT_TIMEOUT = 10.0  # seconds without progress before a transfer is dropped
+
+
+class NotLeaderError(Exception):
+    """
+    Raised to a client that proposed to or read from a node that is not (or
+    stopped being) the leader. leader_id is the last leader this node heard
+    from, or None.
+    """
+
+    def __init__(self, leader_id):
+        super().__init__(f"Not the leader, last known leader is {leader_id}")
+        self.leader_id = leader_id
 
 
 class RaftNode(threading.Thread):
-    def __init__(self, node_id, peers, base_port=5000):
+    def __init__(self, node_id, peers, base_port=5000, state_machine=None,
+                 election_timeout=ELECTION_TIMEOUT, heartbeat_interval=HEARTBEAT_INTERVAL, verbose=True,
+                 data_dir=None, snapshot_threshold=SNAPSHOT_THRESHOLD,
+                 max_batch=MAX_ENTRIES_PER_MESSAGE, max_inflight=MAX_INFLIGHT):
         super(RaftNode, self).__init__()
         self.node_id = node_id
         self.peers = peers  # list of node_ids representing other nodes
         self.base_port = base_port
+        self.election_timeout_range = election_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.verbose = verbose
+        self.snapshot_threshold = snapshot_threshold
+        self.max_batch = max_batch
+        self.max_inflight = max_inflight
 
         # Raft persistent and volatile state (simplified)
         self.current_term = 0
         self.voted_for = None
         self.state = FOLLOWER
+        self.leader_id = None
+        # Sent with every AppendEntries response. A higher value than the
+        # leader saw before means a new process, which may have lost the
+        # entries the previous one acknowledged (a replaced node)
+        self.incarnation = time.time_ns()
+
+        # Replicated log: entries {"term", "command"} following the snapshot,
+        # which replaces entries up to snapshot_index; log index i is
+        # self.log[i - snapshot_index - 1]
+        self.log = []
+        self.snapshot_index = 0
+        self.snapshot_term = 0
+        self.snapshot_data = None  # serialized state machine at snapshot_index
+        self.snapshot_running = False  # a helper thread is encoding and saving a snapshot
+        self.commit_index = 0
+        self.last_applied = 0
+        self.state_machine = state_machine if state_machine is not None else ProductStore()
+
+        # Term, vote and log survive restarts in a WAL under data_dir; without
+        # one they live in memory only. The state machine is rebuilt by
+        # re-applying entries as the commit index is learned again
+        self.storage = None
+        if data_dir is not None:
+            self.storage = RaftStorage(os.path.join(data_dir, f"node-{node_id}"))
+            self.current_term = self.storage.term
+            self.voted_for = self.storage.voted_for
+            self.log = self.storage.entries
+            if self.storage.snapshot is not None:
+                index, term, data = self.storage.snapshot
+                self.state_machine.restore(json.loads(data))
+                self.snapshot_index, self.snapshot_term, self.snapshot_data = index, term, data
+                self.commit_index = self.last_applied = index
+        self.durable_index = self.last_log_index()  # entries the leader itself has made durable
+
+        # Leader state, reinitialized after every election. next_index is
+        # optimistic: it moves past entries as soon as they are sent
+        self.next_index = {}
+        self.match_index = {}
+        self.inflight = {}       # peer -> deque of the last index of each unacknowledged message
+        self.last_sent = {}      # peer -> time of the last AppendEntries
+        self.last_progress = {}  # peer -> time its match index last advanced
+        self.term_start_index = 0  # index of the no-op entry appended on becoming leader
+        self.snapshot_transfers = set()  # peers an InstallSnapshot is being sent to
+        self.peer_incarnations = {}  # peer -> highest incarnation it answered with
+
+        # Client requests waiting on this node: proposals by log index, as
+        # (term, Future), and reads as (heartbeat seq, read index, query, Future)
+        self.pending = {}
+        self.pending_reads = []
+        self.heartbeat_seq = 0
+        self.acked_seq = {}  # peer -> highest heartbeat seq it answered in this term
+
+        # Client threads only append and wake the loop, which replicates
+        # whatever was appended since its last wakeup in one go
+        self.replicate_requested = False
+        self.read_round_requested = False
+
+        # Follower: success response coalesced over a batch of datagrams and
+        # sent once the entries it acknowledges are durable
+        self.ack = None
+
+        # Client threads call propose()/read() while run() handles messages
+        self.lock = threading.RLock()
+
+        # Timers: a heap of (deadline, seq, callback) run by the event loop.
+        # Deadlines use time.monotonic()
+        self.timers = []
+        self.timer_seq = itertools.count()
 
         # For leader election timing
         self.election_timeout = self.reset_election_timeout()
-        self.last_heartbeat_time = time.time()
+        self.election_started_at = None
+        self.election_duration = None  # seconds from our last election start to winning it
+        self.call_at(self.election_timeout, self.check_election_timeout)
 
         # Networking (UDP)
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER_SIZE)
         self.sock.bind(("localhost", self.base_port + self.node_id))
         self.sock.setblocking(False)
 
+        # The loop sleeps in select() until a datagram arrives, the next timer
+        # is due, or another thread writes to the wakeup socket (new
+        # proposals and reads, stop())
+        self.wakeup_reader, self.wakeup_writer = socket.socketpair()
+        self.wakeup_reader.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.sock, selectors.EVENT_READ)
+        self.selector.register(self.wakeup_reader, selectors.EVENT_READ)
+
+        # InstallSnapshot listener (TCP), accepted by the loop and served on
+        # a helper thread per transfer
+        self.snapshot_server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.snapshot_server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.snapshot_server.bind(("localhost", self.snapshot_port(self.node_id)))
+        self.snapshot_server.listen()
+        self.snapshot_server.setblocking(False)
+        self.selector.register(self.snapshot_server, selectors.EVENT_READ)
+
         # For voting and counting majority
         self.votes_received = 0
         self.majority = (len(self.peers) + 1) // 2 + 1  # majority threshold
@@ -43,52 +188,166 @@ class RaftNode(threading.Thread):
         self.running = True
 
     def reset_election_timeout(self):
-        # Randomized election timeout: between 1.5 and 3 seconds
-        return time.time() + random.uniform(1.5, 3.0)
+        # Randomized election timeout, between 1.5 and 3 seconds by default
+        return time.monotonic() + random.uniform(*self.election_timeout_range)
+
+    def trace(self, message):
+        if self.verbose:
+            print(f"Node {self.node_id}: {message}")
+
+    def call_at(self, deadline, callback):
+        heapq.heappush(self.timers, (deadline, next(self.timer_seq), callback))
+
+    def snapshot_port(self, node_id):
+        return self.base_port + SNAPSHOT_PORT_OFFSET + node_id
+
+    def last_log_index(self):
+        return self.snapshot_index + len(self.log)
+
+    def entry(self, index):
+        return self.log[index - self.snapshot_index - 1]
+
+    def log_term(self, index):
+        # Terms are only known from the snapshot on
+        if index == self.snapshot_index:
+            return self.snapshot_term
+        return self.entry(index)["term"]
+
+    def save_state(self):
+        # Term and vote must be durable before any message that depends on them
+        if self.storage is not None:
+            self.storage.save_state(self.current_term, self.voted_for)
+            self.storage.sync()
+
+    def save_entries(self, index, entries, log_length):
+        """
+        Writes entries (already in self.log from index on) to the WAL without
+        waiting for the fsync. Returns the write's seq for storage.sync().
+        """
+        if self.storage is None:
+            return 0
+        seq = self.storage.save_entries(index, entries, log_length)
+        if self.storage.should_compact(len(self.log)):
+            self.start_compaction()
+        return seq
+
+    def start_compaction(self):
+        """
+        Rewrites the WAL from the current term, vote and log on a helper
+        thread, so the loop does not wait for the file and its fsyncs.
+        """
+        if self.storage is None or not self.storage.begin_compact():
+            return
+        args = (self.current_term, self.voted_for, self.snapshot_index + 1, list(self.log))
+        threading.Thread(target=self.storage.compact, args=args, daemon=True).start()
 
     def send_message(self, target_id, message):
         addr = ("localhost", self.base_port + target_id)
         data = json.dumps(message).encode('utf-8')
-        self.sock.sendto(data, addr)
+        try:
+            self.sock.sendto(data, addr)
+        except OSError:
+            pass  # socket closed by stop(); UDP loss is handled by retransmission
 
     def broadcast_message(self, message):
         for p in self.peers:
             self.send_message(p, message)
 
+    def wake(self):
+        try:
+            self.wakeup_writer.send(b'x')
+        except OSError:
+            pass  # already stopped
+
+    def request_replication(self):
+        # Called with the lock held; one wakeup covers everything appended
+        # until the loop gets to it
+        if not self.replicate_requested:
+            self.replicate_requested = True
+            self.wake()
+
+    # Client API, called from any thread
+
+    def submit(self, command):
+        """
+        Appends a command to the log and returns a Future of the state
+        machine's result. Raises NotLeaderError on a follower; the Future
+        fails with it when leadership is lost before the command commits.
+        """
+        with self.lock:
+            if self.state != LEADER:
+                raise NotLeaderError(self.leader_id)
+            self.log.append({"term": self.current_term, "command": command})
+            index = self.last_log_index()
+            self.save_entries(index, self.log[-1:], index - 1)
+            future = Future()
+            self.pending[index] = (self.current_term, future)
+            self.request_replication()
+        return future
+
+    def propose(self, command, timeout=PROPOSE_TIMEOUT):
+        """
+        Appends a command to the log and waits until it is committed and
+        applied. Returns the state machine's result (or raises its exception).
+        Raises NotLeaderError on a follower or when leadership is lost, and
+        concurrent.futures.TimeoutError when no majority answers in time.
+        """
+        return self.submit(command).result(timeout)
+
+    def read(self, query, timeout=PROPOSE_TIMEOUT):
+        """
+        Linearizable read: runs query(state_machine) once this node has
+        confirmed with a majority that it is still the leader and has applied
+        everything committed when the read started (the read index).
+        """
+        with self.lock:
+            if self.state != LEADER:
+                raise NotLeaderError(self.leader_id)
+            future = Future()
+            # Until the no-op of this term commits, the commit index may lag
+            # behind entries committed by the previous leader
+            read_index = max(self.commit_index, self.term_start_index)
+            # Confirmed by the next heartbeat round, shared by concurrent reads
+            self.pending_reads.append((self.heartbeat_seq + 1, read_index, query, future))
+            self.read_round_requested = True
+            self.request_replication()
+        return future.result(timeout)
+
+    # Elections
+
     def request_votes(self):
         # Send RequestVote to all peers
         msg = {
             "type": REQUEST_VOTE,
             "term": self.current_term,
-            "candidate_id": self.node_id
-        }
-        print(f"Node {self.node_id}: Requesting votes for term {self.current_term}")
-        self.broadcast_message(msg)
-
-    def send_heartbeat(self):
-        # Leader sends heartbeat
-        msg = {
-            "type": HEARTBEAT,
-            "term": self.current_term,
-            "leader_id": self.node_id
+            "candidate_id": self.node_id,
+            "last_log_index": self.last_log_index(),
+            "last_log_term": self.log_term(self.last_log_index())
         }
+        self.trace(f"Requesting votes for term {self.current_term}")
         self.broadcast_message(msg)
 
     def handle_request_vote(self, msg, addr):
         term = msg["term"]
         candidate_id = msg["candidate_id"]
+        state = (self.current_term, self.voted_for)
         if term > self.current_term:
             # Higher term found; revert to follower
-            self.current_term = term
-            self.state = FOLLOWER
-            self.voted_for = None
+            self.step_down(term, save=False)
+
+        # Only vote for candidates whose log holds every committed entry
+        last_term = self.log_term(self.last_log_index())
+        up_to_date = (msg["last_log_term"], msg["last_log_index"]) >= (last_term, self.last_log_index())
 
         vote_granted = False
-        if term == self.current_term and (self.voted_for is None or self.voted_for == candidate_id):
+        if term == self.current_term and (self.voted_for is None or self.voted_for == candidate_id) and up_to_date:
             # Grant vote
             vote_granted = True
             self.voted_for = candidate_id
-            print(f"Node {self.node_id}: Voted for Node {candidate_id} in term {term}")
+            self.election_timeout = self.reset_election_timeout()
+            self.trace(f"Voted for Node {candidate_id} in term {term}")
+        if (self.current_term, self.voted_for) != state:
+            self.save_state()
 
         # Send vote response
         response = {
@@ -96,78 +355,596 @@ class RaftNode(threading.Thread):
             "term": self.current_term,
             "vote_granted": vote_granted
         }
-        self.sock.sendto(json.dumps(response).encode('utf-8'), addr)
+        try:
+            self.sock.sendto(json.dumps(response).encode('utf-8'), addr)
+        except OSError:
+            pass
 
     def handle_vote_response(self, msg):
+        if msg["term"] > self.current_term:
+            self.step_down(msg["term"])
+            return
         if self.state == CANDIDATE and msg["term"] == self.current_term and msg["vote_granted"]:
             self.votes_received += 1
-            print(f"Node {self.node_id}: Received vote. Total votes = {self.votes_received}")
+            self.trace(f"Received vote. Total votes = {self.votes_received}")
             if self.votes_received >= self.majority:
-                # Become the leader
-                print(f"Node {self.node_id}: I received majority votes, becoming LEADER for term {self.current_term}")
-                self.state = LEADER
-                # As a leader, immediately send heartbeat to establish authority
+                self.become_leader()
+
+    def start_election(self):
+        self.state = CANDIDATE
+        self.current_term += 1
+        self.voted_for = self.node_id
+        self.votes_received = 1  # voted for self
+        self.leader_id = None
+        self.election_started_at = time.monotonic()
+        self.trace(f"Starting election for term {self.current_term}")
+        self.save_state()
+        self.request_votes()
+        self.election_timeout = self.reset_election_timeout()
+        if self.votes_received >= self.majority:  # single-node cluster
+            self.become_leader()
+
+    def become_leader(self):
+        self.election_duration = time.monotonic() - self.election_started_at
+        self.trace(f"I received majority votes, becoming LEADER for term {self.current_term}")
+        self.state = LEADER
+        self.leader_id = self.node_id
+        self.next_index = {p: self.last_log_index() + 1 for p in self.peers}
+        self.match_index = {p: 0 for p in self.peers}
+        self.inflight = {p: collections.deque() for p in self.peers}
+        self.last_sent = {p: 0 for p in self.peers}
+        self.last_progress = {p: time.monotonic() for p in self.peers}
+        self.acked_seq = {}
+        # A no-op entry of the new term: committing it commits everything
+        # before it and gives reads a read index that is known to be complete
+        self.log.append({"term": self.current_term, "command": None})
+        self.term_start_index = self.last_log_index()
+        seq = self.save_entries(self.term_start_index, self.log[-1:], self.term_start_index - 1)
+        if self.storage is not None:
+            self.storage.sync(seq)
+        self.durable_index = self.term_start_index
+        # As a leader, immediately send heartbeat to establish authority
+        self.send_heartbeat()
+        for p in self.peers:
+            self.send_entries(p)
+        term = self.current_term
+        self.call_at(time.monotonic() + self.heartbeat_interval, lambda: self.heartbeat_tick(term))
+        self.advance_commit_index()
+
+    def step_down(self, term, save=True):
+        if term > self.current_term:
+            self.current_term = term
+            self.voted_for = None
+            if save:
+                self.save_state()
+        self.state = FOLLOWER
+        # Reads need a confirmed leader; proposals stay pending, their entries
+        # may still be committed by the next leader
+        for _, _, _, future in self.pending_reads:
+            future.set_exception(NotLeaderError(self.leader_id))
+        self.pending_reads = []
+
+    # Log replication
+
+    def replicate(self):
+        """
+        Runs on the loop after a wakeup from submit()/read(): sends everything
+        appended since the last call to each follower (within its window),
+        starts a heartbeat round for waiting reads, and fsyncs the new entries
+        once for all the proposals that arrived meanwhile.
+        """
+        with self.lock:
+            self.replicate_requested = False
+            if self.state != LEADER:
+                return
+            if self.read_round_requested:
+                self.read_round_requested = False
+                self.heartbeat_seq += 1
                 self.send_heartbeat()
-                self.last_heartbeat_time = time.time()
+            for p in self.peers:
+                self.send_entries(p)
+            term = self.current_term
+            last_index = self.last_log_index()
+        # Followers store the entries while the leader fsyncs them
+        if self.storage is not None:
+            self.storage.sync()
+        with self.lock:
+            if self.state == LEADER and self.current_term == term:
+                self.durable_index = max(self.durable_index, last_index)
+                self.advance_commit_index()
+            self.check_reads()
+
+    def send_heartbeat(self):
+        # Empty AppendEntries to every peer, whatever its window. Its previous
+        # entry is the peer's match index (known to match), so a heartbeat
+        # never fails because entries ahead of it are still in flight
+        for p in self.peers:
+            if p not in self.snapshot_transfers:
+                self.send_append_entries(p, max(self.match_index[p], self.snapshot_index), 0)
 
-    def handle_heartbeat(self, msg):
+    def send_entries(self, peer):
+        """Sends the peer's unsent entries in messages of up to max_batch while its window has room."""
+        inflight = self.inflight[peer]
+        while len(inflight) < self.max_inflight and peer not in self.snapshot_transfers:
+            if self.next_index[peer] <= self.snapshot_index:
+                # The entries the peer needs were replaced by the snapshot
+                inflight.clear()
+                self.start_snapshot_transfer(peer)
+                return
+            if self.next_index[peer] > self.last_log_index():
+                return
+            if not inflight:
+                self.last_progress[peer] = time.monotonic()
+            prev_log_index = self.next_index[peer] - 1
+            sent = self.send_append_entries(peer, prev_log_index, self.max_batch)
+            inflight.append(prev_log_index + sent)
+            self.next_index[peer] = prev_log_index + sent + 1
+
+    def send_append_entries(self, peer, prev_log_index, max_entries):
+        """Sends up to max_entries entries after prev_log_index; returns how many were sent."""
+        start = prev_log_index - self.snapshot_index
+        entries = self.log[start:start + max_entries]
+        while True:
+            msg = {
+                "type": APPEND_ENTRIES,
+                "term": self.current_term,
+                "leader_id": self.node_id,
+                "prev_log_index": prev_log_index,
+                "prev_log_term": self.log_term(prev_log_index),
+                "entries": entries,
+                "leader_commit": self.commit_index,
+                "seq": self.heartbeat_seq
+            }
+            data = json.dumps(msg).encode('utf-8')
+            if len(data) <= MAX_DATAGRAM_SIZE or len(entries) <= 1:
+                break
+            entries = entries[:len(entries) // 2]
+        try:
+            self.sock.sendto(data, ("localhost", self.base_port + peer))
+        except OSError:
+            pass
+        self.last_sent[peer] = time.monotonic()
+        return len(entries)
+
+    def handle_append_entries(self, msg):
         leader_term = msg["term"]
-        if leader_term > self.current_term:
-            self.current_term = leader_term
-            self.state = FOLLOWER
-            self.voted_for = None
+        leader_id = msg["leader_id"]
+        if leader_term < self.current_term:
+            self.send_append_response(leader_id, False, msg, conflict_index=0)
+            return
+        if leader_term > self.current_term or self.state != FOLLOWER:
+            self.step_down(leader_term)
 
-        if leader_term >= self.current_term:
-            # Reset election timeout and acknowledge leader
-            self.last_heartbeat_time = time.time()
-            self.election_timeout = self.reset_election_timeout()
+        # Reset election timeout and acknowledge leader
+        self.leader_id = leader_id
+        self.election_timeout = self.reset_election_timeout()
 
-    def run(self):
-        print(f"Node {self.node_id} started as {self.state} on port {self.base_port + self.node_id}")
-        while self.running:
-            # Check for messages
-            self.receive_messages()
+        # The entry before the new ones must match, otherwise the leader backs
+        # up to conflict_index: our log end, or the start of the conflicting term
+        prev_log_index = msg["prev_log_index"]
+        prev_log_term = msg["prev_log_term"]
+        entries = msg["entries"]
+        if prev_log_index < self.snapshot_index:
+            # Entries up to the snapshot are committed, so they match the leader's
+            entries = entries[self.snapshot_index - prev_log_index:]
+            prev_log_index, prev_log_term = self.snapshot_index, self.snapshot_term
+        if prev_log_index > self.last_log_index():
+            self.send_append_response(leader_id, False, msg, conflict_index=self.last_log_index() + 1)
+            return
+        if self.log_term(prev_log_index) != prev_log_term:
+            conflict_term = self.log_term(prev_log_index)
+            first = prev_log_index
+            while first > self.snapshot_index + 1 and self.log_term(first - 1) == conflict_term:
+                first -= 1
+            self.send_append_response(leader_id, False, msg, conflict_index=first)
+            return
 
-            # Leader behavior: send periodic heartbeats
-            if self.state == LEADER:
-                if time.time() - self.last_heartbeat_time > 0.5:
-                    self.send_heartbeat()
-                    self.last_heartbeat_time = time.time()
+        index = prev_log_index
+        log_length = self.last_log_index()
+        appended = []
+        for entry in entries:
+            index += 1
+            if index <= self.last_log_index():
+                if self.log_term(index) == entry["term"]:
+                    continue  # already have it (duplicated or reordered message)
+                self.truncate_log(index)
+            self.log.append(entry)
+            appended.append(entry)
+        match_index = prev_log_index + len(entries)
+        if appended:
+            self.save_entries(self.last_log_index() - len(appended) + 1, appended, log_length)
 
-            # Follower and Candidate behavior: check election timeouts
-            if self.state in [FOLLOWER, CANDIDATE]:
-                if time.time() > self.election_timeout:
-                    self.start_election()
+        if msg["leader_commit"] > self.commit_index:
+            self.commit_index = max(self.commit_index, min(msg["leader_commit"], match_index))
+            self.apply_committed()
+        self.queue_ack(leader_id, msg["seq"], match_index)
 
-            time.sleep(0.05)
+    def queue_ack(self, leader_id, seq, match_index):
+        # Successes are cumulative, so one ack answers a whole batch of messages
+        ack = self.ack
+        if ack is not None and (ack["leader_id"], ack["term"]) != (leader_id, self.current_term):
+            self.flush_ack()
+            ack = None
+        if ack is None:
+            self.ack = {"leader_id": leader_id, "term": self.current_term, "seq": seq, "match_index": match_index}
+        else:
+            ack["seq"] = max(ack["seq"], seq)
+            ack["match_index"] = max(ack["match_index"], match_index)
 
-    def start_election(self):
-        self.state = CANDIDATE
-        self.current_term += 1
-        self.voted_for = self.node_id
-        self.votes_received = 1  # voted for self
-        print(f"Node {self.node_id}: Starting election for term {self.current_term}")
-        self.request_votes()
+    def flush_ack(self):
+        ack, self.ack = self.ack, None
+        if ack is None:
+            return
+        # The entries must be durable before the leader counts them
+        if self.storage is not None:
+            self.storage.sync()
+        self.send_message(ack["leader_id"], {
+            "type": APPEND_RESPONSE,
+            "term": ack["term"],
+            "follower_id": self.node_id,
+            "success": True,
+            "match_index": ack["match_index"],
+            "conflict_index": 0,
+            "prev_log_index": 0,
+            "incarnation": self.incarnation,
+            "seq": ack["seq"]
+        })
+
+    def truncate_log(self, index):
+        """Drops the entries from index on; they were never committed."""
+        del self.log[index - self.snapshot_index - 1:]
+        for pending_index in [i for i in self.pending if i >= index]:
+            _, future = self.pending.pop(pending_index)
+            future.set_exception(NotLeaderError(self.leader_id))
+
+    def send_append_response(self, leader_id, success, msg, match_index=0, conflict_index=0):
+        self.send_message(leader_id, {
+            "type": APPEND_RESPONSE,
+            "term": self.current_term,
+            "follower_id": self.node_id,
+            "success": success,
+            "match_index": match_index,
+            "conflict_index": conflict_index,
+            "prev_log_index": msg.get("prev_log_index", 0),
+            "incarnation": self.incarnation,
+            "seq": msg.get("seq", 0)
+        })
+
+    def handle_append_response(self, msg):
+        if msg["term"] > self.current_term:
+            self.step_down(msg["term"])
+            return
+        if self.state != LEADER or msg["term"] != self.current_term:
+            return
+
+        peer = msg["follower_id"]
+        known = self.peer_incarnations.get(peer)
+        if known is not None and msg["incarnation"] < known:
+            return  # sent by a process that has since been replaced
+        inflight = self.inflight[peer]
+        if known is not None and msg["incarnation"] > known:
+            # A new process on the peer's port has only what it acknowledges from now on
+            self.match_index[peer] = 0
+            inflight.clear()
+        self.peer_incarnations[peer] = msg["incarnation"]
+        # Any answer in this term confirms that the peer still follows us
+        self.acked_seq[peer] = max(self.acked_seq.get(peer, 0), msg["seq"])
+        if msg["success"]:
+            match_index = msg["match_index"]
+            if match_index > self.match_index[peer]:
+                self.match_index[peer] = match_index
+                self.last_progress[peer] = time.monotonic()
+                self.advance_commit_index()
+            while inflight and inflight[0] <= match_index:
+                inflight.popleft()
+            self.next_index[peer] = max(self.next_index[peer], match_index + 1)
+            self.send_entries(peer)
+        elif msg["prev_log_index"] < self.match_index[peer]:
+            # A late answer to a message sent before the peer caught up
+            pass
+        else:
+            next_index = max(self.match_index[peer] + 1, min(self.next_index[peer], msg["conflict_index"]))
+            # Messages in flight after a gap fail too; rewind only once for them
+            if next_index < self.next_index[peer] or not inflight:
+                self.next_index[peer] = next_index
+                inflight.clear()
+                self.send_entries(peer)
+        self.check_reads()
+
+    def advance_commit_index(self):
+        # The highest index stored on a majority; only entries of the current
+        # term are committed by counting replicas
+        matches = sorted([self.durable_index] + [self.match_index[p] for p in self.peers], reverse=True)
+        majority_index = matches[self.majority - 1]
+        if majority_index > self.commit_index and self.log_term(majority_index) == self.current_term:
+            self.commit_index = majority_index
+            self.apply_committed()
+            self.check_reads()
+
+    def apply_committed(self):
+        while self.last_applied < self.commit_index:
+            self.last_applied += 1
+            entry = self.entry(self.last_applied)
+            result, error = None, None
+            if entry["command"] is not None:
+                try:
+                    result = self.state_machine.apply(entry["command"])
+                except Exception as e:
+                    error = e
+            pending = self.pending.pop(self.last_applied, None)
+            if pending is None:
+                continue
+            term, future = pending
+            if term != entry["term"]:
+                future.set_exception(NotLeaderError(self.leader_id))
+            elif error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        if self.last_applied - self.snapshot_index >= self.snapshot_threshold:
+            self.take_snapshot()
+
+    def check_reads(self):
+        if not self.pending_reads:
+            return
+        remaining = []
+        for read in self.pending_reads:
+            seq, read_index, query, future = read
+            acks = 1 + sum(1 for p in self.peers if self.acked_seq.get(p, 0) >= seq)
+            if acks < self.majority or self.last_applied < read_index:
+                remaining.append(read)
+                continue
+            try:
+                future.set_result(query(self.state_machine))
+            except Exception as e:
+                future.set_exception(e)
+        self.pending_reads = remaining
+
+    # Snapshots
+
+    def take_snapshot(self):
+        """
+        Replaces the applied part of the log with a snapshot of the state
+        machine. Only the copy of the state is taken here; encoding and
+        saving it run on a helper thread, one snapshot at a time.
+        """
+        if self.snapshot_running:
+            return
+        self.snapshot_running = True
+        index = self.last_applied
+        args = (index, self.log_term(index), self.state_machine.snapshot())
+        threading.Thread(target=self.write_snapshot, args=args, daemon=True).start()
+
+    def write_snapshot(self, index, term, state):
+        data = json.dumps(state).encode('utf-8')
+        if self.storage is not None:
+            # Saved before the log is cut: until the WAL is rewritten, replay
+            # skips the entries the snapshot covers
+            self.storage.save_snapshot(index, term, data)
+        with self.lock:
+            self.snapshot_running = False
+            if index <= self.snapshot_index:
+                return  # a snapshot from the leader got further meanwhile
+            del self.log[:index - self.snapshot_index]
+            self.snapshot_index, self.snapshot_term, self.snapshot_data = index, term, data
+            self.trace(f"Snapshot at index {index} ({len(data)} bytes)")
+            self.start_compaction()
+
+    def start_snapshot_transfer(self, peer):
+        self.snapshot_transfers.add(peer)
+        header = {
+            "term": self.current_term,
+            "leader_id": self.node_id,
+            "last_included_index": self.snapshot_index,
+            "last_included_term": self.snapshot_term,
+            "size": len(self.snapshot_data)
+        }
+        self.trace(f"Sending snapshot at index {self.snapshot_index} to Node {peer}")
+        threading.Thread(target=self.send_snapshot, args=(peer, header, self.snapshot_data), daemon=True).start()
+
+    def send_snapshot(self, peer, header, data):
+        # Runs on its own thread: the transfer can take longer than heartbeats
+        reply = None
+        try:
+            with socket.create_connection(("localhost", self.snapshot_port(peer)), timeout=SNAPSHOT_TIMEOUT) as conn:
+                conn.sendall(json.dumps(header).encode('utf-8') + b"\n")
+                view = memoryview(data)
+                for offset in range(0, len(data), SNAPSHOT_CHUNK_SIZE):
+                    conn.sendall(view[offset:offset + SNAPSHOT_CHUNK_SIZE])
+                reply = json.loads(conn.makefile('rb').readline())
+        except (OSError, ValueError) as e:
+            self.trace(f"Snapshot transfer to Node {peer} failed: {e}")
+
+        with self.lock:
+            self.snapshot_transfers.discard(peer)
+            if reply is None:
+                return  # retried with the next heartbeat
+            if reply["term"] > self.current_term:
+                self.step_down(reply["term"])
+                return
+            if self.state != LEADER or self.current_term != header["term"] or not reply["success"]:
+                return
+            index = header["last_included_index"]
+            self.match_index[peer] = max(self.match_index[peer], index)
+            self.next_index[peer] = max(self.next_index[peer], index + 1)
+            self.last_progress[peer] = time.monotonic()
+            self.advance_commit_index()
+            self.send_entries(peer)
+
+    def accept_snapshot(self):
+        try:
+            conn, _ = self.snapshot_server.accept()
+        except OSError:
+            return
+        threading.Thread(target=self.receive_snapshot, args=(conn,), daemon=True).start()
+
+    def receive_snapshot(self, conn):
+        with conn:
+            try:
+                conn.settimeout(SNAPSHOT_TIMEOUT)
+                reader = conn.makefile('rb')
+                header = json.loads(reader.readline())
+                data = bytearray()
+                while len(data) < header["size"]:
+                    with self.lock:
+                        if header["term"] < self.current_term:
+                            break
+                        # A transfer in progress counts as contact with the leader
+                        self.election_timeout = self.reset_election_timeout()
+                    chunk = reader.read(min(SNAPSHOT_CHUNK_SIZE, header["size"] - len(data)))
+                    if not chunk:
+                        raise ConnectionError("Snapshot transfer ended early")
+                    data += chunk
+                data = bytes(data)
+                if len(data) == header["size"] and self.storage is not None:
+                    # Durable before it is installed, without holding the lock:
+                    # entries appended after it must never be in a WAL without it.
+                    # A snapshot only holds committed entries, so saving one that
+                    # is then refused (stale leader) is harmless
+                    self.storage.save_snapshot(header["last_included_index"], header["last_included_term"], data)
+                with self.lock:
+                    success = len(data) == header["size"] and self.install_snapshot(header, data)
+                    reply = {"term": self.current_term, "success": success}
+                conn.sendall(json.dumps(reply).encode('utf-8') + b"\n")
+            except (OSError, ValueError) as e:
+                self.trace(f"Snapshot transfer failed: {e}")
+
+    def install_snapshot(self, header, data):
+        if header["term"] < self.current_term:
+            return False
+        if header["term"] > self.current_term or self.state != FOLLOWER:
+            self.step_down(header["term"])
+        self.leader_id = header["leader_id"]
         self.election_timeout = self.reset_election_timeout()
 
+        index, term = header["last_included_index"], header["last_included_term"]
+        if index <= self.snapshot_index:
+            return True
+        if index <= self.last_log_index() and self.log_term(index) == term:
+            # The snapshot covers a prefix of our log; keep what follows
+            del self.log[:index - self.snapshot_index]
+        else:
+            self.truncate_log(self.snapshot_index + 1)
+        for pending_index in [i for i in self.pending if i <= index]:
+            _, future = self.pending.pop(pending_index)
+            future.set_exception(NotLeaderError(self.leader_id))
+
+        self.snapshot_index, self.snapshot_term, self.snapshot_data = index, term, data
+        if index > self.last_applied:
+            self.state_machine.restore(json.loads(data))
+            self.last_applied = index
+        self.commit_index = max(self.commit_index, index)
+        self.trace(f"Installed snapshot at index {index} from Node {self.leader_id}")
+        self.start_compaction()
+        return True
+
+    # Timers
+
+    def check_election_timeout(self):
+        # Handlers move self.election_timeout forward instead of rescheduling,
+        # so a timer that fires early just re-arms itself at the new deadline
+        if time.monotonic() >= self.election_timeout:
+            if self.state == LEADER:
+                self.election_timeout = self.reset_election_timeout()
+            else:
+                self.start_election()
+        self.call_at(self.election_timeout, self.check_election_timeout)
+
+    def heartbeat_tick(self, term):
+        # Leader behavior, until the term ends: heartbeats go only to peers
+        # that got no AppendEntries since the last tick (data traffic counts
+        # as a heartbeat), and a window without any acknowledgement for a
+        # whole interval is assumed lost and resent from the match index
+        if self.state != LEADER or self.current_term != term:
+            return
+        now = time.monotonic()
+        for p in self.peers:
+            if p in self.snapshot_transfers:
+                continue
+            if self.inflight[p] and now - self.last_progress[p] >= self.heartbeat_interval:
+                self.inflight[p].clear()
+                self.next_index[p] = self.match_index[p] + 1
+                self.send_entries(p)
+            elif now - self.last_sent[p] >= self.heartbeat_interval:
+                self.send_append_entries(p, max(self.match_index[p], self.snapshot_index), 0)
+        self.call_at(now + self.heartbeat_interval, lambda: self.heartbeat_tick(term))
+
+    def run_timers(self):
+        now = time.monotonic()
+        while self.timers and self.timers[0][0] <= now:
+            _, _, callback = heapq.heappop(self.timers)
+            callback()
+
+    def run(self):
+        self.trace(f"started as {self.state} on port {self.base_port + self.node_id}")
+        try:
+            while self.running:
+                with self.lock:
+                    timeout = max(0, self.timers[0][0] - time.monotonic()) if self.timers else None
+                woken = False
+                for key, _ in self.selector.select(timeout):
+                    if key.fileobj is self.sock:
+                        self.receive_messages()
+                    elif key.fileobj is self.snapshot_server:
+                        self.accept_snapshot()
+                    else:
+                        self.drain_wakeup()
+                        woken = True
+                if woken:
+                    self.replicate()
+                with self.lock:
+                    self.run_timers()
+        finally:
+            self.selector.close()
+            self.sock.close()
+            self.snapshot_server.close()
+            self.wakeup_reader.close()
+            self.wakeup_writer.close()
+            if self.storage is not None:
+                with self.lock:
+                    self.storage.close()
+
+    def drain_wakeup(self):
+        try:
+            while self.wakeup_reader.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
     def receive_messages(self):
-        while True:
+        for _ in range(RECV_BATCH):
             try:
-                data, addr = self.sock.recvfrom(4096)
-            except BlockingIOError:
+                data, addr = self.sock.recvfrom(65535)
+            except (BlockingIOError, OSError):
                 break
             msg = json.loads(data.decode('utf-8'))
             msg_type = msg.get("type")
 
-            if msg_type == REQUEST_VOTE:
-                self.handle_request_vote(msg, addr)
+            with self.lock:
+                if msg_type == REQUEST_VOTE:
+                    self.handle_request_vote(msg, addr)
+
+                elif msg_type == VOTE_RESPONSE:
+                    self.handle_vote_response(msg)
 
-            elif msg_type == VOTE_RESPONSE:
-                self.handle_vote_response(msg)
+                elif msg_type == APPEND_ENTRIES:
+                    self.handle_append_entries(msg)
 
-            elif msg_type == HEARTBEAT:
-                self.handle_heartbeat(msg)
+                elif msg_type == APPEND_RESPONSE:
+                    self.handle_append_response(msg)
+        with self.lock:
+            self.flush_ack()
 
     def stop(self):
         self.running = False
-        self.sock.close()
+        try:
+            self.wakeup_writer.send(b'x')
+        except OSError:
+            pass  # already stopped
+        with self.lock:
+            for _, future in self.pending.values():
+                future.set_exception(NotLeaderError(None))
+            self.pending = {}
+            for _, _, _, future in self.pending_reads:
+                future.set_exception(NotLeaderError(None))
+            self.pending_reads = []
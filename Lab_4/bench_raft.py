@@ -0,0 +1,85 @@
+"""
+Raft replication throughput on localhost: submits product create commands
+to the leader of an in-process cluster, keeping up to --outstanding of them
+uncommitted, and reports committed commands/s. Runs once with the default
+batching and pipelining and once per --window/--batch combination given.
+
+All nodes share one Python process (and its GIL), so the figures are a
+lower bound of what separate processes would reach.
+
+    python bench_raft.py --commands 50000 --nodes 5
+    python bench_raft.py --window 1 --batch 1    # unbatched, one message in flight
+"""
+import argparse
+import shutil
+import tempfile
+import threading
+import time
+
+from RaftNode import MAX_ENTRIES_PER_MESSAGE, MAX_INFLIGHT
+from main import find_leader, start_cluster, stop_cluster
+
+
+def run(num_nodes, commands, outstanding, max_batch, max_inflight, data_dir):
+    nodes = start_cluster(num_nodes, verbose=False, election_timeout=(0.3, 0.6), heartbeat_interval=0.1,
+                          max_batch=max_batch, max_inflight=max_inflight, data_dir=data_dir,
+                          snapshot_threshold=max(1000, commands))
+    try:
+        leader = find_leader(nodes)
+        slots = threading.BoundedSemaphore(outstanding)
+        done = threading.Event()
+        failed = []
+        remaining = [commands]
+        lock = threading.Lock()
+
+        def finished(future):
+            if future.exception() is not None:
+                failed.append(future.exception())
+            slots.release()
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    done.set()
+
+        started = time.perf_counter()
+        for i in range(commands):
+            slots.acquire()
+            leader.submit({"op": "create", "product": {
+                "name": f"Phone {i}", "url": f"https://example.com/{i}", "price_mdl": 4000 + i,
+                "display_size": 6.1, "price_eur": 210.0 + i}}).add_done_callback(finished)
+        done.wait()
+        elapsed = time.perf_counter() - started
+    finally:
+        stop_cluster(nodes)
+
+    print(f"batch {max_batch:>4}, window {max_inflight:>2}: {commands / elapsed:>9.0f} commands/s "
+          f"({commands} in {elapsed:.2f} s{', %d failed' % len(failed) if failed else ''})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, default=5)
+    parser.add_argument("--commands", type=int, default=20000)
+    parser.add_argument("--outstanding", type=int, default=5000, help="uncommitted commands at a time")
+    parser.add_argument("--batch", type=int, nargs="*", default=[], help="entries per AppendEntries to compare")
+    parser.add_argument("--window", type=int, nargs="*", default=[], help="in-flight windows to compare")
+    parser.add_argument("--data-dir", action="store_true", help="persist every node's log in a temporary WAL")
+    args = parser.parse_args()
+
+    settings = [(MAX_ENTRIES_PER_MESSAGE, MAX_INFLIGHT)]
+    for batch in args.batch or [MAX_ENTRIES_PER_MESSAGE]:
+        for window in args.window or [MAX_INFLIGHT]:
+            if (batch, window) not in settings:
+                settings.append((batch, window))
+
+    for max_batch, max_inflight in settings:
+        data_dir = tempfile.mkdtemp(prefix="bench_raft_") if args.data_dir else None
+        try:
+            run(args.nodes, args.commands, args.outstanding, max_batch, max_inflight, data_dir)
+        finally:
+            if data_dir:
+                shutil.rmtree(data_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,148 @@
-from RaftNode import RaftNode
+from RaftNode import RaftNode, LEADER
+import argparse
+import statistics
 import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def find_leader(nodes, timeout=10, poll_interval=0.1):
+    # Wait until one running node is leader
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        for node in nodes:
+            if node.running and node.state == LEADER:
+                return node
+        time.sleep(poll_interval)
+    raise RuntimeError("No leader elected")
 
-def main():
-    num_nodes = 5
-    nodes = []
-    peers = list(range(num_nodes))
 
-    for i in range(num_nodes):
-        node_peers = [p for p in peers if p != i]
-        node = RaftNode(i, node_peers, base_port=5000)
-        node.start()
-        nodes.append(node)
+def start_node(node_id, num_nodes, **options):
+    node_peers = [p for p in range(num_nodes) if p != node_id]
+    node = RaftNode(node_id, node_peers, base_port=5000, **options)
+    node.start()
+    return node
 
 
-    time.sleep(10)
+def start_cluster(num_nodes, **options):
+    return [start_node(i, num_nodes, **options) for i in range(num_nodes)]
 
+
+def stop_cluster(nodes):
     for node in nodes:
-        node.stop()
-        node.join()
+        if node.running:
+            node.stop()
+            node.join()
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def measure_elections(runs, num_nodes, election_timeout, heartbeat_interval):
+    """
+    Starts a fresh cluster `runs` times and reports the time until the first
+    leader is elected, and how much of it the winning election round took
+    (RequestVote out to majority of votes in, i.e. network and processing
+    time rather than the randomized timeout).
+    """
+    to_leader = []
+    rounds = []
+    for _ in range(runs):
+        started = time.monotonic()
+        nodes = start_cluster(num_nodes, election_timeout=election_timeout,
+                              heartbeat_interval=heartbeat_interval, verbose=False)
+        leader = find_leader(nodes, poll_interval=0.001)
+        to_leader.append(time.monotonic() - started)
+        rounds.append(leader.election_duration)
+        stop_cluster(nodes)
+
+    for name, values in (("time to leader", to_leader), ("election round", rounds)):
+        ms = [v * 1000 for v in values]
+        print(f"{name}: min {min(ms):.1f} ms, median {statistics.median(ms):.1f} ms, "
+              f"p95 {percentile(ms, 0.95):.1f} ms, max {max(ms):.1f} ms")
+
+
+def replace_node(num_products, snapshot_threshold):
+    """
+    Fills the catalog of a 5-node cluster through num_products proposals,
+    replaces a follower by a fresh node with an empty log, and reports how
+    long the new node takes to catch up with the leader's commit index.
+    """
+    num_nodes = 5
+    nodes = start_cluster(num_nodes, snapshot_threshold=snapshot_threshold, verbose=False)
+    leader = find_leader(nodes)
+
+    def create(i):
+        return leader.propose({"op": "create", "product": {
+            "name": f"Phone {i}", "url": f"https://example.com/{i}", "price_mdl": 4000 + i,
+            "display_size": 6.1, "price_eur": 210.0 + i}})
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        list(executor.map(create, range(num_products)))
+    print(f"Committed {num_products} products in {time.monotonic() - started:.1f} s, "
+          f"leader snapshot at index {leader.snapshot_index}, {len(leader.log)} entries in its log")
+
+    old = next(node for node in nodes if node is not leader)
+    old.stop()
+    old.join()
+    started = time.monotonic()
+    new = start_node(old.node_id, num_nodes, snapshot_threshold=snapshot_threshold, verbose=False)
+    nodes[nodes.index(old)] = new
+    target = leader.commit_index
+    while new.last_applied < target:
+        time.sleep(0.01)
+    print(f"Replacement Node {new.node_id} caught up to index {target} in {time.monotonic() - started:.2f} s "
+          f"(installed snapshot at index {new.snapshot_index}, {len(new.state_machine.products)} products)")
+    stop_cluster(nodes)
+
+
+def demo(data_dir=None):
+    nodes = start_cluster(5, data_dir=data_dir)
+
+    leader = find_leader(nodes)
+    print(f"Leader is Node {leader.node_id}")
+
+    # Writes go through the replicated log
+    phone = leader.propose({"op": "create", "product": {
+        "name": "Phone A", "url": "https://example.com/a", "price_mdl": 4999, "display_size": 6.1, "price_eur": 260.0}})
+    leader.propose({"op": "create", "product": {
+        "name": "Phone B", "url": "https://example.com/b", "price_mdl": 8999, "display_size": 6.7, "price_eur": 468.0}})
+    print("Updated:", leader.propose({"op": "update", "id": phone["id"], "changes": {"price_mdl": 4599}}))
+    print("Deleted:", leader.propose({"op": "delete", "name": "Phone B"}))
+    print("Products:", leader.read(lambda store: store.list()))
+
+    # The catalog survives the loss of the leader
+    leader.stop()
+    leader.join()
+    leader = find_leader(nodes)
+    print(f"New leader is Node {leader.node_id}")
+    print("Products:", leader.read(lambda store: store.list()))
+
+    stop_cluster(nodes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Raft cluster demo")
+    parser.add_argument("--elections", type=int, metavar="RUNS",
+                        help="measure time-to-leader over RUNS fresh clusters instead of running the demo")
+    parser.add_argument("--nodes", type=int, default=5)
+    parser.add_argument("--election-timeout", type=float, nargs=2, default=[0.15, 0.3], metavar=("MIN", "MAX"),
+                        help="election timeout range in seconds for --elections")
+    parser.add_argument("--heartbeat-interval", type=float, default=0.05)
+    parser.add_argument("--data-dir", help="keep each node's term, vote and log in a WAL under this directory")
+    parser.add_argument("--replace", type=int, metavar="PRODUCTS",
+                        help="create PRODUCTS products, then time the catch-up of a replaced follower")
+    parser.add_argument("--snapshot-threshold", type=int, default=1000)
+    args = parser.parse_args()
+
+    if args.replace:
+        replace_node(args.replace, args.snapshot_threshold)
+    elif args.elections:
+        measure_elections(args.elections, args.nodes, tuple(args.election_timeout), args.heartbeat_interval)
+    else:
+        demo(args.data_dir)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,141 @@
+import ftplib
+import queue
+import threading
+from io import BytesIO
+
+FTP_TIMEOUT = 30  # seconds per control/data connection operation
+FTP_BLOCK_SIZE = 64 * 1024
+FTP_QUEUE_BLOCKS = 16  # blocks buffered between a download and its consumer
+
+
+class TransferAborted(Exception):
+    pass
+
+
+class PersistentFTP:
+    """
+    One logged-in FTP session shared by the manager's threads. Commands are
+    serialized with a lock; before each operation the session is checked with
+    NOOP and re-established if the server dropped it (idle timeout, restart).
+    """
+
+    def __init__(self, host, user, password, timeout=FTP_TIMEOUT):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.timeout = timeout
+        self.ftp = None
+        self.lock = threading.Lock()
+
+    def connection(self):
+        """Returns a working session. Must be called with self.lock held."""
+        if self.ftp is not None:
+            try:
+                self.ftp.voidcmd('NOOP')
+                return self.ftp
+            except ftplib.all_errors:
+                self.close()
+        self.ftp = self.open_session()
+        return self.ftp
+
+    def open_session(self):
+        ftp = ftplib.FTP(self.host, timeout=self.timeout)
+        try:
+            ftp.login(self.user, self.password)
+            ftp.voidcmd('TYPE I')  # SIZE is only reliable in binary mode
+        except ftplib.all_errors:
+            ftp.close()
+            raise
+        return ftp
+
+    def close(self):
+        if self.ftp is None:
+            return
+        try:
+            self.ftp.close()
+        finally:
+            self.ftp = None
+
+    def run(self, operation):
+        with self.lock:
+            ftp = self.connection()
+            try:
+                return operation(ftp)
+            except Exception:
+                # The session may be in the middle of a transfer; start over next time
+                self.close()
+                raise
+
+    def stat(self, filename):
+        """
+        Returns (modification time, size) of a file, or None when it does not
+        exist. The modification time is None on servers without MDTM.
+        """
+        def query(ftp):
+            try:
+                size = ftp.size(filename)
+            except ftplib.error_perm:  # 550: no such file
+                return None
+            try:
+                modified = ftp.voidcmd(f'MDTM {filename}')[4:].strip()
+            except ftplib.error_perm:
+                modified = None
+            return modified, size
+
+        return self.run(query)
+
+    def upload(self, filename, content):
+        self.run(lambda ftp: ftp.storbinary(f'STOR {filename}', BytesIO(content)))
+
+    def iter_file(self, filename, blocksize=FTP_BLOCK_SIZE):
+        """
+        Yields the file block by block while it downloads. retrbinary runs on
+        a helper thread and hands blocks over through a bounded queue, so at
+        most FTP_QUEUE_BLOCKS blocks are held in memory whatever the file
+        size. Closing the generator early aborts the transfer.
+
+        The download uses its own short-lived session: its pace is set by the
+        consumer, and the shared session's lock must not wait on it.
+        """
+        blocks = queue.Queue(maxsize=FTP_QUEUE_BLOCKS)
+        abort = threading.Event()
+        done = object()
+
+        def put(item):
+            while not abort.is_set():
+                try:
+                    blocks.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+            raise TransferAborted()
+
+        def download():
+            try:
+                ftp = self.open_session()
+                try:
+                    ftp.retrbinary(f'RETR {filename}', put, blocksize)
+                finally:
+                    ftp.close()
+                put(done)
+            except TransferAborted:
+                pass
+            except Exception as e:
+                try:
+                    put(e)
+                except TransferAborted:
+                    pass
+
+        thread = threading.Thread(target=download, daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = blocks.get()
+                if item is done:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            abort.set()
+            thread.join()
@@ -7,8 +7,15 @@ import signal
 import sys
 import threading
 import os
-from ftplib import FTP
-from io import BytesIO
+import functools
+import ftplib
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from ftp_client import PersistentFTP
+# common/ sits at the repository root; the docker image copies it next to this file
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+from common.http_session import create_session
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -20,6 +27,9 @@ QUEUE_NAME = 'scraped_data'
 
 # Webserver configuration (LAB2 webserver for products)
 WEBSERVER_URL = 'http://webserver:5000/products'
+# Upsert by name: re-sending products that are already stored is not an error
+# and unchanged products are not written again
+WEBSERVER_PARAMS = {'mode': 'upsert'}
 
 # LAB2 webserver endpoint for file uploads (multipart)
 # Adjust if you have a different endpoint for file uploads.
@@ -30,14 +40,43 @@ FTP_HOST = os.getenv('FTP_HOST', 'ftp_server')
 FTP_USER = os.getenv('FTP_USER', 'user')
 FTP_PASS = os.getenv('FTP_PASS', 'password')
 FTP_FILENAME = 'processed_data.json'  #
-FTP_FETCH_INTERVAL = 30  # seconds
-
-# Retry configuration for sending data to webserver
+FTP_FETCH_INTERVAL = 30  # seconds, between MDTM/SIZE checks; the file is only re-sent when it changed
+
+# Consumer configuration: RabbitMQ hands out up to PREFETCH_COUNT unacked
+# messages and WORKER_COUNT threads process them concurrently. PREFETCH_COUNT
+# also caps the number of messages in one batch.
+PREFETCH_COUNT = int(os.getenv('PREFETCH_COUNT', 200))
+WORKER_COUNT = int(os.getenv('WORKER_COUNT', 4))
+
+# Micro-batching: messages are merged into one webserver write once their
+# products reach BATCH_MAX_ITEMS or the oldest one waited BATCH_MAX_WAIT_MS
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', 500))
+BATCH_MAX_WAIT_MS = int(os.getenv('BATCH_MAX_WAIT_MS', 200))
+
+# Retry configuration for sending data to webserver. A failed message is
+# parked in retry queue n for RETRY_DELAY * 2**n seconds, after which
+# RabbitMQ dead-letters it back to QUEUE_NAME; after MAX_RETRIES it goes to
+# FAILED_QUEUE_NAME.
 MAX_RETRIES = 5
-RETRY_DELAY = 5  # seconds
+RETRY_DELAY = 5  # seconds, doubled on every attempt
+RETRY_HEADER = 'x-retry-count'
+FAILED_QUEUE_NAME = f'{QUEUE_NAME}.failed'
 
 stop_thread = False  # To gracefully stop threads
 
+# Keep-alive connections to the webserver shared by the workers and the FTP
+# thread, see common/http_session.py for pool, timeout and retry settings
+session = create_session(pool_maxsize=WORKER_COUNT + 1)
+
+# One FTP login shared by the batch uploads and the fetch thread
+ftp_client = PersistentFTP(FTP_HOST, FTP_USER, FTP_PASS)
+
+# Every product accepted by the webserver, newest scrape per name. Written to
+# FTP_FILENAME as a whole after each batch, so the file stays a full snapshot
+# however the messages were batched.
+snapshot = {}
+snapshot_lock = threading.Lock()
+
 
 def connect_rabbitmq():
     connection = pika.BlockingConnection(
@@ -45,113 +84,306 @@ def connect_rabbitmq():
     )
     channel = connection.channel()
     channel.queue_declare(queue=QUEUE_NAME, durable=True)
+    for attempt in range(MAX_RETRIES):
+        channel.queue_declare(queue=retry_queue_name(attempt), durable=True, arguments={
+            'x-message-ttl': int(retry_delay(attempt) * 1000),
+            'x-dead-letter-exchange': '',
+            'x-dead-letter-routing-key': QUEUE_NAME,
+        })
+    channel.queue_declare(queue=FAILED_QUEUE_NAME, durable=True)
     return connection, channel
 
 
+def retry_queue_name(attempt):
+    return f'{QUEUE_NAME}.retry.{attempt}'
+
+
+def retry_delay(attempt):
+    return RETRY_DELAY * 2 ** attempt
+
+
 def upload_file_to_ftp(content: bytes):
     """
     Upload the given content to the FTP server as FTP_FILENAME.
     """
     try:
-        ftp = FTP(FTP_HOST)
-        ftp.login(FTP_USER, FTP_PASS)
-        # Store content as a file in the FTP server
-        bio = BytesIO(content)
-        ftp.storbinary(f'STOR {FTP_FILENAME}', bio)
-        ftp.quit()
+        ftp_client.upload(FTP_FILENAME, content)
         logger.info("Successfully uploaded file to FTP server.")
-    except Exception as e:
+    except ftplib.all_errors as e:
         logger.error(f"Error uploading file to FTP: {e}")
 
 
-def fetch_file_from_ftp():
+def load_snapshot():
     """
-    Fetch the file from the FTP server and return its content as bytes.
+    Seeds the snapshot from the file already on the FTP server, so a restart
+    does not shrink it to the products received since.
     """
     try:
-        ftp = FTP(FTP_HOST)
-        ftp.login(FTP_USER, FTP_PASS)
-        bio = BytesIO()
-        ftp.retrbinary(f'RETR {FTP_FILENAME}', bio.write)
-        ftp.quit()
-        bio.seek(0)
-        return bio.read()
-    except Exception as e:
-        logger.error(f"Error fetching file from FTP: {e}")
-        return None
+        if ftp_client.stat(FTP_FILENAME) is None:
+            return
+        data = json.loads(b''.join(ftp_client.iter_file(FTP_FILENAME)))
+    except (ftplib.all_errors + (ValueError,)) as e:
+        logger.error(f"Could not load {FTP_FILENAME} from FTP, starting with an empty snapshot: {e}")
+        return
+    products = data.get('filtered_products') if isinstance(data, dict) else None
+    with snapshot_lock:
+        for product in products if isinstance(products, list) else []:
+            if isinstance(product, dict) and isinstance(product.get('name'), str):
+                snapshot[product['name']] = product
+    logger.info(f"Loaded {len(snapshot)} products from {FTP_FILENAME}.")
+
+
+def update_snapshot(products):
+    """
+    Merges accepted products into the snapshot and uploads it. Uploads are
+    made under the lock so the file never goes back to an older snapshot.
+    """
+    with snapshot_lock:
+        for product in products:
+            name = product.get('name')
+            if isinstance(name, str) and not (name in snapshot and scraped_before(product, snapshot[name])):
+                snapshot[name] = product
+        stamps = [stamp for stamp in (parse_time(product.get('scraped_at')) for product in snapshot.values()) if stamp]
+        document = {
+            'filtered_products': list(snapshot.values()),
+            'total_sum_eur': round(sum(product.get('price_eur') or 0 for product in snapshot.values()), 2),
+            'timestamp_utc': max(stamps).isoformat() if stamps else None,
+        }
+        upload_file_to_ftp(json.dumps(document, indent=2).encode('utf-8'))
+
+
+def multipart_body(field, filename, content_type, chunks, boundary):
+    """
+    Generates a multipart/form-data body with a single file part around the
+    given chunks, so the file is never held in memory as a whole.
+    """
+    yield (f'--{boundary}\r\n'
+           f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+           f'Content-Type: {content_type}\r\n\r\n').encode('utf-8')
+    yield from chunks
+    yield f'\r\n--{boundary}--\r\n'.encode('utf-8')
 
 
-def send_file_to_webserver(file_content: bytes):
+def send_file_to_webserver(chunks):
     """
-    Send the fetched file as a multipart/form-data request to the LAB2 webserver.
+    Stream the file chunks as a multipart/form-data request to the LAB2
+    webserver. Returns True when the webserver accepted it.
     """
-    files = {
-        'file': (FTP_FILENAME, file_content, 'application/json')
-    }
+    boundary = uuid.uuid4().hex
+    body = multipart_body('file', FTP_FILENAME, 'application/json', chunks, boundary)
     try:
-        response = requests.post(WEBSERVER_FILE_UPLOAD_URL, files=files, timeout=10)
+        # A generator body is sent with chunked transfer encoding
+        response = session.post(WEBSERVER_FILE_UPLOAD_URL, data=body,
+                                headers={'Content-Type': f'multipart/form-data; boundary={boundary}'})
         if response.status_code == 201:
             logger.info("File successfully sent to webserver.")
-        else:
-            logger.error(
-                f"Failed to send file to webserver. Status Code: {response.status_code} Response: {response.text}")
-    except requests.exceptions.RequestException as e:
+            return True
+        logger.error(
+            f"Failed to send file to webserver. Status Code: {response.status_code} Response: {response.text}")
+    except (requests.exceptions.RequestException,) + ftplib.all_errors as e:
         logger.error(f"Error sending file to webserver: {e}")
+    finally:
+        body.close()  # stops the FTP download if the request ended early
+    return False
 
 
 def ftp_fetch_thread_func():
     """
-    Thread function that periodically fetches a file from the FTP server and sends it to the webserver.
+    Thread function that periodically checks the file on the FTP server and
+    sends it to the webserver when its modification time or size changed.
     """
+    last_sent = None
     while not stop_thread:
-        file_content = fetch_file_from_ftp()
-        if file_content:
-            send_file_to_webserver(file_content)
+        try:
+            stamp = ftp_client.stat(FTP_FILENAME)
+        except ftplib.all_errors as e:
+            logger.error(f"Error checking file on FTP: {e}")
+            stamp = None
+        if stamp is not None and stamp != last_sent:
+            if send_file_to_webserver(ftp_client.iter_file(FTP_FILENAME)):
+                last_sent = stamp
+        elif stamp is not None:
+            logger.info(f"{FTP_FILENAME} unchanged since the last upload, skipping.")
+        logger.info(f"HTTP connections: {session.stats.summary()}")
         time.sleep(FTP_FETCH_INTERVAL)
 
 
-def callback(ch, method, properties, body):
+def parse_message(body):
+    """
+    Returns the decoded message, or None when it is not a dict with a
+    'filtered_products' list.
+    """
     try:
         data = json.loads(body)
-        logger.info(f"Manager received data: {data}")
+    except json.JSONDecodeError:
+        logger.error("Invalid data format: message is not JSON.")
+        return None
+    logger.info(f"Manager received data: {data}")
 
-        # Extract 'filtered_products' from the data structure
-        filtered_products = data.get('filtered_products', [])
-        if not isinstance(filtered_products, list):
-            logger.error("Invalid data format: 'filtered_products' should be a list.")
-            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
-            return
+    # Extract 'filtered_products' from the data structure
+    if not isinstance(data, dict) or not isinstance(data.get('filtered_products', []), list):
+        logger.error("Invalid data format: 'filtered_products' should be a list.")
+        return None
+    data.setdefault('filtered_products', [])
+    return data
 
-        # Attempt to send data to webserver
-        attempt = 0
-        while attempt < MAX_RETRIES:
-            try:
-                response = requests.post(WEBSERVER_URL, json=filtered_products, timeout=10)
-                if response.status_code == 201:
-                    logger.info("Data successfully sent to webserver.")
-
-                    # Once data is successfully sent, write to file and upload to FTP
-                    file_content = json.dumps(data, indent=2).encode('utf-8')
-                    upload_file_to_ftp(file_content)
-
-                    ch.basic_ack(delivery_tag=method.delivery_tag)
-                    break
-                else:
-                    logger.error(
-                        f"Failed to send data to webserver. Status Code: {response.status_code} Response: {response.text}")
-            except requests.exceptions.RequestException as e:
-                logger.error(f"Error sending data to webserver: {e}")
-
-            attempt += 1
-            logger.info(f"Retrying in {RETRY_DELAY} seconds... (Attempt {attempt}/{MAX_RETRIES})")
-            time.sleep(RETRY_DELAY)
+
+def parse_time(value):
+    """An ISO 8601 timestamp as an aware datetime, or None when missing or invalid."""
+    if not isinstance(value, str):
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def scraped_before(product, other):
+    """True when both products have a scrape time and product's is older."""
+    product_time, other_time = parse_time(product.get('scraped_at')), parse_time(other.get('scraped_at'))
+    return product_time is not None and other_time is not None and product_time < other_time
+
+
+def merge_products(batch):
+    """
+    Merges the filtered_products of several messages, the newest scrape
+    winning for a name that appears more than once (the later message on a
+    tie). Each product is stamped with its message's timestamp_utc as
+    scraped_at, which the webserver uses to ignore writes older than the
+    stored row. Returns the products and, for each of them, the indexes of
+    the messages it came from.
+    """
+    merged = {}
+    for index, data in enumerate(batch):
+        scraped_at = parse_time(data.get('timestamp_utc'))
+        for position, product in enumerate(data['filtered_products']):
+            name = product.get('name') if isinstance(product, dict) else None
+            if scraped_at is not None and isinstance(product, dict) and 'scraped_at' not in product:
+                product = dict(product, scraped_at=scraped_at.isoformat())
+            # Products without a name are kept apart so the webserver reports them
+            key = name if isinstance(name, str) else (index, position)
+            previous, sources = merged.get(key, (None, set()))
+            if previous is not None and scraped_before(product, previous):
+                product = previous
+            merged[key] = (product, sources | {index})
+    products = [product for product, _ in merged.values()]
+    sources = [sources for _, sources in merged.values()]
+    return products, sources
+
+
+def process_batch(batch):
+    """
+    Sends the products of a batch of messages to the webserver in one upsert
+    and uploads the batch to FTP once. Runs on a worker thread and returns an
+    outcome per message: 'ack', 'retry' or 'fail'.
+    """
+    products, sources = merge_products(batch)
+    total = sum(len(data['filtered_products']) for data in batch)
+    try:
+        response = session.post(WEBSERVER_URL, params=WEBSERVER_PARAMS, json=products)
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Error sending data to webserver: {e}")
+        return ['retry'] * len(batch)
+    if response.status_code != 201:
+        logger.error(
+            f"Failed to send data to webserver. Status Code: {response.status_code} Response: {response.text}")
+        # The same payload will be rejected again; only server errors are retried
+        return ['fail' if 400 <= response.status_code < 500 else 'retry'] * len(batch)
+
+    result = response.json()
+    logger.info(f"Batch of {len(batch)} messages ({total} products, {len(products)} after de-duplication) "
+                f"sent to webserver: {result.get('inserted')} inserted, {result.get('updated')} updated, "
+                f"{result.get('unchanged')} unchanged.")
+
+    # Messages whose products were rejected go to the failed queue, the rest are acked
+    rejected = {error['product_index'] - 1 for error in result.get('errors', []) if 'product_index' in error}
+    failed = set().union(*(sources[index] for index in rejected if index < len(sources)))
+    outcomes = ['fail' if index in failed else 'ack' for index in range(len(batch))]
+
+    # Once data is successfully sent, update the snapshot on FTP
+    update_snapshot([product for index, product in enumerate(products) if index not in rejected])
+    return outcomes
+
+
+def finish_message(channel, method, properties, body, outcome):
+    """
+    Acks a processed message, first republishing it to a retry queue or to the
+    failed queue when needed. Runs on the connection thread: pika channels
+    must not be used from the workers.
+    """
+    headers = dict(properties.headers or {})
+    if outcome == 'retry':
+        attempt = headers.get(RETRY_HEADER, 0)
+        if attempt < MAX_RETRIES:
+            headers[RETRY_HEADER] = attempt + 1
+            channel.basic_publish(exchange='', routing_key=retry_queue_name(attempt), body=body,
+                                  properties=pika.BasicProperties(delivery_mode=2, headers=headers))
+            logger.info(f"Retrying in {retry_delay(attempt)} seconds... (Attempt {attempt + 1}/{MAX_RETRIES})")
         else:
-            logger.error("Max retries reached. Message will be requeued.")
-            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+            logger.error("Max retries reached.")
+            outcome = 'fail'
+    if outcome == 'fail':
+        channel.basic_publish(exchange='', routing_key=FAILED_QUEUE_NAME, body=body,
+                              properties=pika.BasicProperties(delivery_mode=2, headers=headers))
+        logger.error(f"Message moved to {FAILED_QUEUE_NAME}.")
+    channel.basic_ack(delivery_tag=method.delivery_tag)
 
-    except Exception as e:
-        logger.error(f"Error processing message: {e}")
-        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+
+class Batcher:
+    """
+    basic_consume callback that collects deliveries and hands them to the
+    worker pool as one batch, so a slow webserver call never blocks the
+    consumer. Everything except the worker runs on the connection thread.
+    """
+
+    def __init__(self, connection, channel, executor):
+        self.connection = connection
+        self.channel = channel
+        self.executor = executor
+        self.messages = []  # (method, properties, body, data)
+        self.items = 0
+        self.timer = None
+
+    def __call__(self, channel, method, properties, body):
+        data = parse_message(body)
+        if data is None:
+            finish_message(channel, method, properties, body, 'fail')
+            return
+        self.messages.append((method, properties, body, data))
+        self.items += len(data['filtered_products'])
+        if self.items >= BATCH_MAX_ITEMS:
+            self.flush()
+        elif self.timer is None:
+            self.timer = self.connection.call_later(BATCH_MAX_WAIT_MS / 1000, self.on_timer)
+
+    def on_timer(self):
+        self.timer = None
+        self.flush()
+
+    def flush(self):
+        if self.timer is not None:
+            self.connection.remove_timeout(self.timer)
+            self.timer = None
+        messages, self.messages, self.items = self.messages, [], 0
+        if messages:
+            self.executor.submit(self.work, messages)
+
+    def work(self, messages):
+        try:
+            outcomes = process_batch([data for _, _, _, data in messages])
+        except Exception as e:
+            logger.error(f"Error processing batch: {e}")
+            outcomes = ['retry'] * len(messages)
+        try:
+            self.connection.add_callback_threadsafe(functools.partial(self.finish, messages, outcomes))
+        except Exception as e:
+            # The connection is gone; RabbitMQ redelivers the unacked messages
+            logger.error(f"Could not ack batch: {e}")
+
+    def finish(self, messages, outcomes):
+        for (method, properties, body, _), outcome in zip(messages, outcomes):
+            finish_message(self.channel, method, properties, body, outcome)
 
 
 def signal_handler(sig, frame):
@@ -162,25 +394,37 @@ def signal_handler(sig, frame):
 
 
 def main():
+    global stop_thread
     # Handle graceful shutdown
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
 
+    load_snapshot()
+
     # Start the FTP fetch thread
     thread = threading.Thread(target=ftp_fetch_thread_func, daemon=True)
     thread.start()
 
     connection, channel = connect_rabbitmq()
-    channel.basic_qos(prefetch_count=1)
-    channel.basic_consume(queue=QUEUE_NAME, on_message_callback=callback)
+    channel.basic_qos(prefetch_count=PREFETCH_COUNT)
+    executor = ThreadPoolExecutor(max_workers=WORKER_COUNT)
+    batcher = Batcher(connection, channel, executor)
+    channel.basic_consume(queue=QUEUE_NAME, on_message_callback=batcher)
 
-    logger.info("Manager started consuming messages and FTP thread started.")
+    logger.info(f"Manager started consuming messages with {WORKER_COUNT} workers and FTP thread started.")
     try:
         channel.start_consuming()
     except Exception as e:
         logger.error(f"Manager encountered an error: {e}")
     finally:
-        connection.close()
+        batcher.flush()
+        executor.shutdown(wait=True)
+        try:
+            # Send the acks queued by the workers that just finished
+            connection.process_data_events(time_limit=0)
+            connection.close()
+        except Exception as e:
+            logger.error(f"Error closing RabbitMQ connection: {e}")
         stop_thread = True
         thread.join()
 
@@ -0,0 +1,250 @@
+import json
+import os
+import struct
+import threading
+import zlib
+
+# Each WAL record is a header (payload length, crc32 of the payload) and a
+# JSON payload. Records:
+#   {"type": "state", "term": 3, "voted_for": 1}
+#   {"type": "entries", "index": 7, "entries": [...]}  log[index:] = entries
+# Entries covered by the snapshot are skipped on replay.
+HEADER = struct.Struct(">II")
+WAL_NAME = "wal.log"
+
+# The latest snapshot: a JSON header line {"index", "term"} followed by the
+# serialized state machine
+SNAPSHOT_NAME = "snapshot"
+
+# Rewrite the WAL once it holds this many superseded records (old state
+# records, overwritten entries) and more of them than live ones
+COMPACT_MIN_DEAD = 1000
+
+
+class RaftStorage:
+    """
+    Durable term, vote and log of one RaftNode, kept in an append-only
+    write-ahead log in data_dir, plus the latest state machine snapshot,
+    which replaces the log up to its index.
+
+    Writes only append to the file; sync(seq) makes everything up to the
+    write numbered seq durable. Concurrent callers share fsyncs (group
+    commit): the first one to need one fsyncs everything written so far,
+    and callers arriving meanwhile are covered by the next one.
+    """
+
+    def __init__(self, data_dir, fsync=True):
+        self.data_dir = data_dir
+        self.path = os.path.join(data_dir, WAL_NAME)
+        self.snapshot_path = os.path.join(data_dir, SNAPSHOT_NAME)
+        self.fsync = fsync
+        os.makedirs(data_dir, exist_ok=True)
+
+        self.cond = threading.Condition()
+        self.written = 0  # seq of the last write
+        self.synced = 0   # seq of the last write known to be durable
+        self.syncing = False
+        self.fsyncs = 0
+        self.snapshot_lock = threading.Lock()
+
+        # While a rewrite of the WAL runs (begin_compact() to the end of
+        # compact()), writes are also kept here to be carried over
+        self.carried = None
+        self.carried_dead = 0
+
+        # State recovered on startup, which the node takes over: entries
+        # holds the log after the snapshot (index, term, data) or from index 1
+        self.term, self.voted_for, self.entries = 0, None, []
+        self.snapshot = None
+        self.snapshot_index = 0
+        self.dead = 0
+        self.load_snapshot()
+        self.replay()
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.sync_dir()
+
+    def load_snapshot(self):
+        if not os.path.exists(self.snapshot_path):
+            return
+        with open(self.snapshot_path, "rb") as f:
+            header = json.loads(f.readline())
+            data = f.read()
+        self.snapshot = (header["index"], header["term"], data)
+        self.snapshot_index = header["index"]
+
+    def replay(self):
+        """
+        Rebuilds term, vote and log from the WAL. A torn or corrupt record
+        at the end (crash in the middle of a write) and anything after it
+        are cut off.
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            data = f.read()
+        view = memoryview(data)
+        offset = 0
+        while offset + HEADER.size <= len(data):
+            length, crc = HEADER.unpack_from(data, offset)
+            payload = view[offset + HEADER.size:offset + HEADER.size + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            self.load(json.loads(bytes(payload)))
+            offset += HEADER.size + length
+        if offset < len(data):
+            print(f"WAL {self.path}: dropping {len(data) - offset} bytes of incomplete records")
+            os.truncate(self.path, offset)
+
+    def load(self, record):
+        if record["type"] == "state":
+            self.dead += 1
+            self.term, self.voted_for = record["term"], record["voted_for"]
+        elif record["type"] == "entries":
+            start = record["index"] - self.snapshot_index - 1
+            entries = record["entries"]
+            if start < 0:
+                self.dead += min(-start, len(entries))
+                entries = entries[-start:]
+                start = 0
+            self.dead += max(0, len(self.entries) - start)
+            del self.entries[start:]
+            self.entries.extend(entries)
+
+    @staticmethod
+    def encode(record):
+        payload = json.dumps(record, separators=(",", ":")).encode("utf-8")
+        return HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+    def write(self, record, dead=0):
+        data = self.encode(record)
+        with self.cond:
+            os.write(self.fd, data)
+            if self.carried is not None:
+                self.carried.append(data)
+            self.dead += dead
+            self.written += 1
+            return self.written
+
+    def save_state(self, term, voted_for):
+        return self.write({"type": "state", "term": term, "voted_for": voted_for}, dead=1)
+
+    def save_entries(self, index, entries, log_length):
+        """
+        Stores entries at log index `index` onwards, replacing what the log
+        (of log_length entries before the change) held from there on.
+        """
+        return self.write({"type": "entries", "index": index, "entries": entries},
+                          dead=max(0, log_length - index + 1))
+
+    def sync(self, seq=None):
+        """Returns once the write numbered seq (default: the last one) is durable."""
+        with self.cond:
+            if seq is None:
+                seq = self.written
+            while self.synced < seq:
+                if self.syncing:
+                    self.cond.wait()
+                    continue
+                self.syncing = True
+                target = self.written
+                self.cond.release()
+                try:
+                    if self.fsync:
+                        os.fsync(self.fd)
+                finally:
+                    self.cond.acquire()
+                    self.syncing = False
+                    self.cond.notify_all()
+                self.synced = max(self.synced, target)
+                self.fsyncs += 1
+
+    def should_compact(self, log_length):
+        return self.dead >= COMPACT_MIN_DEAD and self.dead > log_length
+
+    def save_snapshot(self, index, term, data):
+        """
+        Replaces the snapshot file (written next to it, fsynced and renamed
+        over it), unless it already holds one at index or later or the
+        storage is closed. Returns whether it was written. The log entries it
+        covers should then be dropped with compact().
+        """
+        with self.snapshot_lock:
+            if index <= self.snapshot_index or self.fd < 0:
+                return False
+            tmp_path = self.snapshot_path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(json.dumps({"index": index, "term": term}).encode("utf-8") + b"\n")
+                f.write(data)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+            self.sync_dir()
+            self.snapshot_index = index
+            return True
+
+    def begin_compact(self):
+        """
+        Starts a rewrite of the WAL unless one is running already; call it
+        while taking the state to pass to compact(). Returns False when the
+        rewrite should be skipped.
+        """
+        with self.cond:
+            if self.carried is not None or self.fd < 0:
+                return False
+            self.carried = []
+            self.carried_dead = self.dead
+            return True
+
+    def compact(self, term, voted_for, first_index, entries):
+        """
+        Replaces the WAL with one state record, one record holding the log
+        from first_index on (after the snapshot), and the records written
+        since begin_compact(). The new file is written and fsynced next to
+        the old one and renamed over it, so a crash leaves one of the two
+        intact. Writes go on meanwhile; only the final swap holds them up.
+        """
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(self.encode({"type": "state", "term": term, "voted_for": voted_for}))
+                f.write(self.encode({"type": "entries", "index": first_index, "entries": entries}))
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+            with self.cond:
+                while self.syncing:
+                    self.cond.wait()
+                with open(tmp_path, "ab") as f:
+                    f.write(b"".join(self.carried))
+                    f.flush()
+                    if self.fsync:
+                        os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+                self.sync_dir()
+                os.close(self.fd)
+                self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+                self.synced = self.written  # everything written so far is in the new file
+                self.dead -= self.carried_dead
+        finally:
+            with self.cond:
+                self.carried = None
+                self.cond.notify_all()
+
+    def sync_dir(self):
+        # Makes the creation or rename of the WAL itself durable
+        if not self.fsync:
+            return
+        fd = os.open(self.data_dir, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def close(self):
+        # Waits for a snapshot or WAL rewrite still running on a helper thread
+        with self.snapshot_lock, self.cond:
+            while self.syncing or self.carried is not None:
+                self.cond.wait()
+            os.close(self.fd)
+            self.fd = -1
@@ -0,0 +1,67 @@
+"""
+Compares the HTML extractor backends on saved ultra.md pages.
+
+    python bench_extractors.py [--rounds 50] [--fixtures fixtures]
+
+Every backend must return exactly what the BeautifulSoup backend returns,
+otherwise the benchmark stops before timing anything.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+from common.extractors import available_extractors, get_extractor
+
+
+def load_fixture(fixtures_dir, name):
+    with open(os.path.join(fixtures_dir, name), 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def time_call(func, html, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func(html)
+    return (time.perf_counter() - start) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=50)
+    parser.add_argument('--fixtures', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures'))
+    args = parser.parse_args()
+
+    category_html = load_fixture(args.fixtures, 'category.html')
+    product_html = load_fixture(args.fixtures, 'product.html')
+
+    names = available_extractors()
+    extractors = {name: get_extractor(name) for name in names}
+
+    reference = extractors.get('bs4')
+    if reference is not None:
+        expected_listing = reference.extract_listing(category_html)
+        expected_display_size = reference.extract_display_size(product_html)
+        for name, extractor in extractors.items():
+            if extractor.extract_listing(category_html) != expected_listing:
+                raise SystemExit(f"{name}: listing differs from bs4")
+            if extractor.extract_display_size(product_html) != expected_display_size:
+                raise SystemExit(f"{name}: display size differs from bs4")
+        print(f"All backends agree: {len(expected_listing)} products, display size {expected_display_size}")
+    else:
+        print("bs4 is not installed, results are not cross-checked")
+
+    print(f"{'backend':<8} {'listing ms':>12} {'product ms':>12} {'cycle ms (1 listing + 60 products)':>36}")
+    baseline = None
+    for name, extractor in extractors.items():
+        listing = time_call(extractor.extract_listing, category_html, args.rounds) * 1000
+        product = time_call(extractor.extract_display_size, product_html, args.rounds) * 1000
+        cycle = listing + 60 * product
+        if baseline is None:
+            baseline = cycle
+        print(f"{name:<8} {listing:>12.2f} {product:>12.2f} {cycle:>25.1f} ({baseline / cycle:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
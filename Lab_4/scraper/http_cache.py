@@ -0,0 +1,95 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(content: bytes):
+    return hashlib.sha256(content).hexdigest()
+
+
+class HTTPCache:
+    """
+    On-disk cache of the pages the scraper has seen, keyed by URL.
+
+    For every URL it keeps the validators sent back by the server (ETag and
+    Last-Modified), a hash of the body and the data that was parsed out of it,
+    so an unchanged page never has to be parsed again. It also remembers the
+    last published version of every product to compute the delta to publish.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.index_path = os.path.join(cache_dir, 'index.json')
+        self.lock = threading.Lock()
+        self.pages = {}
+        self.published = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            self.pages = index.get('pages', {})
+            self.published = index.get('published', {})
+            logger.info(f"Loaded HTTP cache with {len(self.pages)} pages from {self.index_path}")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.error(f"Ignoring unreadable HTTP cache {self.index_path}: {e}")
+
+    def save(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with self.lock:
+            index = {'pages': self.pages, 'published': self.published}
+            # Write to a temporary file first so a crash never leaves a half-written index
+            tmp_path = self.index_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(index, f)
+            os.replace(tmp_path, self.index_path)
+
+    def get(self, url):
+        with self.lock:
+            return self.pages.get(url)
+
+    def conditional_headers(self, url):
+        entry = self.get(url)
+        headers = {}
+        if entry and entry.get('data') is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def store(self, url, etag, last_modified, body_hash, data):
+        with self.lock:
+            self.pages[url] = {
+                'etag': etag,
+                'last_modified': last_modified,
+                'content_hash': body_hash,
+                'data': data
+            }
+
+    def refresh_validators(self, url, etag, last_modified):
+        # A 200 with an identical body can still carry new validators
+        with self.lock:
+            entry = self.pages.get(url)
+            if entry:
+                entry['etag'] = etag or entry.get('etag')
+                entry['last_modified'] = last_modified or entry.get('last_modified')
+
+    def changed_products(self, products):
+        """
+        Return the products that are new or differ from what was last published.
+        """
+        with self.lock:
+            return [p for p in products if self.published.get(p['name']) != p]
+
+    def mark_published(self, products):
+        with self.lock:
+            for product in products:
+                self.published[product['name']] = product
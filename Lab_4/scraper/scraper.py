@@ -1,14 +1,22 @@
 import requests
-from bs4 import BeautifulSoup
 from functools import reduce
 from datetime import datetime
 import pytz
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlparse
 import pika
 import json
 import time
 import logging
 import sys
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import namedtuple
+from http_cache import HTTPCache, content_hash
+# common/ sits at the repository root; the docker image copies it next to this file
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+from common.extractors import get_extractor
+from common.http_session import create_session
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -35,24 +43,102 @@ QUEUE_NAME = 'scraped_data'
 MAX_RETRIES = 10
 RETRY_DELAY = 5  # seconds
 
+# Product page fetching: number of pages fetched in parallel and the maximum
+# number of requests per second sent to a single host (0 disables the limit)
+FETCH_CONCURRENCY = int(os.getenv('FETCH_CONCURRENCY', 8))
+MAX_REQUESTS_PER_HOST_PER_SECOND = float(os.getenv('MAX_REQUESTS_PER_HOST_PER_SECOND', 10))
 
-def fetch_http(full_url):
+
+class HostRateLimiter:
+    """
+    Spaces out requests to the same host so that at most `rate` requests per
+    second are started, no matter how many worker threads are fetching.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.next_slot = {}
+        self.lock = threading.Lock()
+
+    def wait(self, host):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+rate_limiter = HostRateLimiter(MAX_REQUESTS_PER_HOST_PER_SECOND)
+
+# One keep-alive connection per fetch thread and host, see common/http_session.py
+session = create_session(pool_maxsize=FETCH_CONCURRENCY)
+
+# HTML extraction backend: "stream" (default), "lxml" or "bs4", see common/extractors.py
+extractor = get_extractor(os.getenv('HTML_EXTRACTOR'))
+
+# Pages are cached on disk between scrape cycles (and container restarts)
+HTTP_CACHE_DIR = os.getenv('HTTP_CACHE_DIR', '.http_cache')
+http_cache = HTTPCache(HTTP_CACHE_DIR)
+
+# Result of a conditional fetch; html is None when the page did not change
+FetchResult = namedtuple('FetchResult', ['html', 'etag', 'last_modified', 'content_hash'])
+
+
+def fetch_http(full_url, headers=None):
     """
-    Fetches a web page using the requests library.
+    Fetches a web page over the shared session's pooled connections.
     """
+    rate_limiter.wait(urlparse(full_url).netloc)
     try:
-        response = requests.get(full_url, headers={
+        response = session.get(full_url, headers={
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
                           "AppleWebKit/537.36 (KHTML, like Gecko) "
-                          "Chrome/58.0.3029.110 Safari/537.3"
+                          "Chrome/58.0.3029.110 Safari/537.3",
+            **(headers or {})
         })
         response.raise_for_status()  # Raise an exception for HTTP errors
-        return response.text
+        return response
     except requests.exceptions.RequestException as e:
         logger.error(f"Error fetching {full_url}: {e}")
         raise
 
 
+def fetch_conditional(full_url):
+    """
+    Fetches a web page with If-None-Match / If-Modified-Since taken from the cache.
+    A 304 answer or a body with the same hash as last time counts as unchanged.
+    """
+    response = fetch_http(full_url, headers=http_cache.conditional_headers(full_url))
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+
+    if response.status_code == 304:
+        return FetchResult(None, etag, last_modified, None)
+
+    body_hash = content_hash(response.content)
+    entry = http_cache.get(full_url)
+    if entry and entry.get('data') is not None and entry.get('content_hash') == body_hash:
+        return FetchResult(None, etag, last_modified, body_hash)
+    return FetchResult(response.text, etag, last_modified, body_hash)
+
+
+def parse_cached(full_url, result, parse):
+    """
+    Returns the data parsed out of a fetched page, reusing the cached data when
+    the page did not change so only new content is parsed.
+    """
+    if result.html is None:
+        http_cache.refresh_validators(full_url, result.etag, result.last_modified)
+        return http_cache.get(full_url)['data']
+
+    data = parse(result.html)
+    http_cache.store(full_url, result.etag, result.last_modified, result.content_hash, data)
+    return data
+
+
 def connect_rabbitmq():
     attempt = 0
     while attempt < MAX_RETRIES:
@@ -85,52 +171,60 @@ def publish_to_rabbitmq(channel, data):
     logger.info(f"Scraper published data to RabbitMQ: {data}")
 
 
+def parse_category_page(html):
+    candidates = []
+
+    for link_text, link_href, price_text in extractor.extract_listing(html):
+        if not link_text or len(link_text) < 5:
+            continue
+
+        if not link_href.startswith('http'):
+            link_href = urljoin(f"{PROTOCOL}{HOST}", link_href)
+
+        candidates.append([link_text, link_href, price_text])
+
+    return candidates
+
+
+def parse_product_page(html):
+    return extractor.extract_display_size(html)
+
+
+def fetch_product_page(link_href):
+    try:
+        return fetch_conditional(link_href)
+    except Exception as e:
+        logger.error(f"Error fetching product page {link_href}: {e}")
+        return None
+
+
 def scrape_and_publish():
     # Scraping logic as provided in the original task
     try:
         main_page_url = f"{PROTOCOL}{HOST}{url}"
-        main_page_html = fetch_http(main_page_url)
+        main_page = fetch_conditional(main_page_url)
     except Exception as e:
         logger.error(f"Error fetching main page: {e}")
         return None
 
-    soup = BeautifulSoup(main_page_html, 'html.parser')
+    candidates = parse_cached(main_page_url, main_page, parse_category_page)
 
-    all_links = soup.find_all('a', class_='product-text pt-4 font-semibold text-gray-900 transition duration-200 hover:text-red-500 dark:text-white sm:text-sm')
-    all_prices = soup.find_all('span', class_='text-blue text-xl font-bold dark:text-white')
+    # Product pages are fetched in parallel; map() hands the results back in
+    # page order, so the output is the same as fetching them one by one
+    with ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY) as executor:
+        pages = list(executor.map(fetch_product_page, [href for _, href, _ in candidates]))
 
     products = []
+    parsed_pages = 0
 
-    for link, price in zip(all_links, all_prices):
-        link_text = link.text.strip()
-        link_href = link.get('href')
-
-        if not link_text or len(link_text) < 5:
+    for (link_text, link_href, price_text), product_page in zip(candidates, pages):
+        if product_page is None:
             continue
 
-        if not link_href.startswith('http'):
-            link_href = urljoin(f"{PROTOCOL}{HOST}", link_href)
+        if product_page.html is not None:
+            parsed_pages += 1
+        display_size = parse_cached(link_href, product_page, parse_product_page)
 
-        try:
-            product_page_html = fetch_http(link_href)
-        except Exception as e:
-            logger.error(f"Error fetching product page {link_href}: {e}")
-            continue
-
-        product_soup = BeautifulSoup(product_page_html, 'html.parser')
-
-        display_size = "N/A"
-        summary_section = product_soup.find('div', class_='mt-[18px] lg:mt-6 mb-2 lg:mb-16')
-        if summary_section:
-            list_items = summary_section.find_all('li')
-            for li in list_items:
-                if "Rezolutia ecranului" in li.text:
-                    display_size_span = li.find_next('span', class_='font-bold text-black')
-                    if display_size_span:
-                        display_size = display_size_span.text.strip()
-                    break
-
-        price_text = price.text.strip()
         price_int = ''.join(filter(str.isdigit, price_text))
 
         if price_int.isdigit():
@@ -156,12 +250,21 @@ def scrape_and_publish():
 
     total_sum_eur = reduce(lambda total, product: total + product['price_eur'], filtered_products, 0)
 
+    # Only products that are new or changed since the last publish are sent,
+    # the total still covers every product currently in the price range
+    changed_products = http_cache.changed_products(filtered_products)
+    logger.info(f"Parsed {parsed_pages} of {len(pages)} product pages, "
+                f"{len(changed_products)} of {len(filtered_products)} products changed")
+    logger.info(f"HTTP connections: {session.stats.summary()}")
+
     final_data_structure = {
-        'filtered_products': filtered_products,
+        'filtered_products': changed_products,
         'total_sum_eur': round(total_sum_eur, 2),
         'timestamp_utc': datetime.now(pytz.UTC).isoformat()
     }
 
+    http_cache.save()
+
     logger.info(f"Scraped and filtered data: {final_data_structure}")
     return final_data_structure
 
@@ -173,8 +276,10 @@ def main():
             data = scrape_and_publish()
             if data and data['filtered_products']:
                 publish_to_rabbitmq(channel, data)
+                http_cache.mark_published(data['filtered_products'])
+                http_cache.save()
             else:
-                logger.warning("No data scraped or all products filtered out. Skipping publish.")
+                logger.warning("No data scraped or no product changed since the last publish. Skipping publish.")
             time.sleep(60)  # Scrape every 60 seconds
     except KeyboardInterrupt:
         logger.info("Scraper stopped by user.")
@@ -0,0 +1,111 @@
+class StateMachine:
+    """
+    State replicated by RaftNode. apply() is called with every committed
+    command, in log order, on every node, so it must be deterministic: the
+    same commands must produce the same state and results everywhere. An
+    exception raised by apply() is the result of that command (it is returned
+    to the proposer) and must leave the state unchanged.
+
+    snapshot() returns the whole state as JSON-serializable data, and
+    restore() replaces the state with such data; they let RaftNode drop the
+    log entries a snapshot covers. The data is encoded on another thread
+    while commands are still applied, so it must not share mutable objects
+    with the state.
+    """
+
+    def apply(self, command):
+        raise NotImplementedError
+
+    def snapshot(self):
+        raise NotImplementedError
+
+    def restore(self, data):
+        raise NotImplementedError
+
+
+class ProductStore(StateMachine):
+    """
+    In-memory product catalog with the same shape as the webserver's Product
+    table: products keyed by id, plus a unique index on name. Commands:
+
+        {"op": "create", "product": {name, url, price_mdl, display_size, price_eur}}
+        {"op": "update", "id": 1, "changes": {...}}   (or "name" instead of "id")
+        {"op": "delete", "id": 1}                     (or "name" instead of "id")
+
+    Each returns the product it created, updated or deleted.
+    """
+
+    FIELDS = ('name', 'url', 'price_mdl', 'display_size', 'price_eur')
+
+    def __init__(self):
+        self.products = {}
+        self.ids_by_name = {}
+        self.next_id = 1
+
+    def apply(self, command):
+        op = command.get("op")
+        if op == "create":
+            return self.create(command["product"])
+        if op == "update":
+            return self.update(self.find(command), command.get("changes", {}))
+        if op == "delete":
+            return self.delete(self.find(command))
+        raise ValueError(f"Unknown operation {op!r}")
+
+    def find(self, command):
+        if "id" in command:
+            product_id = command["id"]
+        else:
+            product_id = self.ids_by_name.get(command.get("name"))
+        if product_id not in self.products:
+            raise KeyError("Product not found")
+        return product_id
+
+    def create(self, data):
+        missing = [field for field in self.FIELDS if field not in data]
+        if missing:
+            raise ValueError(f"Missing fields: {', '.join(missing)}")
+        if data['name'] in self.ids_by_name:
+            raise ValueError("Product with this name already exists")
+        product = {'id': self.next_id, **{field: data[field] for field in self.FIELDS}}
+        self.next_id += 1
+        self.products[product['id']] = product
+        self.ids_by_name[product['name']] = product['id']
+        return dict(product)
+
+    def update(self, product_id, changes):
+        product = self.products[product_id]
+        changes = {field: changes[field] for field in self.FIELDS if field in changes}
+        new_name = changes.get('name', product['name'])
+        if new_name != product['name'] and new_name in self.ids_by_name:
+            raise ValueError("Product with this name already exists")
+        del self.ids_by_name[product['name']]
+        product.update(changes)
+        self.ids_by_name[product['name']] = product_id
+        return dict(product)
+
+    def delete(self, product_id):
+        product = self.products.pop(product_id)
+        del self.ids_by_name[product['name']]
+        return dict(product)
+
+    def snapshot(self):
+        return {"next_id": self.next_id, "products": [dict(product) for product in self.products.values()]}
+
+    def restore(self, data):
+        self.products = {product['id']: dict(product) for product in data["products"]}
+        self.ids_by_name = {product['name']: product['id'] for product in data["products"]}
+        self.next_id = data["next_id"]
+
+    # Queries, meant to be run through RaftNode.read()
+
+    def get(self, product_id):
+        product = self.products.get(product_id)
+        return dict(product) if product else None
+
+    def get_by_name(self, name):
+        return self.get(self.ids_by_name.get(name))
+
+    def list(self, offset=0, limit=10):
+        ids = sorted(self.products)[offset:offset + limit]
+        return [dict(self.products[product_id]) for product_id in ids]
@@ -0,0 +1,277 @@
+import threading
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+
+class CacheBackend:
+    """
+    Storage used by ProductCache. The in-process MemoryCache is the default;
+    a backend shared between workers (Redis, memcached, ...) only has to
+    implement these methods with the same semantics.
+    """
+
+    def get(self, key):
+        """Return the value stored under key, or MISSING."""
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, *keys):
+        raise NotImplementedError
+
+    def incr(self, key):
+        """
+        Atomically increment an integer counter (0 when absent) and return
+        the new value. Counters are never evicted or expired.
+        """
+        raise NotImplementedError
+
+    def counter(self, key):
+        """Return the value of a counter, 0 when it was never incremented."""
+        raise NotImplementedError
+
+    def sadd(self, key, members, ttl=None):
+        """
+        Add members to the set under key and (re)start its TTL. Sets are not
+        evicted by the LRU, only expired.
+        """
+        raise NotImplementedError
+
+    def spop(self, key):
+        """Delete the set under key and return its members (empty when absent)."""
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def __len__(self):
+        return 0
+
+
+class MemoryCache(CacheBackend):
+    """
+    LRU cache with a per-entry TTL, safe to use from several request threads.
+    Counters and sets live outside the LRU, so filling the cache with pages
+    never evicts them.
+    """
+
+    def __init__(self, max_entries=10000, default_ttl=60):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.entries = OrderedDict()  # key -> (expires_at, value)
+        self.counters = {}
+        self.sets = {}  # key -> (expires_at, set of members)
+        self.lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return MISSING
+            expires_at, value = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self.entries[key]
+                return MISSING
+            self.entries.move_to_end(key)
+            return value
+
+    def expires_at(self, ttl):
+        ttl = self.default_ttl if ttl is None else ttl
+        return time.monotonic() + ttl if ttl else None
+
+    def set(self, key, value, ttl=None):
+        expires_at = self.expires_at(ttl)
+        with self.lock:
+            self.entries[key] = (expires_at, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def incr(self, key):
+        with self.lock:
+            value = self.counters.get(key, 0) + 1
+            self.counters[key] = value
+            return value
+
+    def counter(self, key):
+        with self.lock:
+            return self.counters.get(key, 0)
+
+    def sadd(self, key, members, ttl=None):
+        expires_at = self.expires_at(ttl)
+        with self.lock:
+            entry = self.sets.get(key)
+            if entry is None or (entry[0] is not None and entry[0] < time.monotonic()):
+                if len(self.sets) >= self.max_entries:
+                    self.purge_sets()
+                entry = (expires_at, set())
+            entry[1].update(members)
+            self.sets[key] = (expires_at, entry[1])
+
+    def purge_sets(self):
+        now = time.monotonic()
+        expired = [key for key, (expires_at, _) in self.sets.items() if expires_at is not None and expires_at < now]
+        for key in expired:
+            del self.sets[key]
+
+    def spop(self, key):
+        with self.lock:
+            entry = self.sets.pop(key, None)
+        if entry is None or (entry[0] is not None and entry[0] < time.monotonic()):
+            return set()
+        return entry[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.counters.clear()
+            self.sets.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+BACKENDS = {
+    'memory': MemoryCache,
+}
+
+
+class ProductCache:
+    """
+    Read-through cache for single products and list pages.
+
+    Single products are stored under their id and their name. Every cached
+    list page is tagged with the ids it contains, so updating a product drops
+    exactly the pages that show it. Creating or deleting products shifts rows
+    between pages, so it moves list pages to a new generation instead; the
+    old pages are never read again and age out of the LRU.
+
+    Every invalidation also bumps a version counter. A value loaded from the
+    database is only stored when the version did not change meanwhile, so a
+    read racing with an update cannot cache the rows from before it.
+    """
+
+    def __init__(self, backend, ttl=None):
+        self.backend = backend
+        self.ttl = ttl
+        self.stats_lock = threading.Lock()
+        # Serializes storing loaded values with invalidations (version check + set)
+        self.tag_lock = threading.Lock()
+        self.hits = {'product': 0, 'list': 0}
+        self.misses = {'product': 0, 'list': 0}
+
+    def count(self, counter, kind):
+        with self.stats_lock:
+            counter[kind] += 1
+
+    @staticmethod
+    def product_key(field, value):
+        return f"product:{field}:{value}"
+
+    def get_product(self, field, value, loader):
+        """
+        Return the product dict with the given id or name, calling loader()
+        on a miss. Products that do not exist are not cached.
+        """
+        key = self.product_key(field, value)
+        product = self.backend.get(key)
+        if product is not MISSING:
+            self.count(self.hits, 'product')
+            return product
+        self.count(self.misses, 'product')
+        version = self.version()
+        product = loader()
+        if product is not None:
+            with self.tag_lock:
+                if self.version() == version:
+                    self.set_product(product)
+        return product
+
+    def set_product(self, product):
+        self.backend.set(self.product_key('id', product['id']), product, self.ttl)
+        self.backend.set(self.product_key('name', product['name']), product, self.ttl)
+
+    def list_generation(self):
+        return self.backend.counter("products:generation")
+
+    def version(self):
+        return self.backend.counter("products:version")
+
+    def get_page(self, params, loader):
+        """
+        Return a cached list response for the given query parameters, calling
+        loader() on a miss. loader returns (response, product_ids).
+        """
+        generation = self.list_generation()
+        key = f"products:{generation}:{params}"
+        page = self.backend.get(key)
+        if page is not MISSING:
+            self.count(self.hits, 'list')
+            return page
+        self.count(self.misses, 'list')
+        version = self.version()
+        page, product_ids = loader()
+        with self.tag_lock:
+            if self.version() == version:
+                self.backend.set(key, page, self.ttl)
+                for product_id in product_ids:
+                    self.backend.sadd(f"tag:{generation}:{product_id}", [key], self.ttl)
+        return page
+
+    def invalidate_products(self, products, lists=False):
+        """
+        Drop the cached entries of the given products (dicts with id and
+        name, the old name included when it changed) and the list pages that
+        contain them. lists=True also retires every list page.
+        """
+        keys = []
+        with self.tag_lock:
+            self.backend.incr("products:version")
+            # Tags are per generation: pages of older ones are never read
+            # again, and their tag sets expire with them
+            generation = self.list_generation()
+            for product in products:
+                keys.append(self.product_key('id', product['id']))
+                keys.append(self.product_key('name', product['name']))
+                keys.extend(self.backend.spop(f"tag:{generation}:{product['id']}"))
+            if keys:
+                self.backend.delete(*keys)
+            if lists:
+                self.backend.incr("products:generation")
+
+    def metrics(self):
+        """
+        Counters in the Prometheus text exposition format.
+        """
+        lines = [
+            "# HELP product_cache_hits_total Cache lookups answered from the cache.",
+            "# TYPE product_cache_hits_total counter",
+        ]
+        lines += [f'product_cache_hits_total{{kind="{kind}"}} {value}' for kind, value in self.hits.items()]
+        lines += [
+            "# HELP product_cache_misses_total Cache lookups that went to the database.",
+            "# TYPE product_cache_misses_total counter",
+        ]
+        lines += [f'product_cache_misses_total{{kind="{kind}"}} {value}' for kind, value in self.misses.items()]
+        lines += [
+            "# HELP product_cache_entries Entries currently stored in the cache backend.",
+            "# TYPE product_cache_entries gauge",
+            f"product_cache_entries {len(self.backend)}",
+        ]
+        if hasattr(self.backend, 'evictions'):
+            lines += [
+                "# HELP product_cache_evictions_total Entries evicted by the LRU policy.",
+                "# TYPE product_cache_evictions_total counter",
+                f"product_cache_evictions_total {self.backend.evictions}",
+            ]
+        return "\n".join(lines) + "\n"
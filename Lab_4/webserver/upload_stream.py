@@ -0,0 +1,149 @@
+import codecs
+import json
+
+from werkzeug.sansio.multipart import Data, Epilogue, File, MultipartDecoder, NeedData
+
+# Bytes read from the request body at a time
+READ_SIZE = 64 * 1024
+
+WHITESPACE = ' \t\n\r'
+_decoder = json.JSONDecoder()
+
+
+class StreamError(ValueError):
+    pass
+
+
+def iter_file_part(read, boundary, field, read_size=READ_SIZE):
+    """
+    Yields the content of the file part named `field` of a multipart body
+    while it is read with read(size). Other parts are skipped; nothing is
+    buffered beyond the decoder's look-ahead for the boundary.
+    """
+    decoder = MultipartDecoder(boundary.encode('latin-1'))
+    in_file = False
+    finished = False
+    while True:
+        event = decoder.next_event()
+        if isinstance(event, NeedData):
+            if finished:
+                raise StreamError("Multipart body ended before the closing boundary")
+            chunk = read(read_size)
+            if chunk:
+                decoder.receive_data(chunk)
+            else:
+                decoder.receive_data(None)
+                finished = True
+        elif isinstance(event, File):
+            in_file = event.name == field
+        elif isinstance(event, Data):
+            if in_file and event.data:
+                yield event.data
+            if not event.more_data and in_file:
+                return
+        elif isinstance(event, Epilogue):
+            raise StreamError(f"No file part named '{field}'")
+
+
+class _Reader:
+    """
+    Decoded text of a stream of UTF-8 chunks with a cursor. Text before the
+    cursor is dropped whenever more input is read.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.text = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, min_available=1):
+        """Reads until min_available characters follow the cursor or the input ends."""
+        parts = [self.text[self.pos:]]
+        available = len(parts[0])
+        while available < min_available and not self.eof:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                self.eof = True
+                text = self.utf8.decode(b'', final=True)
+            else:
+                text = self.utf8.decode(chunk)
+            parts.append(text)
+            available += len(text)
+        self.text = ''.join(parts)
+        self.pos = 0
+
+    def peek(self):
+        """Returns the next non-whitespace character, '' at the end of the input."""
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if self.eof:
+                return ''
+            self.fill()
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise StreamError(f"Expected one of {chars!r}, found {char or 'end of input'!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+                # A number or literal at the very end may continue in the next chunk
+                if end < len(self.text) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError as e:
+                if self.eof:
+                    raise StreamError(str(e))
+            # Grow the look-ahead geometrically so a large value is not
+            # re-decoded once per chunk
+            self.fill(2 * (len(self.text) - self.pos) + 1)
+
+
+def iter_array_items(chunks, key):
+    """
+    Yields the items of the array under `key` in a top-level JSON object, or
+    of a top-level array, while the UTF-8 chunks are read. Only one item is
+    decoded at a time; other members of the object are decoded and dropped.
+    """
+    reader = _Reader(chunks)
+    if reader.expect('{[') == '[':
+        yield from _iter_items(reader)
+    elif reader.peek() == '}':
+        reader.pos += 1
+    else:
+        while True:
+            name = reader.value()
+            if not isinstance(name, str):
+                raise StreamError("Object keys must be strings")
+            reader.expect(':')
+            if name == key:
+                if reader.peek() != '[':
+                    raise StreamError(f"'{key}' should be a list")
+                reader.pos += 1
+                yield from _iter_items(reader)
+            else:
+                reader.value()
+            if reader.expect(',}') == '}':
+                break
+    if reader.peek():
+        raise StreamError("Unexpected data after the JSON document")
+
+
+def _iter_items(reader):
+    if reader.peek() == ']':
+        reader.pos += 1
+        return
+    while True:
+        yield reader.value()
+        if reader.expect(',]') == ']':
+            return
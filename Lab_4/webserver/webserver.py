@@ -1,9 +1,24 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import and_, func, inspect, or_, select, text, tuple_
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.exc import IntegrityError
 import logging
 import json
+import base64
 import os
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from cache import BACKENDS, ProductCache
+from upload_stream import StreamError, iter_array_items, iter_file_part
+# common/ sits at the repository root; the docker image copies it next to this file
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+from common.negotiation import init_app as init_negotiation, respond
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -15,15 +30,64 @@ app_http = Flask(__name__)
 app_http.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URI
 app_http.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db = SQLAlchemy(app_http)
+# Responses are JSON, MessagePack or NDJSON by Accept header, and compressed
+# by Accept-Encoding above a size threshold, see common/negotiation.py
+init_negotiation(app_http)
+
+# Rows fetched per round trip by GET /products/export
+EXPORT_CHUNK_SIZE = 1000
+
+PRODUCT_FIELDS = ['name', 'url', 'price_mdl', 'display_size', 'price_eur']
+
+# Rows per INSERT ... ON CONFLICT statement in POST /products?mode=upsert
+UPSERT_CHUNK_SIZE = 500
+UPSERT_INSERTS = {
+    'postgresql': postgresql_insert,
+    'sqlite': sqlite_insert,
+}
+
+# POST /upload: finished import jobs kept for GET /upload/jobs/<id>, and
+# invalid products reported per job
+UPLOAD_JOB_HISTORY = 100
+UPLOAD_MAX_ERRORS = 20
+
+# GET /products page size, on the offset and the cursor path
+PRODUCTS_DEFAULT_LIMIT = 10
+PRODUCTS_MAX_LIMIT = 100
+
+# GET /products/search page size
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+
+# Read-through cache for GET /product and GET /products pages
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory')
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 10000))
+CACHE_TTL_SECONDS = float(os.getenv('CACHE_TTL_SECONDS', 60))
+cache = ProductCache(BACKENDS[CACHE_BACKEND](CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS), CACHE_TTL_SECONDS)
 
 
 class Product(db.Model):
+    __table_args__ = (
+        # Price range filters and ORDER BY price_eur, id keyset pages
+        db.Index('ix_product_price_eur_id', 'price_eur', 'id'),
+        db.Index('ix_product_display_size_price_eur_id', 'display_size', 'price_eur', 'id'),
+        # PostgreSQL only: trigram index for name substring search, and a
+        # text_pattern_ops index so LIKE 'prefix%' can use it under any collation
+        db.Index('ix_product_name_trgm', 'name', postgresql_using='gin',
+                 postgresql_ops={'name': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+        db.Index('ix_product_name_pattern', 'name',
+                 postgresql_ops={'name': 'text_pattern_ops'}).ddl_if(dialect='postgresql'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(80), unique=True, nullable=False)
     url = db.Column(db.String(200), nullable=False)
     price_mdl = db.Column(db.Float, nullable=False)
     display_size = db.Column(db.String(50), nullable=False)
     price_eur = db.Column(db.Float, nullable=False)
+    # When the values were scraped (naive UTC); an upsert with an older
+    # scraped_at than the stored one is ignored
+    scraped_at = db.Column(db.DateTime)
 
     def to_dict(self):
         return {
@@ -37,21 +101,32 @@ class Product(db.Model):
 
 
 with app_http.app_context():
+    if db.engine.dialect.name == 'postgresql':
+        with db.engine.begin() as connection:
+            connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
     db.create_all()
+    # create_all skips tables that already exist, so indexes added to the
+    # model later are created here on existing databases
+    for index in Product.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+    # Same for columns: create_all does not alter existing tables
+    if 'scraped_at' not in {column['name'] for column in inspect(db.engine).get_columns(Product.__tablename__)}:
+        with db.engine.begin() as connection:
+            connection.execute(text(f'ALTER TABLE {Product.__tablename__} ADD COLUMN scraped_at TIMESTAMP'))
 
 
 @app_http.route('/products', methods=['POST'])
 def create_products():
     if not request.is_json:
-        return jsonify({"error": "Request must be JSON"}), 400
+        return respond({"error": "Request must be JSON"}), 400
 
     data = request.get_json()
     products_data = data if isinstance(data, list) else [data]
-    required_fields = ['name', 'url', 'price_mdl', 'display_size', 'price_eur']
-    added_products, errors = [], []
+    upsert = request.args.get('mode') == 'upsert'
+    added_products, valid_products, errors = [], [], []
 
     for idx, product_data in enumerate(products_data, start=1):
-        missing = [field for field in required_fields if field not in product_data]
+        missing = [field for field in PRODUCT_FIELDS if field not in product_data]
         if missing:
             errors.append({
                 "product_index": idx,
@@ -59,6 +134,13 @@ def create_products():
             })
             continue
 
+        if upsert:
+            try:
+                valid_products.append(upsert_row(product_data))
+            except ValueError as e:
+                errors.append({"product_index": idx, "error": str(e)})
+            continue
+
         product = Product(
             name=product_data['name'],
             url=product_data['url'],
@@ -70,8 +152,11 @@ def create_products():
         db.session.add(product)
         added_products.append(product)
 
-    if not added_products and errors:
-        return jsonify({"errors": errors}), 400
+    if not added_products and not valid_products and errors:
+        return respond({"errors": errors}), 400
+
+    if upsert:
+        return upsert_products(valid_products, errors)
 
     try:
         db.session.commit()
@@ -80,7 +165,10 @@ def create_products():
         errors.append({
             "error": "Product with this name already exists."
         })
-        return jsonify({"errors": errors}), 400
+        return respond({"errors": errors}), 400
+
+    # New rows shift every list page after them
+    cache.invalidate_products([product.to_dict() for product in added_products], lists=True)
 
     response = {
         "message": f"{len(added_products)} products added successfully.",
@@ -90,19 +178,290 @@ def create_products():
     if errors:
         response["errors"] = errors
 
-    return jsonify(response), 201
+    return respond(response), 201
+
+
+def upsert_supported():
+    return db.engine.dialect.name in UPSERT_INSERTS
+
+
+def parse_scraped_at(value):
+    """ISO 8601 scrape time of a product as naive UTC, or None when not given."""
+    if value is None:
+        return None
+    try:
+        scraped_at = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid scraped_at: {value!r}")
+    if scraped_at.tzinfo is not None:
+        scraped_at = scraped_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return scraped_at
+
+
+def upsert_row(product_data):
+    row = {field: product_data[field] for field in PRODUCT_FIELDS}
+    row['scraped_at'] = parse_scraped_at(product_data.get('scraped_at'))
+    return row
+
+
+def scraped_before(product, current):
+    return (product['scraped_at'] is not None and current['scraped_at'] is not None
+            and product['scraped_at'] < current['scraped_at'])
+
+
+def scraped_after(product, current):
+    return product['scraped_at'] is not None and (
+        current['scraped_at'] is None or product['scraped_at'] > current['scraped_at'])
+
+
+def upsert_chunk(products):
+    """
+    Upserts up to UPSERT_CHUNK_SIZE products with unique names in one
+    INSERT ... ON CONFLICT (name) DO UPDATE, without committing. The existing
+    rows are read first: unchanged products are left out of the statement,
+    which makes re-sending the same scrape result almost free, and the same
+    read gives the counts. Returns (inserted, updated rows, unchanged).
+
+    Products carrying a scraped_at are last-write-wins: one scraped before
+    the stored row is dropped (counted as unchanged), so a batch that was
+    retried or posted concurrently cannot bring back an older price.
+    """
+    table = Product.__table__
+    existing = {
+        row['name']: dict(row)
+        for row in db.session.execute(
+            select(table).where(table.c.name.in_([product['name'] for product in products]))
+        ).mappings()
+    }
+    inserted, updated, unchanged = 0, [], 0
+    rows = []
+    for product in products:
+        current = existing.get(product['name'])
+        if current is None:
+            inserted += 1
+        elif scraped_before(product, current):
+            unchanged += 1
+            continue
+        elif any(current[field] != product[field] for field in PRODUCT_FIELDS):
+            updated.append(current)
+        else:
+            unchanged += 1
+            # Same values, but the newer scrape time must still be stored
+            if not scraped_after(product, current):
+                continue
+        rows.append(product)
+    if not rows:
+        return inserted, updated, unchanged
+
+    statement = UPSERT_INSERTS[db.engine.dialect.name](table).values(rows)
+    excluded = statement.excluded
+    changed_fields = [field for field in PRODUCT_FIELDS if field != 'name']
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.name],
+        set_=dict({field: excluded[field] for field in changed_fields},
+                  scraped_at=func.coalesce(excluded.scraped_at, table.c.scraped_at)),
+        where=and_(
+            # Rechecked here for rows written since the read above
+            or_(excluded.scraped_at.is_(None), table.c.scraped_at.is_(None),
+                excluded.scraped_at >= table.c.scraped_at),
+            # A row written concurrently with the same values stays untouched
+            or_(*(table.c[field] != excluded[field] for field in changed_fields),
+                and_(excluded.scraped_at.isnot(None),
+                     or_(table.c.scraped_at.is_(None), excluded.scraped_at > table.c.scraped_at))),
+        ),
+    )
+    db.session.execute(statement)
+    return inserted, updated, unchanged
+
+
+def upsert_products(products, errors):
+    """
+    Inserts new products and updates existing ones by name, one multi-row
+    statement per UPSERT_CHUNK_SIZE products, in a single transaction.
+    """
+    if not upsert_supported():
+        return respond({"error": f"Upsert is not supported on {db.engine.dialect.name}"}), 400
+
+    # Later duplicates of a name win, like they would with sequential PUTs
+    unique = list({product['name']: product for product in products}.values())
+    inserted, updated, unchanged = 0, [], 0
+    for start in range(0, len(unique), UPSERT_CHUNK_SIZE):
+        chunk_inserted, chunk_updated, chunk_unchanged = upsert_chunk(unique[start:start + UPSERT_CHUNK_SIZE])
+        inserted += chunk_inserted
+        updated += chunk_updated
+        unchanged += chunk_unchanged
+
+    db.session.commit()
+    if inserted or updated:
+        cache.invalidate_products(updated, lists=bool(inserted))
+
+    response = {
+        "message": f"{inserted} products added, {len(updated)} updated, {unchanged} unchanged.",
+        "inserted": inserted,
+        "updated": len(updated),
+        "unchanged": unchanged,
+    }
+    if errors:
+        response["errors"] = errors
+    return respond(response), 201
+
+
+def encode_cursor(last_id):
+    return base64.urlsafe_b64encode(json.dumps({"after": last_id}).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        return int(json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))["after"])
+    except (ValueError, KeyError, TypeError, AttributeError):
+        raise ValueError("Invalid cursor")
 
 
 @app_http.route('/products', methods=['GET'])
 def get_products():
     try:
         offset = int(request.args.get('offset', 0))
-        limit = int(request.args.get('limit', 10))
+        limit = min(int(request.args.get('limit', PRODUCTS_DEFAULT_LIMIT)), PRODUCTS_MAX_LIMIT)
     except ValueError:
-        return jsonify({"error": "Offset and limit must be integers"}), 400
+        return respond({"error": "Offset and limit must be integers"}), 400
+    if offset < 0 or limit < 1:
+        return respond({"error": "offset must not be negative and limit must be a positive integer"}), 400
+
+    if 'cursor' in request.args:
+        # Keyset pagination: ?cursor= for the first page, then the next_cursor
+        # of the previous response. Each page is an index range scan on id.
+        try:
+            after = decode_cursor(request.args['cursor'])
+        except ValueError as e:
+            return respond({"error": str(e)}), 400
+
+        def load_keyset_page():
+            query = Product.query.order_by(Product.id)
+            if after is not None:
+                query = query.filter(Product.id > after)
+            products = [product.to_dict() for product in query.limit(limit)]
+            next_cursor = encode_cursor(products[-1]['id']) if products and len(products) == limit else None
+            return {"data": products, "next_cursor": next_cursor}, [product['id'] for product in products]
+
+        return respond(cache.get_page(f"after={after}&limit={limit}", load_keyset_page)), 200
 
-    products = Product.query.offset(offset).limit(limit).all()
-    return jsonify([product.to_dict() for product in products]), 200
+    def load_offset_page():
+        # Ordered by id so a page only changes when rows are added or removed
+        products = [product.to_dict() for product in Product.query.order_by(Product.id).offset(offset).limit(limit)]
+        return products, [product['id'] for product in products]
+
+    return respond(cache.get_page(f"offset={offset}&limit={limit}", load_offset_page)), 200
+
+
+# sort parameter -> keyset columns; name is unique so it needs no id tie-breaker
+SEARCH_SORTS = {
+    'id': [Product.id],
+    'price_eur': [Product.price_eur, Product.id],
+    'name': [Product.name],
+}
+
+
+def encode_search_cursor(sort, product):
+    key = sort.lstrip('-')
+    after = [product[column.key] for column in SEARCH_SORTS[key]]
+    return base64.urlsafe_b64encode(json.dumps({"sort": sort, "after": after}).encode('utf-8')).decode('ascii')
+
+
+def decode_search_cursor(cursor, sort):
+    if not cursor:
+        return None
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        after = payload["after"]
+        if payload["sort"] != sort or len(after) != len(SEARCH_SORTS[sort.lstrip('-')]):
+            raise ValueError
+        return after
+    except (ValueError, KeyError, TypeError, AttributeError):
+        raise ValueError("Invalid cursor")
+
+
+@app_http.route('/products/search', methods=['GET'])
+def search_products():
+    """
+    Filtered, sorted, keyset-paged product search.
+
+    ?min_price=&max_price= filter on price_eur, ?display_size= is an exact
+    match, ?q= a case-insensitive name substring and ?prefix= a name prefix.
+    ?sort= is id, price_eur or name, with a leading '-' for descending order.
+    Pages continue from the next_cursor of the previous response.
+    """
+    args = request.args
+    sort = args.get('sort', 'id')
+    if sort.lstrip('-') not in SEARCH_SORTS:
+        return respond({"error": f"sort must be one of {', '.join(SEARCH_SORTS)}, optionally prefixed with '-'"}), 400
+    try:
+        min_price = float(args['min_price']) if 'min_price' in args else None
+        max_price = float(args['max_price']) if 'max_price' in args else None
+        limit = min(int(args.get('limit', SEARCH_DEFAULT_LIMIT)), SEARCH_MAX_LIMIT)
+    except ValueError:
+        return respond({"error": "min_price and max_price must be numbers and limit an integer"}), 400
+    if limit < 1:
+        return respond({"error": "limit must be a positive integer"}), 400
+    try:
+        after = decode_search_cursor(args.get('cursor'), sort)
+    except ValueError as e:
+        return respond({"error": str(e)}), 400
+
+    query = Product.query
+    if min_price is not None:
+        query = query.filter(Product.price_eur >= min_price)
+    if max_price is not None:
+        query = query.filter(Product.price_eur <= max_price)
+    if 'display_size' in args:
+        query = query.filter(Product.display_size == args['display_size'])
+    if args.get('q'):
+        query = query.filter(Product.name.icontains(args['q'], autoescape=True))
+    if args.get('prefix'):
+        query = query.filter(Product.name.startswith(args['prefix'], autoescape=True))
+
+    columns = SEARCH_SORTS[sort.lstrip('-')]
+    descending = sort.startswith('-')
+    if after is not None:
+        # Row-value comparison matches the (sort key, id) index order
+        position = tuple_(*columns) if len(columns) > 1 else columns[0]
+        value = tuple_(*after) if len(columns) > 1 else after[0]
+        query = query.filter(position < value if descending else position > value)
+    query = query.order_by(*(column.desc() if descending else column for column in columns))
+
+    products = [product.to_dict() for product in query.limit(limit)]
+    next_cursor = encode_search_cursor(sort, products[-1]) if products and len(products) == limit else None
+    return respond({"data": products, "next_cursor": next_cursor}), 200
+
+
+@app_http.route('/products/export', methods=['GET'])
+def export_products():
+    """
+    Streams every product as NDJSON (one JSON object per line). Rows are read
+    EXPORT_CHUNK_SIZE at a time with yield_per and written out as they come,
+    so the export never holds the whole table in memory. ?cursor= resumes
+    after the id stored in a cursor.
+    """
+    try:
+        after = decode_cursor(request.args.get('cursor'))
+    except ValueError as e:
+        return respond({"error": str(e)}), 400
+
+    def generate():
+        query = db.session.query(Product).order_by(Product.id)
+        if after is not None:
+            query = query.filter(Product.id > after)
+        lines = []
+        for product in query.yield_per(EXPORT_CHUNK_SIZE):
+            lines.append(json.dumps(product.to_dict()))
+            if len(lines) == EXPORT_CHUNK_SIZE:
+                yield '\n'.join(lines) + '\n'
+                lines = []
+        if lines:
+            yield '\n'.join(lines) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
 
 @app_http.route('/product', methods=['GET'])
@@ -111,14 +470,30 @@ def get_product():
     name = request.args.get('name')
 
     if not product_id and not name:
-        return jsonify({"error": "Please provide 'id' or 'name' as query parameter"}), 400
+        return respond({"error": "Please provide 'id' or 'name' as query parameter"}), 400
 
-    product = Product.query.get(product_id) if product_id else Product.query.filter_by(name=name).first()
+    if product_id:
+        try:
+            product_id = int(product_id)
+        except ValueError:
+            return respond({"error": "id must be an integer"}), 400
+
+        def load():
+            product = db.session.get(Product, product_id)
+            return product.to_dict() if product else None
+
+        product = cache.get_product('id', product_id, load)
+    else:
+        def load():
+            product = Product.query.filter_by(name=name).first()
+            return product.to_dict() if product else None
+
+        product = cache.get_product('name', name, load)
 
     if not product:
-        return jsonify({"error": "Product not found"}), 404
+        return respond({"error": "Product not found"}), 404
 
-    return jsonify(product.to_dict()), 200
+    return respond(product), 200
 
 
 @app_http.route('/product', methods=['PUT'])
@@ -127,27 +502,30 @@ def update_product():
     name = request.args.get('name')
 
     if not product_id and not name:
-        return jsonify({"error": "Please provide 'id' or 'name' as query parameter"}), 400
+        return respond({"error": "Please provide 'id' or 'name' as query parameter"}), 400
 
     if not request.is_json:
-        return jsonify({"error": "Request must be JSON"}), 400
+        return respond({"error": "Request must be JSON"}), 400
 
     data = request.get_json()
     product = Product.query.get(product_id) if product_id else Product.query.filter_by(name=name).first()
 
     if not product:
-        return jsonify({"error": "Product not found"}), 404
+        return respond({"error": "Product not found"}), 404
 
-    for key in ['name', 'url', 'price_mdl', 'display_size', 'price_eur']:
+    old = product.to_dict()
+    for key in PRODUCT_FIELDS:
         if key in data:
             setattr(product, key, data[key])
 
     try:
         db.session.commit()
-        return jsonify(product.to_dict()), 200
+        # Both names: the old one must stop resolving, the new one may not be cached yet
+        cache.invalidate_products([old, product.to_dict()])
+        return respond(product.to_dict()), 200
     except IntegrityError:
         db.session.rollback()
-        return jsonify({"error": "Product with this name already exists"}), 400
+        return respond({"error": "Product with this name already exists"}), 400
 
 
 @app_http.route('/product', methods=['DELETE'])
@@ -156,25 +534,159 @@ def delete_product():
     name = request.args.get('name')
 
     if not product_id and not name:
-        return jsonify({"error": "Please provide 'id' or 'name' as query parameter"}), 400
+        return respond({"error": "Please provide 'id' or 'name' as query parameter"}), 400
 
     product = Product.query.get(product_id) if product_id else Product.query.filter_by(name=name).first()
 
     if not product:
-        return jsonify({"error": "Product not found"}), 404
+        return respond({"error": "Product not found"}), 404
 
+    deleted = product.to_dict()
     db.session.delete(product)
     db.session.commit()
-    return jsonify({"message": "Product deleted successfully"}), 200
+    cache.invalidate_products([deleted], lists=True)
+    return respond({"message": "Product deleted successfully"}), 200
+
+
+@app_http.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(cache.metrics(), mimetype='text/plain; version=0.0.4')
+
+
+upload_jobs = OrderedDict()  # job id -> progress dict, oldest first
+upload_jobs_lock = threading.Lock()
+
+
+def start_upload_job(job_id):
+    job = {
+        "job_id": job_id,
+        "status": "running",
+        "bytes_read": 0,
+        "products": 0,
+        "inserted": 0,
+        "updated": 0,
+        "unchanged": 0,
+        "invalid": 0,
+        "errors": [],
+        "started_at": time.time(),
+        "finished_at": None,
+    }
+    with upload_jobs_lock:
+        upload_jobs[job_id] = job
+        upload_jobs.move_to_end(job_id)
+        while len(upload_jobs) > UPLOAD_JOB_HISTORY:
+            upload_jobs.popitem(last=False)
+    return job
+
+
+def upload_job_snapshot(job_id):
+    with upload_jobs_lock:
+        job = upload_jobs.get(job_id)
+        return dict(job, errors=list(job["errors"])) if job else None
+
+
+def import_products(job, products):
+    """
+    Upserts the products of an upload chunk by chunk, committing each chunk
+    so that memory stays flat and job progress is visible while it runs.
+    """
+    chunk = {}
+
+    def flush():
+        inserted, updated, unchanged = upsert_chunk(list(chunk.values()))
+        db.session.commit()
+        if inserted or updated:
+            cache.invalidate_products(updated, lists=bool(inserted))
+        with upload_jobs_lock:
+            job["inserted"] += inserted
+            job["updated"] += len(updated)
+            job["unchanged"] += unchanged
+        chunk.clear()
+
+    for idx, product_data in enumerate(products, start=1):
+        with upload_jobs_lock:
+            job["products"] = idx
+        missing = PRODUCT_FIELDS if not isinstance(product_data, dict) else [
+            field for field in PRODUCT_FIELDS if field not in product_data]
+        try:
+            if missing:
+                raise ValueError(f"Missing fields: {', '.join(missing)}")
+            row = upsert_row(product_data)
+        except ValueError as e:
+            with upload_jobs_lock:
+                job["invalid"] += 1
+                if len(job["errors"]) < UPLOAD_MAX_ERRORS:
+                    job["errors"].append({"product_index": idx, "error": str(e)})
+            continue
+        # Within a chunk the last duplicate wins; across chunks the later upsert does
+        chunk[product_data['name']] = row
+        if len(chunk) >= UPSERT_CHUNK_SIZE:
+            flush()
+    if chunk:
+        flush()
+
 
 @app_http.route('/upload', methods=['POST'])
 def upload_file():
-    if 'file' not in request.files:
-        return jsonify({"error": "No file provided"}), 400
-    file = request.files['file']
-    # Process the file as needed
-    # Return a success response
-    return jsonify({"message": "File uploaded"}), 201
+    """
+    Imports the filtered_products of a JSON snapshot sent as the multipart
+    'file' part. The body is parsed while it is read from request.stream, one
+    product at a time, and upserted in chunks, so memory does not grow with
+    the file size. Progress is available at GET /upload/jobs/<job_id>; pass
+    ?job_id= to choose the id and poll while the upload is still running.
+    """
+    boundary = request.mimetype_params.get('boundary')
+    if request.mimetype != 'multipart/form-data' or not boundary:
+        return respond({"error": "No file provided"}), 400
+    if not upsert_supported():
+        return respond({"error": f"Upload is not supported on {db.engine.dialect.name}"}), 400
+
+    job = start_upload_job(request.args.get('job_id') or uuid.uuid4().hex)
+    stream = request.stream
+
+    def read(size):
+        data = stream.read(size)
+        with upload_jobs_lock:
+            job["bytes_read"] += len(data)
+        return data
+
+    products = iter_array_items(iter_file_part(read, boundary, 'file'), 'filtered_products')
+    try:
+        import_products(job, products)
+        status, code = "done", 201
+    except StreamError as e:
+        db.session.rollback()
+        logger.error(f"Upload {job['job_id']} failed: {e}")
+        with upload_jobs_lock:
+            job["error"] = str(e)
+        status, code = "failed", 400
+    except Exception as e:
+        db.session.rollback()
+        logger.exception(f"Upload {job['job_id']} failed")
+        with upload_jobs_lock:
+            job["error"] = str(e)
+        status, code = "failed", 500
+
+    with upload_jobs_lock:
+        job["status"] = status
+        job["finished_at"] = time.time()
+        response = dict(job, errors=list(job["errors"]))
+    return respond(response), code
+
+
+@app_http.route('/upload/jobs', methods=['GET'])
+def list_upload_jobs():
+    with upload_jobs_lock:
+        job_ids = list(upload_jobs)
+    return respond([upload_job_snapshot(job_id) for job_id in reversed(job_ids)]), 200
+
+
+@app_http.route('/upload/jobs/<job_id>', methods=['GET'])
+def get_upload_job(job_id):
+    job = upload_job_snapshot(job_id)
+    if not job:
+        return respond({"error": "Upload job not found"}), 404
+    return respond(job), 200
 
 
 if __name__ == '__main__':
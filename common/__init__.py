@@ -0,0 +1,5 @@
+"""
+Modules shared by the labs and the Lab_4 services. Scripts in the source
+tree put the repository root on sys.path; the docker images copy this
+package next to the service code.
+"""
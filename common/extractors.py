@@ -0,0 +1,253 @@
+"""
+Extraction of the few fields the scraper needs from ultra.md pages.
+
+Every backend exposes the same two methods:
+    extract_listing(html)      -> [(link_text, link_href, price_text), ...]
+    extract_display_size(html) -> display size string or "N/A"
+
+"bs4" builds a full BeautifulSoup tree (the original implementation),
+"stream" is an html.parser event handler that never builds a tree and stops
+as soon as the display size is found, and "lxml" (only when lxml is installed)
+runs precompiled XPath expressions over lxml's C parser.
+"""
+import os
+from html.parser import HTMLParser
+
+LINK_CLASS = 'product-text pt-4 font-semibold text-gray-900 transition duration-200 hover:text-red-500 dark:text-white sm:text-sm'
+PRICE_CLASS = 'text-blue text-xl font-bold dark:text-white'
+SUMMARY_CLASS = 'mt-[18px] lg:mt-6 mb-2 lg:mb-16'
+DISPLAY_SIZE_LABEL = 'Rezolutia ecranului'
+DISPLAY_SIZE_CLASS = 'font-bold text-black'
+
+DEFAULT_EXTRACTOR = os.getenv('HTML_EXTRACTOR', 'stream')
+
+
+class BeautifulSoupExtractor:
+    name = 'bs4'
+
+    def __init__(self):
+        from bs4 import BeautifulSoup
+        self.BeautifulSoup = BeautifulSoup
+
+    def extract_listing(self, html):
+        soup = self.BeautifulSoup(html, 'html.parser')
+        all_links = soup.find_all('a', class_=LINK_CLASS)
+        all_prices = soup.find_all('span', class_=PRICE_CLASS)
+        return [(link.text.strip(), link.get('href'), price.text.strip())
+                for link, price in zip(all_links, all_prices)]
+
+    def extract_display_size(self, html):
+        product_soup = self.BeautifulSoup(html, 'html.parser')
+        summary_section = product_soup.find('div', class_=SUMMARY_CLASS)
+        if summary_section:
+            for li in summary_section.find_all('li'):
+                if DISPLAY_SIZE_LABEL in li.text:
+                    display_size_span = li.find_next('span', class_=DISPLAY_SIZE_CLASS)
+                    if display_size_span:
+                        return display_size_span.text.strip()
+                    break
+        return "N/A"
+
+
+def class_matches(attrs, expected):
+    for name, value in attrs:
+        if name == 'class':
+            return value is not None and ' '.join(value.split()) == expected
+    return False
+
+
+class _StopParsing(Exception):
+    pass
+
+
+class _ListingParser(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.links = []
+        self.prices = []
+        self.link = None  # [href, text parts] of the <a> being read
+        self.price = None  # text parts of the price <span> being read
+        self.span_depth = 0
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ('script', 'style'):
+            self.skip_depth += 1
+        elif tag == 'a' and self.link is None and class_matches(attrs, LINK_CLASS):
+            self.link = [dict(attrs).get('href'), []]
+        elif tag == 'span':
+            if self.price is not None:
+                self.span_depth += 1
+            elif class_matches(attrs, PRICE_CLASS):
+                self.price = []
+                self.span_depth = 1
+
+    def handle_endtag(self, tag):
+        if tag in ('script', 'style'):
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag == 'a' and self.link is not None:
+            self.links.append((''.join(self.link[1]).strip(), self.link[0]))
+            self.link = None
+        elif tag == 'span' and self.price is not None:
+            self.span_depth -= 1
+            if self.span_depth == 0:
+                self.prices.append(''.join(self.price).strip())
+                self.price = None
+
+    def handle_data(self, data):
+        if self.skip_depth:
+            return
+        if self.link is not None:
+            self.link[1].append(data)
+        if self.price is not None:
+            self.price.append(data)
+
+
+class _DisplaySizeParser(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.display_size = "N/A"
+        self.div_depth = 0  # depth inside the summary <div>, 0 when outside
+        self.li_depth = 0
+        self.li_text = None
+        self.li_span = None  # text of the first value span inside the current <li>
+        self.span = None  # text parts of the value span being read
+        self.span_depth = 0
+        self.label_found = False  # label <li> seen, waiting for the next value span
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ('script', 'style'):
+            self.skip_depth += 1
+        elif tag == 'div':
+            if self.div_depth:
+                self.div_depth += 1
+            elif not self.label_found and class_matches(attrs, SUMMARY_CLASS):
+                self.div_depth = 1
+        elif tag == 'li' and self.div_depth and not self.label_found:
+            self.li_depth += 1
+            if self.li_depth == 1:
+                self.li_text = []
+                self.li_span = None
+        elif tag == 'span':
+            if self.span is not None:
+                self.span_depth += 1
+            elif (self.label_found or (self.li_depth and self.li_span is None)) \
+                    and class_matches(attrs, DISPLAY_SIZE_CLASS):
+                self.span = []
+                self.span_depth = 1
+
+    def handle_endtag(self, tag):
+        if tag in ('script', 'style'):
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag == 'span' and self.span is not None:
+            self.span_depth -= 1
+            if self.span_depth == 0:
+                text = ''.join(self.span).strip()
+                self.span = None
+                if self.label_found:
+                    self.display_size = text
+                    raise _StopParsing()
+                self.li_span = text
+        elif tag == 'li' and self.li_depth:
+            self.li_depth -= 1
+            if self.li_depth == 0:
+                if DISPLAY_SIZE_LABEL in ''.join(self.li_text):
+                    if self.li_span is not None:
+                        self.display_size = self.li_span
+                        raise _StopParsing()
+                    # The value is somewhere after the label, keep reading
+                    self.label_found = True
+                self.li_text = None
+        elif tag == 'div' and self.div_depth:
+            self.div_depth -= 1
+            if self.div_depth == 0 and not self.label_found:
+                # Summary section is over and had no display size
+                raise _StopParsing()
+
+    def handle_data(self, data):
+        if self.skip_depth:
+            return
+        if self.li_text is not None:
+            self.li_text.append(data)
+        if self.span is not None:
+            self.span.append(data)
+
+
+class StreamingExtractor:
+    name = 'stream'
+
+    def extract_listing(self, html):
+        parser = _ListingParser()
+        parser.feed(html)
+        parser.close()
+        return [(text, href, price) for (text, href), price in zip(parser.links, parser.prices)]
+
+    def extract_display_size(self, html):
+        parser = _DisplaySizeParser()
+        try:
+            parser.feed(html)
+            parser.close()
+        except _StopParsing:
+            pass
+        return parser.display_size
+
+
+class LxmlExtractor:
+    name = 'lxml'
+
+    def __init__(self):
+        from lxml import etree, html as lxml_html
+        self.lxml_html = lxml_html
+        self.links = etree.XPath("//a[normalize-space(@class)=$cls]")
+        self.prices = etree.XPath("//span[normalize-space(@class)=$cls]")
+        self.summary_items = etree.XPath("(//div[normalize-space(@class)=$cls])[1]//li")
+        # find_next(): first matching span after the <li> starts, inside it or later
+        self.value_span = etree.XPath("(descendant::span[normalize-space(@class)=$cls]"
+                                      " | following::span[normalize-space(@class)=$cls])[1]")
+
+    @staticmethod
+    def text(element):
+        return ''.join(element.xpath("descendant-or-self::text()[not(parent::script or parent::style)]"))
+
+    def extract_listing(self, html):
+        tree = self.lxml_html.fromstring(html)
+        all_links = self.links(tree, cls=LINK_CLASS)
+        all_prices = self.prices(tree, cls=PRICE_CLASS)
+        return [(self.text(link).strip(), link.get('href'), self.text(price).strip())
+                for link, price in zip(all_links, all_prices)]
+
+    def extract_display_size(self, html):
+        tree = self.lxml_html.fromstring(html)
+        for li in self.summary_items(tree, cls=SUMMARY_CLASS):
+            if DISPLAY_SIZE_LABEL in self.text(li):
+                spans = self.value_span(li, cls=DISPLAY_SIZE_CLASS)
+                if spans:
+                    return self.text(spans[0]).strip()
+                break
+        return "N/A"
+
+
+EXTRACTORS = {
+    'bs4': BeautifulSoupExtractor,
+    'stream': StreamingExtractor,
+    'lxml': LxmlExtractor,
+}
+
+
+def available_extractors():
+    names = []
+    for name, extractor_class in EXTRACTORS.items():
+        try:
+            extractor_class()
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def get_extractor(name=None):
+    name = name or DEFAULT_EXTRACTOR
+    if name not in EXTRACTORS:
+        raise ValueError(f"Unknown HTML extractor '{name}', expected one of {', '.join(EXTRACTORS)}")
+    return EXTRACTORS[name]()
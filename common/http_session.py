@@ -0,0 +1,149 @@
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+# Shared HTTP client settings for the scraper and the manager.
+
+# Hosts that keep a connection pool, and kept-alive connections per host. With
+# HTTP_POOL_BLOCK the per-host size is a hard limit: extra threads wait for a
+# free connection instead of opening throwaway ones.
+HTTP_POOL_CONNECTIONS = int(os.getenv('HTTP_POOL_CONNECTIONS', 10))
+HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', 10))
+HTTP_POOL_BLOCK = os.getenv('HTTP_POOL_BLOCK', '1') == '1'
+
+# Seconds; used for every request that does not pass its own timeout
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 5))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 30))
+
+# Retries of connection errors, and of 429/5xx answers to idempotent methods,
+# with exponential backoff (HTTP_RETRY_BACKOFF * 2**n seconds)
+HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', 3))
+HTTP_RETRY_BACKOFF = float(os.getenv('HTTP_RETRY_BACKOFF', 0.5))
+RETRY_STATUSES = (429, 502, 503, 504)
+
+
+class ConnectionStats:
+    """
+    Counts requests and newly opened connections, and splits the time spent
+    per request into connecting (TCP + TLS handshake) and transfer. Transfer
+    includes waiting for the server and for a free pooled connection.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.requests = 0
+        self.connections = 0
+        self.connect_time = 0.0
+        self.transfer_time = 0.0
+
+    def record_connect(self, seconds):
+        self.local.connect_time = getattr(self.local, 'connect_time', 0.0) + seconds
+        with self.lock:
+            self.connections += 1
+            self.connect_time += seconds
+
+    def start_request(self):
+        self.local.connect_time = 0.0
+        return time.perf_counter()
+
+    def end_request(self, started):
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.requests += 1
+            self.transfer_time += max(0.0, elapsed - getattr(self.local, 'connect_time', 0.0))
+
+    def reuse_ratio(self):
+        """Share of requests that were sent over an already open connection."""
+        if not self.requests:
+            return 0.0
+        return max(0.0, 1 - self.connections / self.requests)
+
+    def summary(self):
+        return (f"{self.requests} requests over {self.connections} new connections "
+                f"(reuse ratio {self.reuse_ratio():.0%}), "
+                f"{self.connect_time:.2f}s connecting, {self.transfer_time:.2f}s in transfer")
+
+
+def timed_connection_class(base, stats):
+    class TimedConnection(base):
+        def connect(self):
+            start = time.perf_counter()
+            try:
+                return super().connect()
+            finally:
+                stats.record_connect(time.perf_counter() - start)
+
+    return TimedConnection
+
+
+class InstrumentedAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose pools open connections through timed connection classes
+    and that applies a default timeout.
+    """
+
+    def __init__(self, stats, timeout, **kwargs):
+        self.stats = stats
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        http_pool = type('TimedHTTPConnectionPool', (HTTPConnectionPool,), {
+            'ConnectionCls': timed_connection_class(HTTPConnection, self.stats),
+        })
+        https_pool = type('TimedHTTPSConnectionPool', (HTTPSConnectionPool,), {
+            'ConnectionCls': timed_connection_class(HTTPSConnection, self.stats),
+        })
+        self.poolmanager.pool_classes_by_scheme = {'http': http_pool, 'https': https_pool}
+
+    def send(self, request, timeout=None, **kwargs):
+        return super().send(request, timeout=self.timeout if timeout is None else timeout, **kwargs)
+
+
+class InstrumentedSession(requests.Session):
+    def __init__(self, stats):
+        super().__init__()
+        self.stats = stats
+
+    def send(self, request, **kwargs):
+        started = self.stats.start_request()
+        try:
+            # The body is read here unless stream=True, so it counts as transfer
+            return super().send(request, **kwargs)
+        finally:
+            self.stats.end_request(started)
+
+
+def create_session(pool_maxsize=HTTP_POOL_MAXSIZE, pool_connections=HTTP_POOL_CONNECTIONS,
+                   pool_block=HTTP_POOL_BLOCK, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT),
+                   max_retries=HTTP_MAX_RETRIES, backoff_factor=HTTP_RETRY_BACKOFF):
+    """
+    Returns a requests.Session that keeps connections alive per host, retries
+    idempotent requests and records connection statistics in session.stats.
+    One session is meant to be shared by all threads of a service.
+    """
+    stats = ConnectionStats()
+    retries = Retry(
+        total=max_retries,
+        connect=max_retries,
+        read=max_retries,
+        status=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,  # never re-sends POST after the request went out
+        raise_on_status=False,
+    )
+    adapter = InstrumentedAdapter(stats, timeout, pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                                  pool_block=pool_block, max_retries=retries)
+    session = InstrumentedSession(stats)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
@@ -0,0 +1,146 @@
+import decimal
+import gzip
+import json
+import os
+
+from flask import current_app, request
+
+# Response encoding chosen from the Accept and Accept-Encoding headers. The
+# encoders below are optional: each format is only offered when its package
+# is installed, and JSON falls back to the standard library.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+NDJSON = 'application/x-ndjson'
+
+# Bodies smaller than this are sent uncompressed
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5  # the default of 11 is far too slow for responses
+ZSTD_LEVEL = 3
+
+
+def _default(value):
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps_json(data):
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, default=_default, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass  # ints wider than 64 bits, which the standard library still encodes
+    return json.dumps(data, default=_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def dumps_msgpack(data):
+    return msgpack.packb(data, use_bin_type=True, default=_default)
+
+
+def dumps_ndjson(items):
+    return b''.join(dumps_json(item) + b'\n' for item in items)
+
+
+def _compress_gzip(body):
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def _compress_brotli(body):
+    return brotli.compress(body, quality=BROTLI_QUALITY)
+
+
+def _compress_zstd(body):
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+
+
+# Server preference when the client accepts several with the same quality
+COMPRESSORS = {}
+if zstandard is not None:
+    COMPRESSORS['zstd'] = _compress_zstd
+if brotli is not None:
+    COMPRESSORS['br'] = _compress_brotli
+COMPRESSORS['gzip'] = _compress_gzip
+
+
+def _list_items(data):
+    """
+    The items of a list response: a list, or the 'data' list of a page with
+    a 'next_cursor'. Returns (items, next_cursor) or None.
+    """
+    if isinstance(data, list):
+        return data, None
+    if isinstance(data, dict) and isinstance(data.get('data'), list) and set(data) <= {'data', 'next_cursor'}:
+        return data['data'], data.get('next_cursor')
+    return None
+
+
+def respond(data):
+    """
+    Drop-in replacement for jsonify(data): encodes data as JSON, MessagePack
+    or, for lists, NDJSON according to the Accept header. The cursor of an
+    NDJSON page is sent in the X-Next-Cursor header.
+    """
+    list_items = _list_items(data)
+    offers = [JSON]
+    if msgpack is not None:
+        offers.append(MSGPACK)
+    if list_items is not None:
+        offers.append(NDJSON)
+    mimetype = request.accept_mimetypes.best_match(offers, default=JSON)
+
+    headers = {}
+    if mimetype == MSGPACK:
+        body = dumps_msgpack(data)
+    elif mimetype == NDJSON:
+        items, next_cursor = list_items
+        body = dumps_ndjson(items)
+        if next_cursor:
+            headers['X-Next-Cursor'] = next_cursor
+    else:
+        body = dumps_json(data)
+    response = current_app.response_class(body, mimetype=mimetype, headers=headers)
+    response.vary.update(('Accept', 'Accept-Encoding'))
+    return response
+
+
+def compress_response(response):
+    """
+    after_request hook: compresses buffered responses of at least
+    COMPRESS_MIN_SIZE bytes with the best encoding the client accepts.
+    """
+    if (response.direct_passthrough or response.is_streamed or 'Content-Encoding' in response.headers
+            or response.status_code < 200 or response.status_code in (204, 304)):
+        return response
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+    encoding = request.accept_encodings.best_match(list(COMPRESSORS))
+    if encoding is None:
+        return response
+
+    response.set_data(COMPRESSORS[encoding](body))
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def init_app(app):
+    app.after_request(compress_response)
@@ -1,22 +1,31 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request
 import xml.etree.ElementTree as ET
+from common.negotiation import init_app, msgpack, respond
 
 app = Flask(__name__)
+# Replies are JSON or MessagePack by Accept header, compressed by Accept-Encoding
+init_app(app)
 
 @app.route('/upload', methods=['POST'])
 def upload_data():
     if request.content_type == 'application/json':
         data = request.json
-        return jsonify({"status": "success", "message": "JSON received", "data": data}), 200
+        return respond({"status": "success", "message": "JSON received", "data": data}), 200
     elif request.content_type == 'application/xml':
         try:
             xml_data = ET.fromstring(request.data)
             data_dict = {child.tag: child.text for child in xml_data}
-            return jsonify({"status": "success", "message": "XML received", "data": data_dict}), 200
+            return respond({"status": "success", "message": "XML received", "data": data_dict}), 200
         except ET.ParseError:
-            return jsonify({"status": "error", "message": "Invalid XML"}), 400
+            return respond({"status": "error", "message": "Invalid XML"}), 400
+    elif request.content_type == 'application/msgpack' and msgpack is not None:
+        try:
+            data = msgpack.unpackb(request.data, raw=False)
+            return respond({"status": "success", "message": "MessagePack received", "data": data}), 200
+        except (ValueError, msgpack.UnpackException):
+            return respond({"status": "error", "message": "Invalid MessagePack"}), 400
     else:
-        return jsonify({"status": "error", "message": "Unsupported content type"}), 400
+        return respond({"status": "error", "message": "Unsupported content type"}), 400
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=8000)